@@ -1,25 +1,67 @@
+from django import forms
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import Product,AppUser,Code,Gift,Message,Transaction,Facture,Category
+from django.contrib.auth.forms import UserChangeForm,UserCreationForm
+from .models import Product,AppUser,Code,Gift,Message,Transaction,Facture,Category,PointsLedger
+from . import ledger
+from .ledger import with_balance
 # Register your models here.
 
+class PointsAdjustmentForm(forms.Form):
+    # AppUser.points is only the ledger snapshot: points change through an ADJUST entry instead
+    adjust_points = forms.IntegerField(
+        required=False, label='Adjust points',
+        help_text='Points to add, or to remove with a negative number. Recorded in the points ledger.',
+    )
+
+    def clean_adjust_points(self):
+        delta = self.cleaned_data.get('adjust_points') or 0
+        if getattr(self.instance, 'balance', 0) + delta < 0:
+            raise forms.ValidationError('The balance cannot go below zero.')
+        return delta
+
+
+class AppUserChangeForm(PointsAdjustmentForm, UserChangeForm):
+    pass
+
+
+class AppUserCreationForm(PointsAdjustmentForm, UserCreationForm):
+    pass
+
+
 class AppUserAdmin(UserAdmin):
     model = AppUser
-    list_display = ('username', 'email', 'points', 'is_active',)
+    form = AppUserChangeForm
+    add_form = AppUserCreationForm
+    list_display = ('username', 'email', 'balance', 'is_active',)
     list_filter = ('is_active',)
+    readonly_fields = ('balance',)
     fieldsets = (
-        (None, {'fields': ('username', 'email', 'password', 'points')}),
+        (None, {'fields': ('username', 'email', 'password', 'balance', 'adjust_points')}),
         ('Permissions', {'fields': ('is_active',)}),
     )
     add_fieldsets = (
         (None, {
             'classes': ('wide',),
-            'fields': ('username', 'email', 'password1', 'password2', 'points', 'is_active')}
+            'fields': ('username', 'email', 'password1', 'password2', 'adjust_points', 'is_active')}
         ),
     )
     search_fields = ('username', 'email',)
     ordering = ('username',)
 
+    def get_queryset(self, request):
+        return with_balance(super().get_queryset(request))
+
+    @admin.display(description='Points', ordering='balance')
+    def balance(self, obj):
+        return obj.balance
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        delta = form.cleaned_data.get('adjust_points')
+        if delta:
+            ledger.credit([ledger.entry(obj.pk, delta, PointsLedger.ADJUST, f'admin:{request.user.pk}')])
+
 admin.site.register(AppUser, AppUserAdmin)
 admin.site.register(Product)
 admin.site.register(Code)
@@ -28,4 +70,5 @@ admin.site.register(Message)
 admin.site.register(Transaction)
 admin.site.register(Facture)
 admin.site.register(Category)
+admin.site.register(PointsLedger)
 
@@ -1,5 +1,22 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+
 
 class CaisseappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'caisseApp'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .metrics import install_query_wrapper
+        post_migrate.connect(_ensure_search_index, sender=self)
+        connection_created.connect(install_query_wrapper)
+
+
+def _ensure_search_index(using, **kwargs):
+    from django.db import router
+    from .search import ensure_index
+    # Replicas have no tables of their own to index: they copy the primary's, index included
+    if router.allow_migrate(using, CaisseappConfig.name):
+        ensure_index(using)
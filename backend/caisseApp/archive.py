@@ -0,0 +1,156 @@
+"""
+Hot/cold storage of factures.
+
+`archive_chunk` moves the oldest factures, with their Transaction rows and
+through-rows, into ArchivedFacture: one row per facture with its lines packed
+as compressed JSON, and only the (user, date, id) index. The hot tables then
+hold recent sales only and their indexes stay small enough to live in the
+page cache. Each chunk moves in its own transaction, so archiving can be
+stopped at any point and resumed by running it again.
+
+Reads still find archived factures: `find` falls back to the archive for a
+single facture, and `paginate_with_archive` continues a history listing into
+the archive where the hot rows end. Archived factures no longer deduplicate
+batch uploads by idempotency key; no terminal resends a basket that old.
+"""
+import json
+import zlib
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import ArchivedFacture,Facture,Transaction
+from .pagination import KeysetPage,decode_cursor,encode_cursor,paginate
+
+
+CHUNK_SIZE = 500
+
+
+def cutoff(days=None):
+    """
+    The date before which factures are archived.
+    """
+    return timezone.now() - timedelta(days=settings.ARCHIVE_AFTER_DAYS if days is None else days)
+
+
+def pack_lines(lines):
+    """
+    Compress (product ID, product name, image name, unit price, quantity, line total) tuples.
+    """
+    return zlib.compress(json.dumps(lines, separators=(',', ':')).encode())
+
+
+def unpack_lines(blob):
+    return [tuple(line) for line in json.loads(zlib.decompress(bytes(blob)))]
+
+
+def archive_chunk(before, chunk_size=CHUNK_SIZE):
+    """
+    Move the oldest factures dated before `before`, at most `chunk_size` of them, to the archive.
+
+    Returns:
+    int: The number of factures moved; 0 once none is left.
+    """
+    with transaction.atomic():
+        ids = list(Facture.objects.filter(date__lt=before).order_by('date', 'id')
+                   .values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return 0
+        Through = Facture.transactionIds.through
+        lines = {pk: [] for pk in ids}
+        for facture_id, *line in Through.objects.filter(facture_id__in=ids).order_by('transaction_id').values_list(
+                'facture_id', 'transaction__productId', 'transaction__productId__name',
+                'transaction__productId__image', 'transaction__unit_price', 'transaction__quantity',
+                'transaction__line_total'):
+            lines[facture_id].append(line)
+        ArchivedFacture.objects.bulk_create([
+            ArchivedFacture(id=f.id, userId_id=f.userId_id, date=f.date, total_cost=f.total_cost,
+                            item_count=f.item_count, points_awarded=f.points_awarded,
+                            idempotency_key=f.idempotency_key, lines=pack_lines(lines[f.id]))
+            for f in Facture.objects.filter(pk__in=ids)
+        ])
+        # Deleting the lines takes their through-rows with them
+        Transaction.objects.filter(facture__in=ids).delete()
+        Facture.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+class ArchivedLine:
+    """
+    A line of an archived facture, with the attributes the facture template reads from a Transaction.
+    """
+    def __init__(self, product_id, name, image, unit_price, quantity, line_total):
+        self.productId = ArchivedProduct(product_id, name, image)
+        self.unit_price = unit_price
+        self.quantity = quantity
+        self.line_total = line_total
+
+
+class ArchivedProduct:
+    def __init__(self, id, name, image):
+        self.id = self.pk = id
+        self.name = name
+        self.image = image
+
+
+def find(facture_id):
+    """
+    Return a facture and its lines from the hot tables, else from the archive.
+
+    Returns:
+    tuple: (facture, lines), or None if the facture exists in neither.
+    """
+    facture = Facture.objects.select_related('userId').filter(pk=facture_id).first()
+    if facture is not None:
+        return facture, facture.transactionIds.select_related('productId')
+    archived = ArchivedFacture.objects.select_related('userId').filter(pk=facture_id).first()
+    if archived is None:
+        return None
+    return archived, [ArchivedLine(*line) for line in unpack_lines(archived.lines)]
+
+
+def paginate_with_archive(hot, archived, cursor=None, page_size=None):
+    """
+    Paginate hot rows and archived rows newest-first as a single listing.
+
+    Archiving always moves the oldest factures, so every archived row is older
+    than every hot one: the archive simply continues the listing. A page reads
+    the side its cursor points into, and the other side only to fill a page
+    that crosses the boundary.
+
+    Parameters:
+    hot (QuerySet): The rows still in the hot table.
+    archived (QuerySet): The matching rows of the archive.
+    cursor (str): An opaque cursor from a previous page, or None for the newest page.
+    page_size (int): The number of rows per page.
+
+    Returns:
+    KeysetPage: The rows of the page and the cursors around it.
+    """
+    position = decode_cursor(cursor)
+    forward = position is None or position[2] == 'next'
+    # Walking towards older rows starts in the hot table, towards newer ones in the archive
+    near, far = (hot, archived) if forward else (archived, hot)
+    page = paginate(near, cursor, page_size)
+    if (page.next if forward else page.prev) is not None:
+        return page
+
+    remaining = page_size - len(page)
+    if page.items:
+        boundary = encode_cursor(page.items[-1] if forward else page.items[0], 'next' if forward else 'prev')
+    else:
+        boundary = cursor
+    if remaining:
+        rest = paginate(far, boundary, remaining)
+        more = (rest.next if forward else rest.prev) is not None
+    else:
+        rest = KeysetPage([])
+        more = far.exists()
+
+    if forward:
+        items = page.items + rest.items
+        return KeysetPage(items, next=encode_cursor(items[-1], 'next') if more else None,
+                          prev=page.prev if page.items else rest.prev)
+    items = rest.items + page.items
+    return KeysetPage(items, prev=encode_cursor(items[0], 'prev') if more else None,
+                      next=page.next if page.items else rest.next)
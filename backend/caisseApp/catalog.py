@@ -0,0 +1,78 @@
+import hashlib
+import json
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse,HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from .routing import reading_from_primary
+
+
+VERSION_KEY = 'catalog:version'
+PAYLOAD_TIMEOUT = 24 * 60 * 60
+
+
+def catalog_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def bump_catalog_version():
+    """
+    Invalidate every cached catalog payload.
+
+    Called from the Product, Category and Gift signals, and once at the end of
+    bulk operations that bypass them.
+    """
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, None)
+
+
+def cached_payload(name, build):
+    """
+    Return the pre-encoded JSON body of a catalog endpoint and its strong ETag.
+
+    The body is built with `build()` only when the catalog version has changed
+    since it was last cached, and from the primary: a replica that has not yet
+    caught up with the change that bumped the version would leave a stale body
+    cached under the new version. The ETag is a hash of the body itself, so a reset
+    version counter can never make a stale client copy look current.
+
+    Parameters:
+    name (str): The endpoint name, part of the cache key.
+    build (callable): Returns the response data as a JSON-serializable object.
+
+    Returns:
+    tuple: (body bytes, ETag header value).
+    """
+    key = f'catalog:{name}:{catalog_version()}'
+    entry = cache.get(key)
+    if entry is None:
+        with reading_from_primary():
+            body = json.dumps(build(), cls=DjangoJSONEncoder).encode()
+        entry = (body, '"%s"' % hashlib.sha256(body).hexdigest()[:32])
+        cache.set(key, entry, PAYLOAD_TIMEOUT)
+    return entry
+
+
+def catalog_response(request, name, build):
+    """
+    Serve a catalog endpoint from the cache, answering 304 when the client copy is current.
+    """
+    body, etag = cached_payload(name, build)
+    if _matches(request.headers.get('If-None-Match', ''), etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _matches(header, etag):
+    tags = {tag.strip() for tag in header.split(',')}
+    return etag in tags or '*' in tags
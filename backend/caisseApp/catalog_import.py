@@ -0,0 +1,242 @@
+"""
+Bulk catalog import from a supplier CSV and an optional zip of images.
+
+Rows upsert categories by name, products by SKU and gifts by product, with
+bulk_create/bulk_update in a single transaction instead of a form save per
+item. Every row is checked first. A row that fails is reported with its line
+number and left out, and the rest of the file is still imported.
+
+Bulk writes send no model signals, so the catalog is invalidated once after
+the commit, and the new images get their variants built together afterwards.
+
+Columns (header row required, any order):
+    sku          the product's natural key; required
+    name, price, description, category, image
+                 blank cells keep the current value; a new product needs
+                 name, price, category and image
+    image        a file name inside the zip
+    gift_points  create or update the product's gift at this point cost
+"""
+import csv
+import io
+import os
+import zipfile
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image
+from .catalog import bump_catalog_version
+from .models import Category,Gift,Product
+
+
+BATCH_SIZE = 500
+# Stay under SQLite's limit on bound parameters when looking rows up
+LOOKUP_CHUNK = 900
+PRODUCT_FIELDS = ('name', 'price', 'description', 'sku')
+REQUIRED_FOR_NEW = ('name', 'price', 'category', 'image')
+
+
+class CatalogImportError(Exception):
+    """
+    The file as a whole cannot be imported: no sku column, or an unreadable zip.
+    """
+
+
+class ImportReport:
+    """
+    The outcome of an import: counts per model, and the rows left out with why.
+    """
+    def __init__(self):
+        self.rows = 0
+        self.created = {'category': 0, 'product': 0, 'gift': 0}
+        self.updated = {'product': 0, 'gift': 0}
+        self.errors = []
+        # Products whose image changed, for the variant builder
+        self.new_images = []
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+    @property
+    def imported(self):
+        return self.rows - len(self.errors)
+
+
+def import_catalog(rows, images=None):
+    """
+    Upsert the catalog from CSV rows.
+
+    Parameters:
+    rows (iterable): Lines of CSV text, such as a file opened in text mode.
+    images (file): An optional zip archive holding the images the rows name.
+
+    Returns:
+    ImportReport: What was created and updated, and the rows that were rejected.
+
+    Raises:
+    CatalogImportError: If the file has no sku column or the archive is not a zip.
+    """
+    report = ImportReport()
+    reader = csv.DictReader(rows)
+    if 'sku' not in (reader.fieldnames or ()):
+        raise CatalogImportError('The CSV needs a header row with a sku column.')
+    try:
+        archive = zipfile.ZipFile(images) if images is not None else None
+    except zipfile.BadZipFile:
+        raise CatalogImportError('The image archive is not a zip file.')
+
+    cleaned = {}
+    for raw in reader:
+        report.rows += 1
+        line = reader.line_num
+        try:
+            row = _clean(raw)
+        except ValidationError as e:
+            report.error(line, '; '.join(e.messages))
+            continue
+        if row['sku'] in cleaned:
+            report.error(line, f"SKU {row['sku']} already appears on line {cleaned[row['sku']][0]}.")
+            continue
+        cleaned[row['sku']] = (line, row)
+
+    existing = _in_chunks(Product.objects.all(), 'sku', list(cleaned))
+    existing = {product.sku: product for product in existing}
+    valid = []
+    # Archive member -> stored name, so an image shared by many rows is checked and hashed once
+    stored = {}
+    for sku, (line, row) in cleaned.items():
+        missing = [column for column in REQUIRED_FOR_NEW if sku not in existing and row.get(column) is None]
+        if missing:
+            report.error(line, f"A new product needs {', '.join(missing)}.")
+            continue
+        if row.get('image') is not None:
+            try:
+                if row['image'] not in stored:
+                    stored[row['image']] = _store_image(archive, row['image'])
+                row['image'] = stored[row['image']]
+            except ValueError as e:
+                report.error(line, str(e))
+                continue
+        valid.append(row)
+
+    with transaction.atomic():
+        categories = _upsert_categories({row['category'] for row in valid if row.get('category')}, report)
+        products = _upsert_products(valid, existing, categories, report)
+        _upsert_gifts({products[row['sku']].pk: row['gift_points'] for row in valid
+                       if row.get('gift_points') is not None}, report)
+        if any(report.created.values()) or any(report.updated.values()):
+            transaction.on_commit(bump_catalog_version)
+    report.errors.sort()
+    return report
+
+
+def _clean(raw):
+    # Blank cells are left out, so they keep the current value of an existing product
+    row = {}
+    errors = []
+    for column, field in [*((name, Product._meta.get_field(name)) for name in PRODUCT_FIELDS),
+                          ('category', Category._meta.get_field('name')),
+                          ('gift_points', Gift._meta.get_field('pointCost'))]:
+        value = (raw.get(column) or '').strip()
+        if not value:
+            continue
+        try:
+            row[column] = field.clean(value, None)
+        except ValidationError as e:
+            errors.append(f"{column}: {' '.join(e.messages)}")
+    image = (raw.get('image') or '').strip()
+    if image:
+        row['image'] = image
+    if not (raw.get('sku') or '').strip():
+        errors.insert(0, 'sku: This field is required.')
+    if errors:
+        raise ValidationError(errors)
+    return row
+
+
+def _store_image(archive, name):
+    """
+    Check that the archive holds a readable image `name` and store it; returns the stored name.
+    """
+    if archive is None:
+        raise ValueError(f"image: {name} needs an image archive.")
+    try:
+        data = archive.read(name)
+    except KeyError:
+        raise ValueError(f"image: {name} is not in the archive.")
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+    except Exception:
+        raise ValueError(f"image: {name} is not a valid image.")
+    field = Product._meta.get_field('image')
+    # Content-addressed: an image that is already stored is not written again
+    return field.storage.save(field.generate_filename(None, os.path.basename(name)), ContentFile(data))
+
+
+def _in_chunks(queryset, field, values):
+    found = []
+    for start in range(0, len(values), LOOKUP_CHUNK):
+        found.extend(queryset.filter(**{f'{field}__in': values[start:start + LOOKUP_CHUNK]}))
+    return found
+
+
+def _upsert_categories(names, report):
+    # Category names are not unique in the schema; the oldest category of a name is the one used
+    categories = {}
+    for category in sorted(_in_chunks(Category.objects.all(), 'name', list(names)), key=lambda c: c.pk):
+        categories.setdefault(category.name, category)
+    new = Category.objects.bulk_create([Category(name=name) for name in sorted(names - set(categories))],
+                                       batch_size=BATCH_SIZE)
+    report.created['category'] += len(new)
+    categories.update((category.name, category) for category in new)
+    return categories
+
+
+def _upsert_products(rows, existing, categories, report):
+    products = dict(existing)
+    new, changed, fields = [], [], set()
+    for row in rows:
+        values = {name: row[name] for name in (*PRODUCT_FIELDS, 'image') if name in row}
+        if 'category' in row:
+            values['category_id'] = categories[row['category']].pk
+        product = existing.get(row['sku'])
+        if product is None:
+            product = products[row['sku']] = Product(**{'description': '', **values})
+            new.append(product)
+            continue
+        updates = {name: value for name, value in values.items() if _current(product, name) != value}
+        if updates:
+            for name, value in updates.items():
+                setattr(product, name, value)
+            changed.append(product)
+            fields.update('category' if name == 'category_id' else name for name in updates)
+            if 'image' in updates:
+                report.new_images.append(product.pk)
+    Product.objects.bulk_create(new, batch_size=BATCH_SIZE)
+    if changed:
+        Product.objects.bulk_update(changed, sorted(fields), batch_size=BATCH_SIZE)
+    report.created['product'] += len(new)
+    report.updated['product'] += len(changed)
+    report.new_images.extend(product.pk for product in new)
+    return products
+
+
+def _current(product, name):
+    return product.image.name if name == 'image' else getattr(product, name)
+
+
+def _upsert_gifts(points, report):
+    # A product may have several gifts; the import manages the oldest one
+    gifts = {}
+    for gift in sorted(_in_chunks(Gift.objects.all(), 'productId', list(points)), key=lambda g: g.pk):
+        gifts.setdefault(gift.productId_id, gift)
+    changed = [gift for product_id, gift in gifts.items() if gift.pointCost != points[product_id]]
+    for gift in changed:
+        gift.pointCost = points[gift.productId_id]
+    Gift.objects.bulk_update(changed, ['pointCost'], batch_size=BATCH_SIZE)
+    new = Gift.objects.bulk_create([Gift(productId_id=product_id, pointCost=cost)
+                                    for product_id, cost in points.items() if product_id not in gifts],
+                                   batch_size=BATCH_SIZE)
+    report.created['gift'] += len(new)
+    report.updated['gift'] += len(changed)
@@ -0,0 +1,224 @@
+from collections import defaultdict
+from django.db import IntegrityError,transaction
+from django.utils import timezone
+from . import ledger,rollups
+from .retry import retry_when_locked
+from .models import Product,AppUser,Transaction,Facture,PointsLedger
+
+
+POINTS_DIVISOR = 50
+
+
+def parse_basket(post):
+    """
+    Read the selected products and their quantities from a caisse form POST.
+
+    Parameters:
+    post (QueryDict): The submitted form data.
+
+    Returns:
+    dict: A mapping of product ID to quantity, in the order the products were selected.
+    """
+    basket = {}
+    for productId in post.getlist('products'):
+        try:
+            pk = int(productId)
+        except (TypeError, ValueError):
+            continue
+        quantity = int(post.get(f"quantity_{pk}", 1) or 1)
+        if quantity > 0:
+            basket[pk] = quantity
+    return basket
+
+
+@retry_when_locked
+def checkout(user, basket):
+    """
+    Record a sale for a user in a fixed number of queries.
+
+    Only the selected products are loaded. The facture, its lines and the
+    ManyToMany through-rows are inserted in bulk inside one atomic block, and
+    the points are credited with a ledger insert, so concurrent checkouts for
+    the same user never contend on the user row. Each line keeps the unit price
+    it was sold at, the facture keeps its total, item count and points, and the
+    daily sales rollups are updated in the same transaction.
+
+    Parameters:
+    user (AppUser): The customer being billed.
+    basket (dict): A mapping of product ID to quantity.
+
+    Returns:
+    Facture: The saved facture.
+    """
+    products = load_products(basket)
+    with transaction.atomic():
+        return record_sales([Sale(user.pk, basket)], products)[0]
+
+
+class Sale:
+    """
+    One basket to bill: a customer, a mapping of product ID to quantity, and an optional idempotency key.
+    """
+    def __init__(self, user_id, basket, key=None):
+        self.user_id = user_id
+        self.basket = basket
+        self.key = key
+
+
+def load_products(pks):
+    """
+    Return the (price, category ID) of the given products, by product ID, in one query.
+    """
+    return {pk: (price, category) for pk, price, category in
+            Product.objects.filter(pk__in=list(pks)).values_list('id', 'price', 'category')}
+
+
+def record_sales(sales, products):
+    """
+    Insert any number of sales with one bulk insert per table.
+
+    Must run inside a transaction. Products missing from `products` are left
+    out of their basket.
+
+    Parameters:
+    sales (list): The Sale objects to record.
+    products (dict): The (price, category ID) of every product of the baskets, by product ID, from load_products.
+
+    Returns:
+    list: The saved factures, in the order of `sales`.
+    """
+    factures = []
+    lines = []
+    for sale in sales:
+        sale_lines = [
+            Transaction(productId_id=pk, quantity=quantity, unit_price=products[pk][0], line_total=products[pk][0] * quantity)
+            for pk, quantity in sale.basket.items() if pk in products
+        ]
+        total = sum(line.line_total for line in sale_lines)
+        factures.append(Facture(userId_id=sale.user_id, idempotency_key=sale.key, total_cost=total,
+                                item_count=sum(line.quantity for line in sale_lines),
+                                points_awarded=int(total // POINTS_DIVISOR)))
+        lines.append(sale_lines)
+
+    Facture.objects.bulk_create(factures)
+    Transaction.objects.bulk_create([line for sale_lines in lines for line in sale_lines])
+    Through = Facture.transactionIds.through
+    Through.objects.bulk_create([
+        Through(facture_id=fac.id, transaction_id=line.id)
+        for fac, sale_lines in zip(factures, lines) for line in sale_lines
+    ])
+    ledger.credit([
+        ledger.entry(fac.userId_id, fac.points_awarded, PointsLedger.EARN, f'facture:{fac.id}')
+        for fac in factures if fac.points_awarded
+    ])
+    days = defaultdict(list)
+    for fac, sale_lines in zip(factures, lines):
+        days[timezone.localdate(fac.date)].extend(
+            (line.productId_id, products[line.productId_id][1], line.quantity, line.line_total) for line in sale_lines)
+    for day, day_lines in days.items():
+        rollups.record(day, day_lines)
+    return factures
+
+
+MAX_BATCH = 500
+
+
+class BasketError(Exception):
+    pass
+
+
+@retry_when_locked
+def checkout_batch(baskets):
+    """
+    Settle a batch of baskets from a POS terminal in one transaction.
+
+    Each basket is a dict with a client-generated `key`, a `userId` and a list
+    of `lines` ({"productId", "quantity"}). Keys that were already recorded,
+    by an earlier upload or earlier in the same batch, are reported as
+    duplicates and not billed again. An invalid basket is reported on its own
+    and does not stop the others, nor keep a later basket with its key from
+    being billed.
+
+    Parameters:
+    baskets (list): The baskets, as decoded from the request JSON.
+
+    Returns:
+    list: One result dict per basket, in the same order.
+    """
+    try:
+        with transaction.atomic():
+            return _checkout_batch(baskets)
+    except IntegrityError:
+        # A concurrent upload recorded one of our keys first: the retry reports it as a duplicate
+        with transaction.atomic():
+            return _checkout_batch(baskets)
+
+
+def _checkout_batch(baskets):
+    results = [None] * len(baskets)
+    parsed = {}
+    for i, basket in enumerate(baskets):
+        try:
+            parsed[i] = _parse_basket_json(basket)
+        except BasketError as e:
+            results[i] = {'key': basket.get('key') if isinstance(basket, dict) else None, 'status': 'error', 'message': str(e)}
+
+    keys = [key for key, _, _ in parsed.values()]
+    recorded = {
+        row['idempotency_key']: row
+        for row in Facture.objects.filter(idempotency_key__in=keys).values(
+            'idempotency_key', 'id', 'total_cost', 'points_awarded')
+    }
+    users = set(AppUser.objects.filter(pk__in={user for _, user, _ in parsed.values()}).values_list('pk', flat=True))
+    products = load_products({pk for _, _, basket in parsed.values() for pk in basket})
+
+    sales = {}
+    # Key -> the basket that bills it; a rejected basket does not claim its key
+    accepted = {}
+    repeats = []
+    for i, (key, user_id, basket) in parsed.items():
+        if key in recorded:
+            row = recorded[key]
+            results[i] = {'key': key, 'status': 'duplicate', 'factureId': row['id'],
+                          'totalCost': row['total_cost'], 'pointsAwarded': row['points_awarded']}
+        elif key in accepted:
+            repeats.append((i, accepted[key]))
+        elif user_id not in users:
+            results[i] = {'key': key, 'status': 'error', 'message': 'AppUser does not exist!'}
+        elif any(pk not in products for pk in basket):
+            results[i] = {'key': key, 'status': 'error', 'message': 'Unknown product in basket.'}
+        else:
+            sales[i] = Sale(user_id, basket, key)
+            accepted[key] = i
+
+    factures = record_sales(list(sales.values()), products)
+    for i, fac in zip(sales, factures):
+        results[i] = {
+            'key': fac.idempotency_key, 'status': 'created', 'factureId': fac.id,
+            'totalCost': fac.total_cost, 'pointsAwarded': fac.points_awarded,
+        }
+    for i, first in repeats:
+        # Repeats inside the batch point at the facture created for the first occurrence
+        results[i] = {**results[first], 'status': 'duplicate'}
+    return results
+
+
+def _parse_basket_json(basket):
+    if not isinstance(basket, dict):
+        raise BasketError('Basket must be an object.')
+    key = basket.get('key')
+    if not isinstance(key, str) or not 0 < len(key) <= 64:
+        raise BasketError('Basket needs a key of 1 to 64 characters.')
+    try:
+        user_id = int(basket['userId'])
+        items = {}
+        for line in basket['lines']:
+            pk, quantity = int(line['productId']), int(line.get('quantity', 1))
+            if quantity <= 0:
+                raise BasketError('Quantities must be positive.')
+            items[pk] = items.get(pk, 0) + quantity
+    except (KeyError, TypeError, ValueError):
+        raise BasketError('Basket needs a userId and a list of lines with productId and quantity.')
+    if not items:
+        raise BasketError('Basket is empty.')
+    return key, user_id, items
@@ -0,0 +1,146 @@
+import time
+from django.db import IntegrityError,transaction
+from . import ledger
+from .retry import retry_when_locked
+from .models import Code,Gift
+
+
+BATCH_SIZE = 5000
+# Stay under SQLite's limit on bound parameters when looking candidates up
+LOOKUP_CHUNK = 900
+
+
+class RedemptionError(Exception):
+    pass
+
+
+class MintReport:
+    """
+    The outcome of a bulk minting run.
+    """
+    def __init__(self, cids, collisions, seconds):
+        self.cids = cids
+        self.collisions = collisions
+        self.seconds = seconds
+
+    @property
+    def count(self):
+        return len(self.cids)
+
+    @property
+    def rate(self):
+        return self.count / self.seconds if self.seconds else float('inf')
+
+
+def mint_codes(gift_id, user_ids, batch_size=BATCH_SIZE):
+    """
+    Issue one gift code per entry of `user_ids`, in bulk.
+
+    Candidates are drawn a batch at a time and inserted with
+    bulk_create(ignore_conflicts=True). Identifiers that were already taken,
+    whether by an older code or by a concurrent minting run, are found with one
+    lookup per chunk and only those owners get new candidates. There is no
+    per-code existence check and no check-then-insert race.
+
+    Parameters:
+    gift_id (int): The gift the codes redeem.
+    user_ids (list): The owner of each code; repeat an id to give a user several codes.
+    batch_size (int): The number of codes inserted per round-trip batch.
+
+    Returns:
+    MintReport: The issued identifiers, in the order of `user_ids`, and timing.
+    """
+    started = time.perf_counter()
+    cids = [None] * len(user_ids)
+    collisions = 0
+    for start in range(0, len(user_ids), batch_size):
+        pending = list(range(start, min(start + batch_size, len(user_ids))))
+        while pending:
+            candidates = dict(zip(Code.random_cids(len(pending)), pending))
+            # A candidate drawn twice in the same batch counts as a collision too
+            collisions += len(pending) - len(candidates)
+            with transaction.atomic():
+                Code.objects.bulk_create(
+                    [Code(cid=cid, giftId_id=gift_id, userId_id=user_ids[i]) for cid, i in candidates.items()],
+                    ignore_conflicts=True,
+                )
+            taken = set(candidates) - _owned(candidates, gift_id, user_ids)
+            collisions += len(taken)
+            for cid, i in candidates.items():
+                if cid not in taken:
+                    cids[i] = cid
+            pending = [i for i in pending if cids[i] is None]
+    return MintReport(cids, collisions, time.perf_counter() - started)
+
+
+def _owned(candidates, gift_id, user_ids):
+    """
+    Return the candidates that now exist with the owner and gift they were drawn for.
+    """
+    owned = set()
+    items = list(candidates.items())
+    for start in range(0, len(items), LOOKUP_CHUNK):
+        chunk = dict(items[start:start + LOOKUP_CHUNK])
+        rows = Code.objects.filter(cid__in=list(chunk)).values_list('cid', 'userId', 'giftId')
+        owned.update(cid for cid, user_id, gift in rows if gift == gift_id and user_id == user_ids[chunk[cid]])
+    return owned
+
+
+@retry_when_locked
+def redeem(gift_id, user_id, idempotency_key=None):
+    """
+    Spend a user's points on a gift and issue its code, safely under concurrency.
+
+    The code and the ledger debit are written in one transaction, and
+    ledger.spend rolls both back if the balance would go negative, so two
+    concurrent redemptions can never both spend the same points.
+    A request repeated with the same idempotency key returns the code issued
+    the first time instead of charging again.
+
+    Parameters:
+    gift_id (int): The gift to redeem.
+    user_id (int): The customer spending the points.
+    idempotency_key (str): Optional client-generated key of this redemption.
+
+    Returns:
+    tuple: (code identifier, True if this replays an earlier redemption).
+
+    Raises:
+    RedemptionError: If the gift does not exist, the user has too few points,
+    or the key was already used for another user or gift.
+    """
+    if idempotency_key:
+        replayed = _replay(gift_id, user_id, idempotency_key)
+        if replayed:
+            return replayed, True
+    cost = Gift.objects.filter(pk=gift_id).values_list('pointCost', flat=True).first()
+    if cost is None:
+        raise RedemptionError('Gift does not exist.')
+
+    for attempt in range(Code.MAX_ATTEMPTS):
+        code = Code(cid=Code.random_cids(1)[0], giftId_id=gift_id, userId_id=user_id, idempotency_key=idempotency_key or None)
+        try:
+            with transaction.atomic():
+                code.save(force_insert=True)
+                ledger.spend(user_id, cost, f'code:{code.cid}')
+            return code.cid, False
+        except ledger.InsufficientPoints as e:
+            raise RedemptionError(str(e))
+        except IntegrityError:
+            # Either a concurrent retry with the same key won the race, or the cid collided
+            if idempotency_key:
+                replayed = _replay(gift_id, user_id, idempotency_key)
+                if replayed:
+                    return replayed, True
+            if attempt == Code.MAX_ATTEMPTS - 1:
+                raise
+
+
+def _replay(gift_id, user_id, idempotency_key):
+    row = Code.objects.filter(idempotency_key=idempotency_key).values_list('cid', 'giftId', 'userId').first()
+    if row is None:
+        return None
+    cid, gift, user = row
+    if (gift, user) != (gift_id, user_id):
+        raise RedemptionError('Idempotency key already used for another redemption.')
+    return cid
@@ -0,0 +1,166 @@
+"""
+Streaming exports of sales and customers for accounting.
+
+Each dataset is read with server-side `iterator()` cursors and encoded a line
+at a time into buffers of BUFFER_BYTES, optionally gzipped on the fly, so an
+export holds one buffer in memory whether it covers a day or five years.
+Factures include the archived ones (see archive.py), older rows first, and
+the whole export reads a single snapshot of the database, in a read
+transaction that lets checkouts write meanwhile.
+
+Under ASGI, Django would read a synchronous iterator to the end before sending
+anything, so the view hands it `as_async` instead.
+"""
+import csv
+import json
+import zlib
+from datetime import datetime,time,timedelta
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections,router,transaction
+from django.db.models import OuterRef,Q,Subquery,Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .archive import unpack_lines
+from .ledger import with_balance
+from .models import AppUser,ArchivedFacture,Facture,PointsLedger
+
+
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+CHUNK_SIZE = 2000
+BUFFER_BYTES = 64 * 1024
+
+
+def date_range(start=None, end=None):
+    """
+    Turn inclusive dates into a [start, end) pair of aware datetimes; either may be None.
+    """
+    tz = timezone.get_current_timezone()
+    return (
+        datetime.combine(start, time.min, tz) if start else None,
+        datetime.combine(end + timedelta(days=1), time.min, tz) if end else None,
+    )
+
+
+def _window(path, start, end):
+    window = Q()
+    if start is not None:
+        window &= Q(**{f'{path}__gte': start})
+    if end is not None:
+        window &= Q(**{f'{path}__lt': end})
+    return window
+
+
+def facture_rows(start, end, using):
+    columns = ('id', 'date', 'userId', 'userId__username', 'total_cost', 'item_count', 'points_awarded')
+    for model, archived in ((ArchivedFacture, True), (Facture, False)):
+        factures = model.objects.using(using).filter(_window('date', start, end)).order_by('date', 'id')
+        for row in factures.values_list(*columns).iterator(chunk_size=CHUNK_SIZE):
+            yield (*row, archived)
+
+
+def line_rows(start, end, using):
+    archived = (ArchivedFacture.objects.using(using).filter(_window('date', start, end)).order_by('date', 'id')
+                .values_list('id', 'date', 'userId', 'lines'))
+    for facture_id, date, user_id, lines in archived.iterator(chunk_size=CHUNK_SIZE):
+        for product_id, name, _, unit_price, quantity, line_total in unpack_lines(lines):
+            yield facture_id, date, user_id, product_id, name, unit_price, quantity, line_total
+    through = (Facture.transactionIds.through.objects.using(using).filter(_window('facture__date', start, end))
+               .order_by('facture__date', 'facture_id', 'transaction_id'))
+    yield from through.values_list(
+        'facture_id', 'facture__date', 'facture__userId', 'transaction__productId', 'transaction__productId__name',
+        'transaction__unit_price', 'transaction__quantity', 'transaction__line_total',
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+
+def customer_rows(start, end, using):
+    def total(sign):
+        entries = PointsLedger.objects.filter(_window('created', start, end), user=OuterRef('pk'),
+                                              **{f'delta__{sign}': 0})
+        return Coalesce(Subquery(entries.values('user').annotate(total=Sum('delta')).values('total')), 0)
+
+    customers = (with_balance(AppUser.objects.using(using).filter(is_staff=False))
+                 .annotate(earned=total('gt'), spent=total('lt')).order_by('id'))
+    for pk, username, email, is_active, earned, spent, balance in customers.values_list(
+            'id', 'username', 'email', 'is_active', 'earned', 'spent', 'balance').iterator(chunk_size=CHUNK_SIZE):
+        yield pk, username, email, is_active, earned, -spent, balance
+
+
+# Columns of each dataset and the function reading its rows over a [start, end) window
+DATASETS = {
+    'factures': (('facture_id', 'date', 'user_id', 'username', 'total_cost', 'item_count', 'points_awarded',
+                  'archived'), facture_rows),
+    'lines': (('facture_id', 'date', 'user_id', 'product_id', 'product_name', 'unit_price', 'quantity',
+               'line_total'), line_rows),
+    # Points earned and spent within the window, and the balance today
+    'customers': (('user_id', 'username', 'email', 'is_active', 'points_earned', 'points_spent', 'balance'),
+                  customer_rows),
+}
+
+
+class _Echo:
+    # csv.writer target that hands each formatted row back instead of storing it
+    def write(self, value):
+        return value
+
+
+def encode(columns, rows, format):
+    """
+    Yield the header (CSV only) and one text line per row.
+    """
+    if format == 'jsonl':
+        for row in rows:
+            yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n'
+        return
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([value.isoformat() if isinstance(value, datetime) else value for value in row])
+
+
+def _snapshot(using):
+    # A plain atomic block would BEGIN IMMEDIATE on caisseApp.sqlite and hold the
+    # write lock, and so stall every checkout, until the download ends
+    connection = connections[using]
+    if hasattr(connection, 'read_snapshot'):
+        return connection.read_snapshot()
+    return transaction.atomic(using=using)
+
+
+def stream(dataset, format='csv', start=None, end=None, compress=False, using=None):
+    """
+    Yield an export as byte chunks of about BUFFER_BYTES.
+
+    Parameters:
+    dataset (str): One of DATASETS.
+    format (str): One of FORMATS.
+    start (date): First day included, or None for no lower bound.
+    end (date): Last day included, or None for no upper bound.
+    compress (bool): Gzip the output.
+    using (str): The database alias to read, or None to let the router pick.
+    """
+    columns, rows = DATASETS[dataset]
+    using = using or router.db_for_read(Facture)
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+    with _snapshot(using):
+        buffer, size = [], 0
+        for line in encode(columns, rows(*date_range(start, end), using), format):
+            buffer.append(line)
+            size += len(line)
+            if size >= BUFFER_BYTES:
+                data = ''.join(buffer).encode()
+                buffer, size = [], 0
+                data = compressor.compress(data) if compressor else data
+                if data:
+                    yield data
+        data = ''.join(buffer).encode()
+        yield compressor.compress(data) + compressor.flush() if compressor else data
+
+
+async def as_async(chunks):
+    """
+    Iterate a synchronous export from async code, one chunk at a time, in the request's thread.
+    """
+    chunks = iter(chunks)
+    while (chunk := await sync_to_async(next)(chunks, None)) is not None:
+        yield chunk
@@ -4,7 +4,7 @@ from .models import Product,Gift
 class ProductForm(forms.ModelForm):
     class Meta:
         model = Product
-        fields = ['name', 'price', 'category', 'description', 'image']
+        fields = ['name', 'sku', 'price', 'category', 'description', 'image']
         
 
 class GiftForm(forms.ModelForm):
@@ -0,0 +1,131 @@
+"""
+Resized variants of product images.
+
+Every uploaded Product.image gets a thumbnail and a medium rendition, each in
+WebP with a JPEG fallback, stored next to the originals under `variants/`.
+Variant names derive from the original's name, so they need no extra column:
+`Product.variants_for` only records which original the current variants were
+made from, and the API advertises them once it matches `Product.image`.
+"""
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from PIL import Image,ImageOps
+from .catalog import bump_catalog_version
+from .models import Product
+
+
+logger = logging.getLogger(__name__)
+
+# Longest side of each variant, in pixels
+SIZES = {'thumb': 200, 'medium': 800}
+FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}),
+           'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True})}
+VARIANT_DIR = 'variants'
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-variants')
+
+
+def variant_name(name, size, fmt):
+    stem = os.path.splitext(name)[0]
+    return f'{VARIANT_DIR}/{stem}_{size}.{fmt}'
+
+
+def variant_urls(name):
+    """
+    Return the URLs of every variant of the image `name`, by size then format.
+    """
+    return {size: {fmt: default_storage.url(variant_name(name, size, fmt)) for fmt in FORMATS} for size in SIZES}
+
+
+def render_variants(name):
+    """
+    Write every variant of the stored image `name`, replacing older ones.
+
+    Returns:
+    int: The total size of the variants written, in bytes.
+    """
+    with default_storage.open(name) as f:
+        original = ImageOps.exif_transpose(Image.open(f))
+        original = original.convert('RGBA' if original.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    written = 0
+    for size, edge in SIZES.items():
+        image = original.copy()
+        image.thumbnail((edge, edge), Image.LANCZOS)
+        for fmt, (pil_format, options) in FORMATS.items():
+            out = io.BytesIO()
+            # JPEG has no alpha channel: flatten onto white
+            if pil_format == 'JPEG' and image.mode == 'RGBA':
+                flat = Image.new('RGB', image.size, 'white')
+                flat.paste(image, mask=image.getchannel('A'))
+                flat.save(out, pil_format, **options)
+            else:
+                image.save(out, pil_format, **options)
+            target = variant_name(name, size, fmt)
+            # Storage.save never overwrites: it would pick a new name and break the derived URL
+            if default_storage.exists(target):
+                default_storage.delete(target)
+            default_storage.save(target, ContentFile(out.getvalue()))
+            written += out.tell()
+    return written
+
+
+def build_variants(product_id, bump=True):
+    """
+    Render the variants of a product's current image and mark them ready.
+
+    The flag is only set if the product still has the image that was rendered,
+    so a replacement uploaded in the meantime is never advertised with stale
+    variants. Pass bump=False to invalidate the catalog once after a batch instead.
+
+    Returns:
+    int: The bytes written, or 0 if the product has no image to render.
+    """
+    name = Product.objects.filter(pk=product_id).values_list('image', flat=True).first()
+    if not name:
+        return 0
+    written = render_variants(name)
+    if Product.objects.filter(pk=product_id, image=name).update(variants_for=name) and bump:
+        bump_catalog_version()
+    return written
+
+
+def schedule(product_id):
+    """
+    Build a product's variants on a background thread, off the request that saved it.
+    """
+    _executor.submit(_build_in_background, product_id)
+
+
+def schedule_batch(product_ids):
+    """
+    Build the variants of several products on a background thread, invalidating the catalog once at the end.
+    """
+    _executor.submit(_build_batch_in_background, list(product_ids))
+
+
+def _build_in_background(product_id):
+    try:
+        build_variants(product_id)
+    except Exception:
+        logger.exception('Could not build image variants for product %s', product_id)
+    finally:
+        connection.close()
+
+
+def _build_batch_in_background(product_ids):
+    built = False
+    try:
+        for product_id in product_ids:
+            try:
+                built = build_variants(product_id, bump=False) > 0 or built
+            except Exception:
+                logger.exception('Could not build image variants for product %s', product_id)
+        if built:
+            bump_catalog_version()
+    finally:
+        connection.close()
@@ -0,0 +1,108 @@
+"""
+Points accounting.
+
+Every change to a balance is an insert-only, signed PointsLedger entry.
+`AppUser.points` is a materialized snapshot of the balance that includes every
+entry up to `AppUser.points_through`; the live balance is that snapshot plus
+the sum of the few entries after it. Earning points therefore never writes the
+user row, and `compact` periodically folds recent entries into the snapshot
+so the sum stays short.
+"""
+from datetime import timedelta
+from django.db import connection,transaction
+from django.db.models import F,Max,OuterRef,Subquery,Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import AppUser,PointsLedger
+
+
+# Entries younger than this are left out of compaction, so an insert that was
+# still uncommitted when the watermark was taken can never be skipped.
+SETTLE_SECONDS = 60
+
+
+class InsufficientPoints(Exception):
+    pass
+
+
+def with_balance(queryset):
+    """
+    Annotate an AppUser queryset with its live `balance`, in the same query.
+    """
+    pending = (
+        PointsLedger.objects.filter(user=OuterRef('pk'), id__gt=OuterRef('points_through'))
+        .values('user').annotate(total=Sum('delta')).values('total')
+    )
+    return queryset.annotate(balance=F('points') + Coalesce(Subquery(pending), 0))
+
+
+def balance(user_id):
+    """
+    Return a user's live balance, or None if the user does not exist.
+    """
+    return with_balance(AppUser.objects.filter(pk=user_id)).values_list('balance', flat=True).first()
+
+
+def entry(user_id, delta, reason, reference=''):
+    return PointsLedger(user_id=user_id, delta=delta, reason=reason, reference=reference)
+
+
+def credit(entries):
+    """
+    Record earned or adjusted points: a single bulk insert, no row is updated.
+    """
+    PointsLedger.objects.bulk_create(entries)
+
+
+def spend(user_id, amount, reference=''):
+    """
+    Debit `amount` points, failing instead of letting the balance go negative.
+
+    Must run inside a transaction. The debit is written first and the balance
+    checked after it: on SQLite the insert takes the write lock, so no other
+    spend can interleave, and on databases with row locks the user row is
+    locked up front. If the balance would go negative the debit is undone by
+    the surrounding rollback.
+
+    Raises:
+    InsufficientPoints: If the user has fewer than `amount` points.
+    """
+    if connection.features.has_select_for_update:
+        list(AppUser.objects.select_for_update().filter(pk=user_id).values_list('pk'))
+    PointsLedger.objects.create(user_id=user_id, delta=-amount, reason=PointsLedger.SPEND, reference=reference)
+    remaining = balance(user_id)
+    if remaining is None or remaining < 0:
+        raise InsufficientPoints('Not enough points to redeem this gift.')
+    return remaining
+
+
+def compact(chunk_size=1000, settle_seconds=SETTLE_SECONDS):
+    """
+    Fold settled ledger entries into the users' balance snapshots.
+
+    Users are processed in chunks, each in its own short transaction. Every
+    snapshot update is guarded by the watermark it was computed from, so a
+    concurrent run can't fold the same entries twice.
+
+    Returns:
+    int: The number of users whose snapshot moved.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settle_seconds)
+    watermark = PointsLedger.objects.filter(created__lte=cutoff).aggregate(last=Max('id'))['last']
+    if watermark is None:
+        return 0
+    folded = 0
+    last_user = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                PointsLedger.objects.filter(user__gt=last_user, id__gt=F('user__points_through'), id__lte=watermark)
+                .values('user', 'user__points_through').annotate(total=Sum('delta'), last=Max('id'))
+                .order_by('user')[:chunk_size]
+            )
+            for row in rows:
+                folded += AppUser.objects.filter(pk=row['user'], points_through=row['user__points_through']).update(
+                    points=F('points') + row['total'], points_through=row['last'])
+        if len(rows) < chunk_size:
+            return folded
+        last_user = rows[-1]['user']
@@ -0,0 +1,268 @@
+"""
+Scripted load against the caisse and the mobile API, for before/after comparisons.
+
+Each scenario is one user's loop: a cashier settling bursts of baskets on the
+caisse page, the app polling the catalog with its ETags, a client paging
+through their history, or a client redeeming gifts. Workers run the scenarios
+concurrently for a duration or a number of iterations, through the Django test
+client (in-process, no server) or over HTTP against a running server, and
+every request is timed under the name of its endpoint.
+
+Workers draw their baskets, products and pages from a random generator seeded
+per worker, so two runs with the same --seed send the same requests. Results
+are plain JSON, and `compare` sets two of them side by side.
+"""
+import http.cookiejar
+import json
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+from clientsApp.tokens import issue_tokens
+from .checkout import MAX_BATCH,checkout_batch
+from .models import AppUser,Category,Gift,Product
+
+
+SCENARIOS = ('checkout', 'catalog', 'history', 'redeem')
+BURST = 5
+HISTORY_PAGES = 3
+
+
+class Fixture:
+    """
+    The rows a benchmark runs against: a cashier, clients with plenty of points
+    and a purchase history, products and gifts, all tagged so they can be
+    removed afterwards.
+    """
+    def __init__(self, customers=20, products=200, history=60, seed=0):
+        self.tag = uuid.uuid4().hex[:8]
+        self.password = get_random_string(16)
+        self.cashier = AppUser.objects.create_user(f'bench-{self.tag}', f'bench-{self.tag}@example.invalid',
+                                                   self.password, is_staff=True)
+        self.customers = [
+            AppUser.objects.create_user(f'bench-{self.tag}-{i}', f'bench-{self.tag}-{i}@example.invalid', None,
+                                        points=10 ** 9)
+            for i in range(customers)
+        ]
+        self.category = Category.objects.create(name=f'bench-{self.tag}')
+        self.products = [p.pk for p in Product.objects.bulk_create([
+            Product(name=f'bench-{self.tag}-{i}', price=1 + i % 50, description='', category=self.category, image='')
+            for i in range(products)
+        ])]
+        self.gifts = [g.pk for g in Gift.objects.bulk_create([
+            Gift(productId_id=pk, pointCost=10) for pk in self.products[:10]
+        ])]
+        self.access = {user.pk: issue_tokens(user)['access'] for user in self.customers}
+        rng = random.Random(seed)
+        baskets = [
+            {'key': f'bench-{self.tag}-{user.pk}-{i}', 'userId': user.pk,
+             'lines': [{'productId': pk, 'quantity': rng.randint(1, 3)} for pk in rng.sample(self.products, 3)]}
+            for user in self.customers for i in range(history)
+        ]
+        for start in range(0, len(baskets), MAX_BATCH):
+            checkout_batch(baskets[start:start + MAX_BATCH])
+
+    def delete(self):
+        self.category.delete()
+        AppUser.objects.filter(pk__in=[self.cashier.pk] + [user.pk for user in self.customers]).delete()
+
+
+class ClientTransport:
+    """
+    Requests through django.test.Client: the whole stack but the server, in this process.
+    """
+    def __init__(self, fixture):
+        self.client = Client()
+        self.client.force_login(fixture.cashier)
+        self.thread = threading.get_ident()
+
+    def request(self, method, path, data=None, headers=None):
+        if method == 'POST':
+            response = self.client.post(path, data or {}, headers=headers)
+        else:
+            response = self.client.get(path, data, headers=headers)
+        return response.status_code, dict(response.items()), response.content
+
+    def close(self):
+        # Only the connection a worker thread opened: a lone worker runs in the caller's thread
+        if threading.get_ident() != self.thread:
+            connection.close()
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpTransport:
+    """
+    Requests over HTTP to a running server; the cashier logs in through the login form.
+    """
+    def __init__(self, fixture, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies), _NoRedirect)
+        self.request('GET', reverse('login'))
+        self.request('POST', reverse('login'), {'username': fixture.cashier.username, 'password': fixture.password})
+
+    def request(self, method, path, data=None, headers=None):
+        headers = dict(headers or {})
+        url = self.base_url + path
+        body = None
+        if method == 'POST':
+            csrf = next((c.value for c in self.cookies if c.name == 'csrftoken'), '')
+            headers.setdefault('X-CSRFToken', csrf)
+            body = urllib.parse.urlencode(data or {}, doseq=True).encode()
+        elif data:
+            url += '?' + urllib.parse.urlencode(data)
+        try:
+            with self.opener.open(urllib.request.Request(url, body, headers, method=method)) as response:
+                return response.status, dict(response.headers), response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, dict(error.headers), error.read()
+
+    def close(self):
+        pass
+
+
+class Worker:
+    """
+    One simulated user running a scenario in a loop, and its timings.
+    """
+    def __init__(self, scenario, fixture, transport, seed):
+        self.scenario = scenario
+        self.fixture = fixture
+        self.transport = transport
+        self.random = random.Random(seed)
+        self.etags = {}
+        self.samples = []
+
+    def timed(self, endpoint, method, path, data=None, headers=None):
+        started = time.perf_counter()
+        try:
+            status, response_headers, content = self.transport.request(method, path, data, headers)
+        except Exception:
+            status, response_headers, content = 0, {}, b''
+        self.samples.append((endpoint, (time.perf_counter() - started) * 1000, status))
+        return status, response_headers, content
+
+    def run(self, deadline=None, iterations=None):
+        done = 0
+        try:
+            while (iterations is None or done < iterations) and (deadline is None or time.monotonic() < deadline):
+                getattr(self, self.scenario)()
+                done += 1
+        finally:
+            self.transport.close()
+
+    def customer(self):
+        user = self.random.choice(self.fixture.customers)
+        return user.pk, {'Authorization': f'Bearer {self.fixture.access[user.pk]}'}
+
+    def checkout(self):
+        for _ in range(BURST):
+            products = self.random.sample(self.fixture.products, self.random.randint(1, 10))
+            data = {'userId': self.random.choice(self.fixture.customers).pk, 'products': products}
+            data.update({f'quantity_{pk}': self.random.randint(1, 3) for pk in products})
+            self.timed('caisse checkout', 'POST', reverse('caisse'), data)
+
+    def catalog(self):
+        _, headers = self.customer()
+        for endpoint in ('products', 'gifts', 'getCategories'):
+            etag = self.etags.get(endpoint)
+            status, response_headers, _ = self.timed(f'catalog {endpoint}', 'GET', f'/clientsApp/{endpoint}/',
+                                                     headers={**headers, **({'If-None-Match': etag} if etag else {})})
+            if status in (200, 304):
+                self.etags[endpoint] = response_headers.get('ETag', etag)
+
+    def history(self):
+        _, headers = self.customer()
+        params = {}
+        for _ in range(HISTORY_PAGES):
+            status, _, content = self.timed('history page', 'GET', '/clientsApp/getUserHistory/', params, headers)
+            cursor = json.loads(content).get('next') if status == 200 else None
+            if not cursor:
+                break
+            params = {'cursor': cursor}
+
+    def redeem(self):
+        user_id, headers = self.customer()
+        gift_id = self.random.choice(self.fixture.gifts)
+        headers['Idempotency-Key'] = f'{self.fixture.tag}-{self.random.getrandbits(64):x}'
+        self.timed('gift redemption', 'GET', f'/clientsApp/createCode/{gift_id}/{user_id}/', headers=headers)
+
+
+def run(fixture, scenarios, concurrency, seconds=None, iterations=None, base_url=None, seed=0):
+    """
+    Run `concurrency` workers for each scenario and return the summary (see `summarize`).
+
+    Give `iterations` (per worker) instead of `seconds` for a run whose request count is fixed.
+    """
+    workers = []
+    for scenario in scenarios:
+        for i in range(concurrency):
+            transport = HttpTransport(fixture, base_url) if base_url else ClientTransport(fixture)
+            workers.append(Worker(scenario, fixture, transport, seed=f'{seed}-{scenario}-{i}'))
+    started = time.monotonic()
+    deadline = None if iterations else started + seconds
+    if len(workers) == 1:
+        workers[0].run(deadline, iterations)
+    else:
+        threads = [threading.Thread(target=worker.run, args=(deadline, iterations)) for worker in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.monotonic() - started
+    return summarize([s for worker in workers for s in worker.samples], elapsed, {
+        'scenarios': list(scenarios), 'concurrency': concurrency, 'seconds': seconds, 'iterations': iterations,
+        'transport': base_url or 'test client', 'seed': seed,
+    })
+
+
+def summarize(samples, elapsed, config):
+    """
+    Throughput and latency percentiles (ms) per endpoint, as a JSON-ready dict.
+    """
+    by_endpoint = {}
+    for endpoint, ms, status in samples:
+        by_endpoint.setdefault(endpoint, []).append((ms, status))
+    endpoints = {}
+    for endpoint, timings in sorted(by_endpoint.items()):
+        latencies = sorted(ms for ms, _ in timings)
+        endpoints[endpoint] = {
+            'requests': len(timings),
+            'errors': sum(1 for _, status in timings if not 200 <= status < 400),
+            'throughput': len(timings) / elapsed if elapsed else 0.0,
+            'p50': statistics.median(latencies),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1],
+        }
+    return {'config': config, 'elapsed': elapsed, 'endpoints': endpoints}
+
+
+def percentile(values, percent):
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def compare(before, after):
+    """
+    Per endpoint of either run: (endpoint, metric, before, after, change in %), None where a side is missing.
+    """
+    rows = []
+    for endpoint in sorted(set(before['endpoints']) | set(after['endpoints'])):
+        old, new = before['endpoints'].get(endpoint, {}), after['endpoints'].get(endpoint, {})
+        for metric in ('throughput', 'p50', 'p95', 'p99'):
+            a, b = old.get(metric), new.get(metric)
+            change = (b - a) / a * 100 if a and b is not None else None
+            rows.append((endpoint, metric, a, b, change))
+    return rows
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand,CommandError
+from django.db import DEFAULT_DB_ALIAS,connections
+from django.db.migrations.recorder import MigrationRecorder
+
+
+# The migrations that describe the schema `migrate --run-syncdb` used to create
+BASELINE = ('0001_initial', '0002_baseline_schema')
+BASELINE_TABLES = ('caisseApp_appuser', 'caisseApp_category', 'caisseApp_product', 'caisseApp_gift',
+                   'caisseApp_transaction', 'caisseApp_message', 'caisseApp_code', 'caisseApp_facture')
+
+
+class Command(BaseCommand):
+    help = ("Record the baseline caisseApp migrations as applied on a database whose tables were created by "
+            "`migrate --run-syncdb`, so that `migrate` can apply the later ones. Django refuses to migrate "
+            "such a database otherwise, since the admin migrations are recorded without caisseApp's.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        recorder = MigrationRecorder(connection)
+        recorder.ensure_schema()
+        applied = {name for app, name in recorder.applied_migrations() if app == 'caisseApp'}
+        if applied:
+            self.stdout.write(f"caisseApp migrations are already recorded ({len(applied)}); nothing to do.")
+            return
+        tables = set(connection.introspection.table_names())
+        missing = [table for table in BASELINE_TABLES if table not in tables]
+        if missing:
+            raise CommandError(f"Not a syncdb-created database: {', '.join(missing)} missing. Run `migrate` instead.")
+        columns = {c.name for c in connection.introspection.get_table_description(connection.cursor(), 'caisseApp_code')}
+        if 'cid' not in columns:
+            raise CommandError("caisseApp_code has no cid column: the tables predate the baseline schema.")
+        for name in BASELINE:
+            recorder.record_applied('caisseApp', name)
+        self.stdout.write(self.style.SUCCESS(
+            f"Recorded {', '.join(BASELINE)} as applied. Run `manage.py migrate` for the rest."
+        ))
@@ -0,0 +1,44 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand,CommandError
+from django.db import connection
+from caisseApp import archive
+
+
+class Command(BaseCommand):
+    help = ("Move factures older than --days, with their lines, from the hot tables to the archive, oldest "
+            "first, one chunk per transaction. Safe to interrupt and run again; archived factures stay "
+            "visible on the facture page and in the client history.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ARCHIVE_AFTER_DAYS,
+                            help="Archive factures older than this many days.")
+        parser.add_argument('--chunk-size', type=int, default=archive.CHUNK_SIZE, help="Factures per transaction.")
+        parser.add_argument('--limit', type=int, help="Stop after archiving about this many factures.")
+        parser.add_argument('--vacuum', action='store_true',
+                            help="VACUUM afterwards to give the freed pages back to the filesystem (SQLite).")
+
+    def handle(self, *args, **options):
+        if options['days'] < 0 or options['chunk_size'] < 1:
+            raise CommandError("--days must not be negative and --chunk-size must be positive.")
+
+        before = archive.cutoff(options['days'])
+        limit = options['limit']
+        started = time.perf_counter()
+        moved = 0
+        while limit is None or moved < limit:
+            size = options['chunk_size'] if limit is None else min(options['chunk_size'], limit - moved)
+            count = archive.archive_chunk(before, size)
+            if not count:
+                break
+            moved += count
+            if options['verbosity'] > 1:
+                self.stdout.write(f"Archived {moved:,} factures")
+        elapsed = time.perf_counter() - started
+
+        if options['vacuum'] and connection.vendor == 'sqlite':
+            connection.cursor().execute('VACUUM')
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {moved:,} factures dated before {before:%Y-%m-%d} in {elapsed:.1f}s"
+            f" ({moved / elapsed if elapsed else 0:,.0f}/s)."
+        ))
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from caisseApp.checkout import POINTS_DIVISOR
+from caisseApp.models import Transaction,Facture
+
+
+class Command(BaseCommand):
+    help = "Fill in the price snapshot of old transactions and the stored totals of old factures, in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        lines = self.backfill_transactions(chunk_size)
+        factures = self.backfill_factures(chunk_size)
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {lines} transactions and {factures} factures."))
+
+    def backfill_transactions(self, chunk_size):
+        # Old lines never stored their price, so the current product price is the best we have
+        done = 0
+        last_id = 0
+        while True:
+            chunk = list(
+                Transaction.objects.filter(pk__gt=last_id, unit_price__isnull=True)
+                .select_related('productId').only('id', 'quantity', 'productId__price')
+                .order_by('pk')[:chunk_size]
+            )
+            if not chunk:
+                return done
+            for line in chunk:
+                line.unit_price = line.productId.price
+                line.line_total = line.productId.price * line.quantity
+            with transaction.atomic():
+                Transaction.objects.bulk_update(chunk, ['unit_price', 'line_total'])
+            done += len(chunk)
+            last_id = chunk[-1].pk
+
+    def backfill_factures(self, chunk_size):
+        done = 0
+        last_id = 0
+        while True:
+            ids = list(
+                Facture.objects.filter(pk__gt=last_id, total_cost__isnull=True)
+                .order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not ids:
+                return done
+            sums = {
+                row['facture_id']: row
+                for row in Facture.transactionIds.through.objects.filter(facture_id__in=ids)
+                .values('facture_id')
+                .annotate(total=Sum('transaction__line_total'), items=Sum('transaction__quantity'))
+            }
+            factures = []
+            for pk in ids:
+                row = sums.get(pk, {})
+                total = row.get('total') or 0
+                factures.append(Facture(pk=pk, total_cost=total, item_count=row.get('items') or 0,
+                                        points_awarded=int(total // POINTS_DIVISOR)))
+            with transaction.atomic():
+                Facture.objects.bulk_update(factures, ['total_cost', 'item_count', 'points_awarded'])
+            done += len(ids)
+            last_id = ids[-1]
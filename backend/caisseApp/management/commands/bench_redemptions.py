@@ -0,0 +1,85 @@
+import threading
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.db import OperationalError,connection
+from caisseApp.codes import RedemptionError,redeem
+from caisseApp.ledger import balance
+from caisseApp.models import AppUser,Category,Code,Gift,Product
+
+
+class Command(BaseCommand):
+    help = ("Hammer gift redemption from concurrent threads, then check that no points were "
+            "overspent and report redemptions per second. Creates and removes its own user and gift.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--attempts', type=int, default=50, help="Redemptions tried per thread.")
+        parser.add_argument('--cost', type=int, default=10)
+        parser.add_argument('--balance', type=int, default=2000,
+                            help="Starting points; keep it below threads*attempts*cost to exercise the overspend guard.")
+        parser.add_argument('--retry-ratio', type=float, default=0.1,
+                            help="Share of attempts that resend the previous idempotency key.")
+        parser.add_argument('--keep', action='store_true', help="Keep the benchmark rows afterwards.")
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        user = AppUser.objects.create(username=f'bench-{tag}', email=f'bench-{tag}@example.invalid',
+                                      points=options['balance'])
+        category = Category.objects.create(name=f'bench-{tag}')
+        product = Product.objects.create(name=f'bench-{tag}', price=0, description='', category=category, image='')
+        gift = Gift.objects.create(productId=product, pointCost=options['cost'])
+
+        results = {'issued': set(), 'replayed': 0, 'refused': 0, 'locked': 0}
+        lock = threading.Lock()
+        retry_every = int(1 / options['retry_ratio']) if options['retry_ratio'] > 0 else 0
+
+        def worker():
+            key = None
+            try:
+                for attempt in range(options['attempts']):
+                    if not (retry_every and key and attempt % retry_every == 0):
+                        key = uuid.uuid4().hex
+                    try:
+                        cid, replayed = redeem(gift.id, user.id, key)
+                    except RedemptionError:
+                        outcome = 'refused'
+                    except OperationalError:
+                        outcome = 'locked'
+                    else:
+                        outcome = 'replayed' if replayed else 'issued'
+                    with lock:
+                        if outcome == 'issued':
+                            results['issued'].add(cid)
+                        else:
+                            results[outcome] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        remaining = balance(user.id)
+        issued = len(results['issued'])
+        stored = Code.objects.filter(giftId=gift).count()
+        expected_balance = options['balance'] - issued * options['cost']
+        total = options['threads'] * options['attempts']
+        self.stdout.write(
+            f"{total} attempts in {elapsed:.2f}s ({total / elapsed:,.0f} requests/s, {issued / elapsed:,.0f} redemptions/s)\n"
+            f"issued={issued} replayed={results['replayed']} refused={results['refused']} locked={results['locked']}\n"
+            f"balance={remaining} expected={expected_balance} codes stored={stored}"
+        )
+        consistent = remaining == expected_balance and stored == issued and remaining >= 0
+        if consistent:
+            self.stdout.write(self.style.SUCCESS("Balances are consistent."))
+        else:
+            self.stdout.write(self.style.ERROR("Inconsistent balances: points were overspent or lost."))
+
+        if not options['keep']:
+            category.delete()
+            user.delete()
@@ -0,0 +1,54 @@
+import random
+import statistics
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from caisseApp.models import Category,Product
+from caisseApp.search import search_products
+
+WORDS = ('chocolate', 'milk', 'orange', 'juice', 'green', 'tea', 'coffee', 'biscuit', 'almond', 'vanilla',
+         'sparkling', 'water', 'honey', 'mint', 'lemon', 'olive', 'bread', 'butter', 'cheese', 'yogurt')
+
+
+class Command(BaseCommand):
+    help = ("Time caisse product lookups (exact SKU scans, SKU prefixes and name prefixes) over a catalog "
+            "of --products generated items. Creates and removes its own products.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--lookups', type=int, default=500)
+        parser.add_argument('--keep', action='store_true', help="Keep the generated products afterwards.")
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:6]
+        category = Category.objects.create(name=f'bench-{tag}')
+        started = time.perf_counter()
+        with transaction.atomic():
+            Product.objects.bulk_create(
+                (Product(name=' '.join(random.sample(WORDS, 3)) + f' {i}', price=random.randint(1, 200),
+                         description=' '.join(random.sample(WORDS, 5)), category=category, image='',
+                         sku=f'{tag}{i:09d}') for i in range(options['products'])),
+                batch_size=2000,
+            )
+        self.stdout.write(f"Created {options['products']:,} products in {time.perf_counter() - started:.1f}s")
+        try:
+            lookups = {
+                'sku scan': lambda: f'{tag}{random.randrange(options["products"]):09d}',
+                'sku prefix': lambda: f'{tag}{random.randrange(options["products"]):09d}'[:-3],
+                'name prefix': lambda: random.choice(WORDS)[:4],
+                'two words': lambda: ' '.join(random.sample(WORDS, 2))[:-2],
+            }
+            for label, make_query in lookups.items():
+                timings = []
+                for _ in range(options['lookups']):
+                    query = make_query()
+                    begin = time.perf_counter()
+                    search_products(query)
+                    timings.append((time.perf_counter() - begin) * 1000)
+                timings.sort()
+                self.stdout.write(f"{label:12} p50={statistics.median(timings):.2f}ms "
+                                  f"p99={timings[int(len(timings) * 0.99)]:.2f}ms max={timings[-1]:.2f}ms")
+        finally:
+            if not options['keep']:
+                category.delete()
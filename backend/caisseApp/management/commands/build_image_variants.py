@@ -0,0 +1,34 @@
+import time
+from django.db.models import F
+from django.core.management.base import BaseCommand
+from caisseApp.catalog import bump_catalog_version
+from caisseApp.images import build_variants
+from caisseApp.models import Product
+
+
+class Command(BaseCommand):
+    help = "Build the resized WebP/JPEG variants of product images that don't have current ones yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Rebuild the variants of every product.")
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='')
+        if not options['force']:
+            products = products.exclude(variants_for=F('image'))
+        started = time.perf_counter()
+        built = failed = written = 0
+        for pk, name in products.order_by('pk').values_list('pk', 'image'):
+            try:
+                written += build_variants(pk, bump=False)
+            except (OSError, ValueError) as e:
+                failed += 1
+                self.stderr.write(f"Product {pk} ({name}): {e}")
+            else:
+                built += 1
+        if built:
+            bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            f"Built variants for {built} products ({written / 1024:,.0f} KB) in {time.perf_counter() - started:.1f}s, "
+            f"{failed} failed."
+        ))
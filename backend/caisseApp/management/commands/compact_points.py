@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from caisseApp.ledger import SETTLE_SECONDS,compact
+
+
+class Command(BaseCommand):
+    help = "Fold settled points ledger entries into the users' balance snapshots. Safe to run from cron."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--settle-seconds', type=int, default=SETTLE_SECONDS,
+                            help="Leave entries younger than this for the next run.")
+
+    def handle(self, *args, **options):
+        folded = compact(options['chunk_size'], options['settle_seconds'])
+        self.stdout.write(self.style.SUCCESS(f"Compacted the points ledger of {folded} users."))
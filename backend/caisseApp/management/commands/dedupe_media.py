@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from caisseApp.catalog import bump_catalog_version
+from caisseApp.models import Product
+from caisseApp.storage import is_hashed,media_storage
+
+
+class Command(BaseCommand):
+    help = ("Move product images that predate content-addressed storage to their hashed name, so identical "
+            "uploads share one file, and point the products at it. Run build_image_variants afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true', help="Delete the old files once no product uses them.")
+
+    def handle(self, *args, **options):
+        names = Product.objects.exclude(image='').order_by('image').values_list('image', flat=True).distinct()
+        moved = missing = freed = 0
+        renamed = {}
+        for name in names:
+            if is_hashed(name):
+                continue
+            if not media_storage.exists(name):
+                missing += 1
+                self.stderr.write(f"Missing file: {name}")
+                continue
+            with media_storage.open(name) as f:
+                renamed[name] = media_storage.save(name, f)
+        with transaction.atomic():
+            for old, new in renamed.items():
+                moved += Product.objects.filter(image=old).update(image=new)
+        if options['delete']:
+            for old in renamed:
+                size = media_storage.size(old)
+                media_storage.delete(old)
+                freed += size
+        if renamed:
+            bump_catalog_version()
+        stored = len(set(renamed.values()))
+        self.stdout.write(self.style.SUCCESS(
+            f"Repointed {moved} products from {len(renamed)} files to {stored} content-addressed files, "
+            f"{missing} missing, {freed / 1024:,.0f} KB freed."
+        ))
@@ -0,0 +1,35 @@
+import time
+from datetime import date
+from django.core.management.base import BaseCommand,CommandError
+from caisseApp import export
+
+
+class Command(BaseCommand):
+    help = ("Stream factures, facture lines or customers as CSV or JSON Lines, archived factures included. "
+            "Reads with server-side cursors, so memory stays flat whatever the date range.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=export.DATASETS)
+        parser.add_argument('--format', choices=export.FORMATS, default='csv')
+        parser.add_argument('--from', dest='start', type=date.fromisoformat, help="First day included, YYYY-MM-DD.")
+        parser.add_argument('--to', dest='end', type=date.fromisoformat, help="Last day included, YYYY-MM-DD.")
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--output', help="File to write; default standard output.")
+
+    def handle(self, *args, **options):
+        chunks = export.stream(options['dataset'], options['format'], options['start'], options['end'],
+                               options['gzip'])
+        if not options['output']:
+            if options['gzip']:
+                raise CommandError("--gzip needs --output.")
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending='')
+            return
+
+        started = time.perf_counter()
+        written = 0
+        with open(options['output'], 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                written += len(chunk)
+        self.stderr.write(f"Wrote {written:,} bytes to {options['output']} in {time.perf_counter() - started:.1f}s.")
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand,CommandError
+from caisseApp.synthetic import Generator,Shape
+
+
+class Command(BaseCommand):
+    help = ("Fill the database with production-shaped synthetic data: catalog, customers, factures with their "
+            "lines, points, gift codes, rollups and message threads, bulk-inserted in chunks. "
+            "The same --seed on the same starting database produces the same rows.")
+
+    def add_arguments(self, parser):
+        defaults = Shape()
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--categories', type=int, default=defaults.categories)
+        parser.add_argument('--products', type=int, default=defaults.products)
+        parser.add_argument('--gifts', type=int, default=defaults.gifts)
+        parser.add_argument('--users', type=int, default=defaults.users)
+        parser.add_argument('--active-share', type=float, default=defaults.active_share,
+                            help="Share of customers who make most of the purchases.")
+        parser.add_argument('--factures', type=int, default=defaults.factures)
+        parser.add_argument('--days', type=int, default=defaults.days, help="Days of history, ending yesterday.")
+        parser.add_argument('--threads', type=int, default=defaults.threads, help="Message threads.")
+        parser.add_argument('--chunk-size', type=int, default=defaults.chunk_size, help="Rows built per transaction.")
+        parser.add_argument('--password', default=defaults.password, help="Password of every generated user.")
+
+    def handle(self, *args, **options):
+        shape = Shape(**{name: options[name] for name in Shape.__dataclass_fields__})
+        if min(shape.categories, shape.products, shape.users, shape.days, shape.chunk_size) < 1:
+            raise CommandError("--categories, --products, --users, --days and --chunk-size must be positive.")
+        if not 0 <= shape.active_share <= 1:
+            raise CommandError("--active-share must be between 0 and 1.")
+
+        report = Generator(shape, seed=options['seed']).run()
+
+        for table, count in report.rows.items():
+            self.stdout.write(f"{table:40} {count:12,}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Inserted {report.total:,} rows in {report.seconds:.1f}s ({report.rate:,.0f} rows/s)."
+        ))
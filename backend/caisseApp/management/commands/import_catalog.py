@@ -0,0 +1,46 @@
+import time
+from django.core.management.base import BaseCommand,CommandError
+from caisseApp.catalog import bump_catalog_version
+from caisseApp.catalog_import import CatalogImportError,import_catalog
+from caisseApp.images import build_variants
+
+
+class Command(BaseCommand):
+    help = ("Create or update categories, products (by SKU) and gifts from a supplier CSV, with an optional zip "
+            "of the images it names. Rows that fail validation are reported and skipped; the others are "
+            "written in bulk and the catalog is refreshed once. See caisseApp/catalog_import.py for the columns.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv')
+        parser.add_argument('--images', help="Zip archive of the images named in the image column.")
+        parser.add_argument('--skip-variants', action='store_true',
+                            help="Leave the resized image variants to build_image_variants.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            with open(options['csv'], newline='', encoding='utf-8-sig') as rows:
+                if options['images']:
+                    with open(options['images'], 'rb') as images:
+                        report = import_catalog(rows, images)
+                else:
+                    report = import_catalog(rows)
+        except (OSError, CatalogImportError) as e:
+            raise CommandError(str(e))
+
+        for line, message in report.errors:
+            self.stderr.write(f"Line {line}: {message}")
+        if report.new_images and not options['skip_variants']:
+            for product_id in report.new_images:
+                try:
+                    build_variants(product_id, bump=False)
+                except (OSError, ValueError) as e:
+                    self.stderr.write(f"Product {product_id}: {e}")
+            bump_catalog_version()
+        created, updated = report.created, report.updated
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report.imported} of {report.rows} rows in {time.perf_counter() - started:.1f}s: "
+            f"{created['product']} products created, {updated['product']} updated; "
+            f"{created['gift']} gifts created, {updated['gift']} updated; {created['category']} categories created; "
+            f"{len(report.errors)} rows rejected."
+        ))
@@ -0,0 +1,63 @@
+import json
+from django.core.management.base import BaseCommand,CommandError
+from caisseApp import loadbench
+
+
+class Command(BaseCommand):
+    help = ("Drive scripted cashier and mobile-app scenarios with concurrent workers and report throughput "
+            "and p50/p95/p99 latency per endpoint. Runs in-process through the test client, or against a "
+            "running server with --url. Creates and removes its own users, products and gifts.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', choices=loadbench.SCENARIOS,
+                            help="Scenario to run; repeat for several. Default: all of them.")
+        parser.add_argument('--concurrency', type=int, default=4, help="Workers per scenario.")
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--iterations', type=int,
+                            help="Run each worker this many times instead of for --seconds.")
+        parser.add_argument('--url', help="Base URL of a running server, e.g. http://127.0.0.1:8000")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--customers', type=int, default=20)
+        parser.add_argument('--products', type=int, default=200)
+        parser.add_argument('--history', type=int, default=60, help="Past factures of each client.")
+        parser.add_argument('--output', help="Write the results as JSON to this file.")
+        parser.add_argument('--compare', help="Results file of an earlier run to compare against.")
+        parser.add_argument('--keep', action='store_true', help="Keep the generated rows afterwards.")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read {options['compare']}: {e}")
+
+        fixture = loadbench.Fixture(customers=options['customers'], products=options['products'],
+                                    history=options['history'], seed=options['seed'])
+        try:
+            results = loadbench.run(
+                fixture, options['scenario'] or loadbench.SCENARIOS, options['concurrency'],
+                seconds=options['seconds'], iterations=options['iterations'], base_url=options['url'],
+                seed=options['seed'],
+            )
+        finally:
+            if not options['keep']:
+                fixture.delete()
+
+        self.stdout.write(f"{'endpoint':20} {'requests':>8} {'errors':>6} {'req/s':>8} "
+                          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for endpoint, row in results['endpoints'].items():
+            self.stdout.write(f"{endpoint:20} {row['requests']:8} {row['errors']:6} {row['throughput']:8.1f} "
+                              f"{row['p50']:8.1f} {row['p95']:8.1f} {row['p99']:8.1f}")
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if baseline is not None:
+            self.stdout.write(f"\nCompared with {options['compare']}:")
+            for endpoint, metric, before, after, change in loadbench.compare(baseline, results):
+                if before is None or after is None:
+                    self.stdout.write(f"{endpoint:20} {metric:10} only in {'this run' if before is None else 'the baseline'}")
+                else:
+                    self.stdout.write(f"{endpoint:20} {metric:10} {before:10.1f} -> {after:10.1f} ({change:+.1f}%)")
@@ -0,0 +1,20 @@
+import asyncio
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from caisseApp.realtime import Broker
+
+
+class Command(BaseCommand):
+    help = "Run the local pub/sub broker that relays chat events between worker processes (BrokerBackend)."
+
+    def add_arguments(self, parser):
+        host, port = getattr(settings, 'PUBSUB_BROKER', ('127.0.0.1', 8765))
+        parser.add_argument('--host', default=host)
+        parser.add_argument('--port', type=int, default=port)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Pub/sub broker listening on {options['host']}:{options['port']}")
+        try:
+            asyncio.run(Broker().serve(options['host'], options['port']))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,124 @@
+import multiprocessing
+import statistics
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.db import OperationalError,connection,connections
+from caisseApp.checkout import checkout
+from caisseApp.models import AppUser,Category,Facture,Product
+
+# Stock Django/SQLite behaviour, for comparison with the configured profile
+BASELINE_OPTIONS = {'timeout': 5, 'transaction_mode': 'DEFERRED', 'pragmas': {}}
+BASELINE_JOURNAL_MODE = 'DELETE'
+
+
+class Command(BaseCommand):
+    help = ("Run checkout bursts and history reads from separate processes against the configured SQLite "
+            "database and report write throughput, lock errors and read latency. Creates and removes its own rows.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--baseline', action='store_true',
+                            help="Use the rollback journal and plain BEGIN instead of the configured profile.")
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        users = [AppUser.objects.create(username=f'stress-{tag}-{i}', email=f'stress-{tag}-{i}@example.invalid')
+                 for i in range(max(options['writers'], options['readers']))]
+        category = Category.objects.create(name=f'stress-{tag}')
+        products = Product.objects.bulk_create([
+            Product(name=f'stress-{tag}-{i}', price=10 + i, description='', category=category, image='') for i in range(10)
+        ])
+        settings_dict = connection.settings_dict
+        configured = settings_dict['OPTIONS']
+        # The journal mode the database file has, WAL once migrated
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            stored = cursor.fetchone()[0]
+        journal = stored
+        if options['baseline']:
+            settings_dict['OPTIONS'] = BASELINE_OPTIONS
+            journal = BASELINE_JOURNAL_MODE
+        try:
+            # The journal mode is stored in the file: switch it before any worker connects
+            connections.close_all()
+            with connection.cursor() as cursor:
+                cursor.execute(f'PRAGMA journal_mode = {journal}')
+            connections.close_all()
+
+            context = multiprocessing.get_context('fork')
+            results = context.Queue()
+            deadline = time.time() + options['seconds']
+            workers = [context.Process(target=_writer, args=(users[i].pk, [p.pk for p in products], deadline, results))
+                       for i in range(options['writers'])]
+            workers += [context.Process(target=_reader, args=(users[i].pk, deadline, results))
+                        for i in range(options['readers'])]
+            for worker in workers:
+                worker.start()
+            reports = [results.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+        finally:
+            settings_dict['OPTIONS'] = configured
+            connections.close_all()
+            with connection.cursor() as cursor:
+                cursor.execute(f'PRAGMA journal_mode = {stored}')
+            category.delete()
+            AppUser.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+        checkouts = sum(r['done'] for r in reports if r['role'] == 'writer')
+        write_errors = sum(r['locked'] for r in reports if r['role'] == 'writer')
+        latencies = sorted(ms for r in reports if r['role'] == 'reader' for ms in r['latencies'])
+        read_errors = sum(r['locked'] for r in reports if r['role'] == 'reader')
+        seconds = options['seconds']
+        self.stdout.write(f"{'baseline' if options['baseline'] else 'configured'} profile, journal_mode={journal}")
+        self.stdout.write(f"checkouts: {checkouts} ({checkouts / seconds:,.0f}/s), locked errors: {write_errors}")
+        if latencies:
+            self.stdout.write(
+                f"reads: {len(latencies)} ({len(latencies) / seconds:,.0f}/s), locked errors: {read_errors}, latency ms "
+                f"p50={statistics.median(latencies):.1f} p95={_percentile(latencies, 95):.1f} "
+                f"p99={_percentile(latencies, 99):.1f} max={latencies[-1]:.1f}"
+            )
+        else:
+            self.stdout.write(f"reads: 0, locked errors: {read_errors}")
+
+
+def _percentile(values, percent):
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def _writer(user_id, product_ids, deadline, results):
+    done = locked = 0
+    user = AppUser.objects.get(pk=user_id)
+    try:
+        while time.time() < deadline:
+            basket = {pk: 1 + (done + pk) % 3 for pk in product_ids[done % 4:done % 4 + 5]}
+            try:
+                checkout(user, basket)
+                done += 1
+            except OperationalError:
+                locked += 1
+    finally:
+        connection.close()
+        results.put({'role': 'writer', 'done': done, 'locked': locked})
+
+
+def _reader(user_id, deadline, results):
+    latencies = []
+    locked = 0
+    try:
+        while time.time() < deadline:
+            started = time.perf_counter()
+            try:
+                list(Facture.objects.filter(userId=user_id).order_by('-date', '-id')
+                     .values('id', 'date', 'total_cost')[:25])
+                Facture.objects.count()
+            except OperationalError:
+                locked += 1
+            else:
+                latencies.append((time.perf_counter() - started) * 1000)
+    finally:
+        connection.close()
+        results.put({'role': 'reader', 'latencies': latencies, 'locked': locked})
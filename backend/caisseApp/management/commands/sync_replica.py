@@ -0,0 +1,34 @@
+import sqlite3
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand,CommandError
+
+
+class Command(BaseCommand):
+    help = ("Refresh a local SQLite replica from the primary with the online backup API. "
+            "Stands in for real replication in development; run it in a loop to simulate lag.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--replica', default='replica', help="The alias of the replica in DATABASES.")
+        parser.add_argument('--every', type=float, default=0, help="Repeat every N seconds instead of once.")
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        replica = settings.DATABASES.get(options['replica'])
+        if replica is None:
+            raise CommandError(f"No database alias {options['replica']!r}.")
+        if not {primary['ENGINE'], replica['ENGINE']} <= {'django.db.backends.sqlite3', 'caisseApp.sqlite'}:
+            raise CommandError("sync_replica only copies SQLite databases; use the server's own replication.")
+        while True:
+            started = time.perf_counter()
+            source = sqlite3.connect(primary['NAME'])
+            target = sqlite3.connect(replica['NAME'])
+            try:
+                source.backup(target)
+            finally:
+                source.close()
+                target.close()
+            self.stdout.write(f"Copied {primary['NAME']} to {replica['NAME']} in {time.perf_counter() - started:.2f}s")
+            if not options['every']:
+                return
+            time.sleep(options['every'])
@@ -0,0 +1,133 @@
+"""
+Serving of uploaded media outside of DEBUG.
+
+Content-hashed names (caisseApp.storage) are served as immutable for a year;
+anything else must be revalidated. Conditional requests and single byte
+ranges are answered here. With MEDIA_SENDFILE set, only the headers are
+produced and the front proxy sends the bytes itself, so no worker is held
+for the length of a download.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse,Http404,HttpResponse,StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date,parse_http_date_safe
+from django.views.decorators.http import require_safe
+from .storage import is_hashed
+
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, no-cache'
+CHUNK_SIZE = 64 * 1024
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+@require_safe
+def serve(request, path):
+    """
+    Serve a file of MEDIA_ROOT.
+
+    Parameters:
+    request (HttpRequest): The HTTP request object.
+    path (str): The file path, relative to MEDIA_ROOT.
+
+    Returns:
+    HttpResponse: The file (200), a part of it (206), 304, or 416 for a range past its end.
+    """
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Not found')
+    if not os.path.isfile(fullpath):
+        raise Http404('Not found')
+    stat = os.stat(fullpath)
+    hashed = is_hashed(path)
+    etag = '"%s"' % (os.path.splitext(os.path.basename(path))[0] if hashed else f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        return _with_headers(not_modified, etag, stat, hashed)
+
+    content_type = mimetypes.guess_type(fullpath)[0] or 'application/octet-stream'
+    sendfile = getattr(settings, 'MEDIA_SENDFILE', None)
+    if sendfile:
+        # The proxy handles Range itself and must not forward these headers to the client
+        response = HttpResponse(content_type=content_type)
+        if sendfile == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + path
+        else:
+            response['X-Sendfile'] = fullpath
+        return _with_headers(response, etag, stat, hashed)
+
+    byte_range = _requested_range(request, etag, stat)
+    if byte_range is None:
+        response = FileResponse(open(fullpath, 'rb'), content_type=content_type)
+    elif byte_range == ():
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(_read_range(fullpath, start, end), status=206, content_type=content_type)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    return _with_headers(response, etag, stat, hashed)
+
+
+def _with_headers(response, etag, stat, hashed):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = IMMUTABLE if hashed else REVALIDATE
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def _requested_range(request, etag, stat):
+    """
+    Parse a single-range Range header.
+
+    Returns:
+    None to send the whole file (no range, several ranges, or a stale
+    If-Range), () if the range is unsatisfiable, or an inclusive (start, end).
+    """
+    header = request.headers.get('Range')
+    if not header or stat.st_size == 0:
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != int(stat.st_mtime):
+        return None
+    match = RANGE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), stat.st_size - 1) if last else stat.st_size - 1
+        if last and int(last) < start:
+            return None
+    else:
+        # A suffix range: the last N bytes
+        start = max(stat.st_size - int(last), 0)
+        end = stat.st_size - 1
+        if int(last) == 0:
+            return ()
+    if start >= stat.st_size:
+        return ()
+    return start, end
+
+
+def _read_range(fullpath, start, end):
+    with open(fullpath, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
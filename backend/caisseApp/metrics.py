@@ -0,0 +1,286 @@
+"""
+Per-view request metrics in Prometheus text format.
+
+MetricsMiddleware times every request and, through an execute wrapper that
+connection_created installs on each database connection, counts its queries
+and their time. Observations land in fixed-bucket histograms keyed by view and
+method, in process memory: recording one is a few dict and list updates.
+
+With several worker processes, set METRICS_DIR to a directory they share.
+Each process then writes its totals there every FLUSH_SECONDS, and /metrics
+sums the files of all processes. Without it, /metrics shows only the process
+that answers.
+
+Setting SLOW_REQUEST_SECONDS turns on the slow-request log: the SQL of every
+request is kept while it runs, and requests over the threshold are logged with
+their slowest statements.
+"""
+import copy
+import hmac
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction,markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse,JsonResponse
+
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger('caisseApp.metrics.slow')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+FLUSH_SECONDS = 5
+SLOW_SQL_SHOWN = 10
+
+HISTOGRAMS = {
+    'duration': ('http_request_duration_seconds', 'Wall time of requests, by view.', DURATION_BUCKETS),
+    'db_time': ('http_request_db_seconds', 'Time spent in database queries per request, by view.', DURATION_BUCKETS),
+    'queries': ('http_request_db_queries', 'Database queries per request, by view.', QUERY_BUCKETS),
+}
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestStats:
+    """
+    What one request spent in the database so far.
+    """
+    def __init__(self, capture_sql):
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = [] if capture_sql else None
+
+
+class Registry:
+    """
+    The histograms of this process, mergeable with those of other processes.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+        self.responses = {}
+
+    def observe(self, labels, duration, stats, status):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = {
+                    name: {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+                    for name, (_, _, buckets) in HISTOGRAMS.items()
+                }
+            for name, value in (('duration', duration), ('db_time', stats.db_time), ('queries', stats.queries)):
+                _observe(series[name], HISTOGRAMS[name][2], value)
+            key = (*labels, f'{status // 100}xx')
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'series': [[list(labels), copy.deepcopy(series)] for labels, series in self.series.items()],
+                'responses': [[list(key), count] for key, count in self.responses.items()],
+            }
+
+
+def _observe(histogram, buckets, value):
+    # Buckets hold plain counts; they are made cumulative when rendered
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            histogram['buckets'][i] += 1
+            break
+    histogram['sum'] += value
+    histogram['count'] += 1
+
+
+registry = Registry()
+_last_flush = 0.0
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every connection; a no-op outside of a measured request.
+    """
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        stats.queries += 1
+        stats.db_time += elapsed
+        if stats.statements is not None:
+            stats.statements.append((elapsed, sql))
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    # URL names repeat across apps ("products"), so prefix the app of the view
+    return f"{match.func.__module__.split('.')[0]}:{match.view_name}"
+
+
+class MetricsMiddleware:
+    """
+    Time each request and count its queries. Put it first in MIDDLEWARE.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        stats, token, started = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, stats, started)
+        return response
+
+    async def _acall(self, request):
+        stats, token, started = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, stats, started)
+        return response
+
+    def _start(self):
+        stats = RequestStats(capture_sql=getattr(settings, 'SLOW_REQUEST_SECONDS', None) is not None)
+        return stats, _current.set(stats), time.perf_counter()
+
+    def _finish(self, request, response, stats, started):
+        duration = time.perf_counter() - started
+        view = view_label(request)
+        registry.observe((view, request.method), duration, stats, response.status_code)
+        threshold = getattr(settings, 'SLOW_REQUEST_SECONDS', None)
+        if threshold is not None and duration >= threshold:
+            slowest = sorted(stats.statements, reverse=True)[:SLOW_SQL_SHOWN]
+            slow_logger.warning(
+                'Slow request %s %s (%s): %.0f ms, %d queries, %.0f ms in the database%s',
+                request.method, request.path, view, duration * 1000, stats.queries, stats.db_time * 1000,
+                ''.join(f'\n  {elapsed * 1000:.1f} ms  {sql}' for elapsed, sql in slowest),
+            )
+        maybe_flush()
+
+
+def maybe_flush(force=False):
+    """
+    Write this process's totals to METRICS_DIR, at most every FLUSH_SECONDS unless forced.
+    """
+    global _last_flush
+    directory = getattr(settings, 'METRICS_DIR', None)
+    now = time.monotonic()
+    if not directory or (not force and now - _last_flush < FLUSH_SECONDS):
+        return
+    _last_flush = now
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(registry.snapshot(), f)
+        # Atomic, so a scrape never reads a half-written file
+        os.replace(tmp, os.path.join(directory, f'{os.getpid()}.json'))
+    except OSError:
+        logger.exception('Could not write metrics to %s', directory)
+
+
+def collect():
+    """
+    Return the merged snapshot of every process (or only this one without METRICS_DIR).
+    """
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if not directory:
+        return [registry.snapshot()]
+    maybe_flush(force=True)
+    snapshots = []
+    for name in os.listdir(directory):
+        if name.endswith('.json'):
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return snapshots
+
+
+def render(snapshots):
+    """
+    Sum process snapshots and format them in the Prometheus text exposition format.
+    """
+    series = {}
+    responses = {}
+    for snapshot in snapshots:
+        for labels, histograms in snapshot['series']:
+            merged = series.setdefault(tuple(labels), {
+                name: {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+                for name, (_, _, buckets) in HISTOGRAMS.items()
+            })
+            for name, histogram in histograms.items():
+                target = merged[name]
+                target['buckets'] = [a + b for a, b in zip(target['buckets'], histogram['buckets'])]
+                target['sum'] += histogram['sum']
+                target['count'] += histogram['count']
+        for key, count in snapshot['responses']:
+            responses[tuple(key)] = responses.get(tuple(key), 0) + count
+
+    lines = []
+    for name, (metric, help_text, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} histogram']
+        for (view, method), histograms in sorted(series.items()):
+            histogram = histograms[name]
+            labels = f'view="{_escape(view)}",method="{_escape(method)}"'
+            cumulative = 0
+            for bound, count in zip(buckets, histogram['buckets']):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+            lines.append(f'{metric}_sum{{{labels}}} {histogram["sum"]:.6f}')
+            lines.append(f'{metric}_count{{{labels}}} {histogram["count"]}')
+    lines += ['# HELP http_responses_total Responses, by view and status class.', '# TYPE http_responses_total counter']
+    for (view, method, status), count in sorted(responses.items()):
+        lines.append(f'http_responses_total{{view="{_escape(view)}",method="{_escape(method)}",status="{status}"}} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def metrics(request):
+    """
+    Serve the metrics of all workers to Prometheus.
+
+    Staff users may read it from the browser; scrapers send
+    `Authorization: Bearer <settings.METRICS_TOKEN>`.
+
+    Parameters:
+    request (HttpRequest): The HTTP request object.
+
+    Returns:
+    HttpResponse: The metrics in Prometheus text format, or 403.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    scheme, _, presented = request.headers.get('Authorization', '').partition(' ')
+    by_token = bool(token) and scheme.lower() == 'bearer' and hmac.compare_digest(presented.strip(), token)
+    if not (by_token or request.user.is_staff):
+        return JsonResponse({'status': 'error', 'message': 'Forbidden'}, status=403)
+    return HttpResponse(render(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def categories_from_names(apps, schema_editor):
+    Category = apps.get_model('caisseApp', 'Category')
+    Product = apps.get_model('caisseApp', 'Product')
+    for name in Product.objects.values_list('category_name', flat=True).distinct():
+        category = Category.objects.create(name=name)
+        Product.objects.filter(category_name=name).update(category=category)
+
+
+class Migration(migrations.Migration):
+    """
+    Bring 0001_initial up to the models as they were before any later migration.
+
+    Databases created with `migrate --run-syncdb` already have this schema, but
+    `migrate` refuses them: their admin migrations are recorded without
+    caisseApp's. Run `manage.py adopt_migrations` first, which records 0001 and
+    0002 as applied, then `manage.py migrate` for the rest.
+    """
+    initial = True
+
+    dependencies = [
+        ('caisseApp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+            ],
+        ),
+        # Product.category was free text: each distinct name becomes a Category
+        migrations.RenameField(model_name='product', old_name='category', new_name='category_name'),
+        migrations.AddField(
+            model_name='product',
+            name='category',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='caisseApp.category'),
+        ),
+        migrations.RunPython(categories_from_names, migrations.RunPython.noop),
+        migrations.RemoveField(model_name='product', name='category_name'),
+        migrations.AlterField(
+            model_name='product',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='caisseApp.category'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='description',
+            field=models.TextField(max_length=200),
+        ),
+        # Codes of 0001 had no code string to redeem them by; the table is recreated keyed by it
+        migrations.DeleteModel(name='Code'),
+        migrations.CreateModel(
+            name='Code',
+            fields=[
+                ('cid', models.CharField(max_length=12, primary_key=True, serialize=False, unique=True)),
+                ('giftId', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='caisseApp.gift')),
+                ('userId', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
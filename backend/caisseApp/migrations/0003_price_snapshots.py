@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caisseApp', '0002_baseline_schema'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='facture',
+            name='item_count',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='facture',
+            name='points_awarded',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='facture',
+            name='total_cost',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='line_total',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='unit_price',
+            field=models.FloatField(null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caisseApp', '0006_code_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appuser',
+            name='points_through',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='PointsLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.IntegerField()),
+                ('reason', models.CharField(choices=[('earn', 'Earned'), ('spend', 'Spent'), ('adjust', 'Adjusted')], max_length=10)),
+                ('reference', models.CharField(blank=True, max_length=40)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='points_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'id'], name='ledger_user_id_idx')],
+            },
+        ),
+    ]
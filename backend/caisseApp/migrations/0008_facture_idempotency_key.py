@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caisseApp', '0007_points_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='facture',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
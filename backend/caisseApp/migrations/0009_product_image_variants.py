@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caisseApp', '0008_facture_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='variants_for',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+    ]
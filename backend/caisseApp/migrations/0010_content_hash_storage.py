@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:24
+
+import caisseApp.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caisseApp', '0009_product_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=models.ImageField(storage=caisseApp.storage.ContentHashStorage(), upload_to=''),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caisseApp', '0010_content_hash_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appuser',
+            name='token_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
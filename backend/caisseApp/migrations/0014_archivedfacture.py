@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caisseApp', '0013_product_sku'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedFacture',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('date', models.DateTimeField()),
+                ('total_cost', models.FloatField(null=True)),
+                ('item_count', models.PositiveIntegerField(null=True)),
+                ('points_awarded', models.PositiveIntegerField(null=True)),
+                ('idempotency_key', models.CharField(blank=True, max_length=64, null=True)),
+                ('lines', models.BinaryField()),
+                ('userId', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['userId', 'date', 'id'], name='archived_user_date_id_idx')],
+            },
+        ),
+    ]
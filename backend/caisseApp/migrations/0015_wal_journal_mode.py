@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def journal_mode(mode):
+    def set_mode(apps, schema_editor):
+        if schema_editor.connection.vendor == 'sqlite':
+            with schema_editor.connection.cursor() as cursor:
+                cursor.execute(f'PRAGMA journal_mode = {mode}')
+    return set_mode
+
+
+class Migration(migrations.Migration):
+    """
+    Switch the database to write-ahead logging, which lets readers run alongside a writer.
+
+    The journal mode is stored in the database file, so it is set once here
+    rather than on every connection. It can't change inside a transaction,
+    hence a non-atomic migration.
+    """
+    atomic = False
+
+    dependencies = [
+        ('caisseApp', '0014_archivedfacture'),
+    ]
+
+    operations = [
+        migrations.RunPython(journal_mode('WAL'), journal_mode('DELETE'), atomic=False),
+    ]
@@ -1,7 +1,8 @@
-from django.db import models
+from django.db import IntegrityError,models,transaction
 from django.contrib.auth.models import AbstractBaseUser,BaseUserManager,PermissionsMixin
 import secrets
 import string
+from .storage import media_storage
 
 class AppUserManager(BaseUserManager):
     def create_user(self, username, email, password=None, **extra_fields):
@@ -33,6 +34,10 @@ class AppUser(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_superuser = models.BooleanField(default=False)
     is_staff = models.BooleanField(default=False)  # Add this for admin access
+    # `points` is the balance snapshot as of ledger entry `points_through`; see ledger.py
+    points_through = models.BigIntegerField(default=0)
+    # Bumped on API logout to revoke the user's refresh tokens; see clientsApp/tokens.py
+    token_version = models.PositiveIntegerField(default=0)
     USERNAME_FIELD = 'username'
     EMAIL_FIELD = 'email'
     REQUIRED_FIELDS = ['email']  # Email & Password are required by default.
@@ -47,7 +52,11 @@ class Product(models.Model):
     price = models.FloatField(max_length=50)
     description = models.TextField(max_length=200)
     category = models.ForeignKey("Category", on_delete=models.CASCADE)
-    image=models.ImageField()
+    image=models.ImageField(storage=media_storage)
+    # Barcode or shop reference scanned at the caisse; unique, so a scan is one index lookup
+    sku=models.CharField(max_length=64, unique=True, null=True, blank=True)
+    # Name of the image the resized variants were built from; they are current when it equals `image`
+    variants_for=models.CharField(max_length=100, blank=True, default='', editable=False)
     
 class Category(models.Model):
     name = models.CharField(max_length=50)
@@ -59,33 +68,144 @@ class Gift(models.Model):
 class Transaction(models.Model):
     productId=models.ForeignKey("Product", on_delete=models.CASCADE)
     quantity=models.IntegerField(max_length=50)
+    # Price snapshot taken at sale time, so later price changes don't rewrite old factures
+    unit_price=models.FloatField(null=True)
+    line_total=models.FloatField(null=True)
     
 class Message(models.Model):
     fromUserId=models.ForeignKey("AppUser", on_delete=models.CASCADE,related_name='fromWho')
     toUserId=models.ForeignKey("AppUser", on_delete=models.CASCADE,related_name='toWho')
     date=models.DateTimeField(auto_now_add=True)
     text=models.TextField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date', 'id'], name='message_date_id_idx'),
+            # Per-user conversation lookups; SQLite appends the rowid, so `since=<id>` stays in the index
+            models.Index(fields=['toUserId', 'date'], name='message_to_date_idx'),
+            models.Index(fields=['fromUserId', 'date'], name='message_from_date_idx'),
+        ]
     
 class Code(models.Model):
     giftId = models.ForeignKey("Gift", on_delete=models.CASCADE)
     userId = models.ForeignKey("AppUser", on_delete=models.CASCADE)
     cid = models.CharField(primary_key=True, max_length=12, unique=True)
+    # Client-chosen key of the redemption request that issued this code, so retries replay it
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
+
+    CID_LENGTH = 12
+    CID_ALPHABET = string.ascii_letters
+    MAX_ATTEMPTS = 5
+
+    @classmethod
+    def random_cids(cls, count):
+        """
+        Draw `count` random code identifiers from one block of OS randomness.
+
+        Bytes at or above the largest multiple of the alphabet size are thrown
+        away, so every letter stays equally likely.
+        """
+        alphabet = cls.CID_ALPHABET
+        limit = 256 - 256 % len(alphabet)
+        needed = count * cls.CID_LENGTH
+        letters = []
+        while len(letters) < needed:
+            letters.extend(alphabet[b % len(alphabet)] for b in secrets.token_bytes(needed) if b < limit)
+        return [''.join(letters[i:i + cls.CID_LENGTH]) for i in range(0, needed, cls.CID_LENGTH)]
 
     def generate_unique_code(self):
-        characters = string.ascii_letters
-        while True:
-            cid = ''.join(secrets.choice(characters) for _ in range(12))
-            if not Code.objects.filter(cid=cid).exists():
-                self.cid = cid
-                break
+        # Uniqueness is enforced by the primary key at insert time, see save()
+        self.cid = ''.join(secrets.choice(self.CID_ALPHABET) for _ in range(self.CID_LENGTH))
 
     def save(self, *args, **kwargs):
-        if not self.cid:
+        if self.cid:
+            return super().save(*args, **kwargs)
+        # Insert straight away instead of check-then-insert, and draw again on the rare collision
+        kwargs['force_insert'] = True
+        for attempt in range(self.MAX_ATTEMPTS):
             self.generate_unique_code()
-        super().save(*args, **kwargs)
+            try:
+                with transaction.atomic(using=kwargs.get('using')):
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                if attempt == self.MAX_ATTEMPTS - 1:
+                    raise
     
+class PointsLedger(models.Model):
+    EARN = 'earn'
+    SPEND = 'spend'
+    ADJUST = 'adjust'
+    REASONS = [(EARN, 'Earned'), (SPEND, 'Spent'), (ADJUST, 'Adjusted')]
+
+    user = models.ForeignKey("AppUser", on_delete=models.CASCADE, related_name='points_entries')
+    delta = models.IntegerField()
+    reason = models.CharField(max_length=10, choices=REASONS)
+    reference = models.CharField(max_length=40, blank=True)  # e.g. "facture:12" or "code:AbCdEf..."
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='ledger_user_id_idx'),
+        ]
+
 class Facture(models.Model):
     transactionIds=models.ManyToManyField("Transaction")
     userId=models.ForeignKey("AppUser", on_delete=models.CASCADE)
     date=models.DateTimeField(auto_now_add=True)
-    
\ No newline at end of file
+    # Stored at checkout so listings never have to sum the lines again
+    total_cost=models.FloatField(null=True)
+    item_count=models.PositiveIntegerField(null=True)
+    points_awarded=models.PositiveIntegerField(null=True)
+    # Set by POS terminals uploading through the batch checkout API, so a resent basket is billed once
+    idempotency_key=models.CharField(max_length=64, unique=True, null=True, blank=True)
+
+    class Meta:
+        # Keyset pagination walks these (date, id) orderings, see pagination.py
+        indexes = [
+            models.Index(fields=['date', 'id'], name='facture_date_id_idx'),
+            models.Index(fields=['userId', 'date', 'id'], name='facture_user_date_id_idx'),
+        ]
+    
+
+class ArchivedFacture(models.Model):
+    """
+    A facture moved out of the hot tables by archive_factures, lines included; see archive.py.
+    """
+    # The id the facture had; SQLite AUTOINCREMENT never hands it out again
+    id=models.BigIntegerField(primary_key=True)
+    userId=models.ForeignKey("AppUser", on_delete=models.CASCADE)
+    date=models.DateTimeField()
+    total_cost=models.FloatField(null=True)
+    item_count=models.PositiveIntegerField(null=True)
+    points_awarded=models.PositiveIntegerField(null=True)
+    idempotency_key=models.CharField(max_length=64, null=True, blank=True)
+    # zlib-compressed JSON of the lines, with the product name and image as they were; see archive.pack_lines
+    lines=models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['userId', 'date', 'id'], name='archived_user_date_id_idx'),
+        ]
+
+
+class DailyProductSales(models.Model):
+    """
+    Units sold and revenue of one product on one day, kept up to date by checkout; see rollups.py.
+    """
+    day=models.DateField()
+    product=models.ForeignKey("Product", on_delete=models.CASCADE)
+    quantity=models.BigIntegerField(default=0)
+    revenue=models.FloatField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['day', 'product'], name='daily_product_sales_key')]
+
+
+class DailyCategorySales(models.Model):
+    day=models.DateField()
+    category=models.ForeignKey("Category", on_delete=models.CASCADE)
+    quantity=models.BigIntegerField(default=0)
+    revenue=models.FloatField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['day', 'category'], name='daily_category_sales_key')]
@@ -0,0 +1,112 @@
+import base64
+import json
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+
+class KeysetPage:
+    """
+    One page of a newest-first listing, with opaque cursors to its neighbours.
+
+    `next` points to older rows and `prev` to newer rows; either is None at the
+    end of the listing.
+    """
+    def __init__(self, items, next=None, prev=None):
+        self.items = items
+        self.next = next
+        self.prev = prev
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(item, direction):
+    date, pk = _key(item)
+    raw = json.dumps([date.isoformat(), pk, direction]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by `encode_cursor`.
+
+    Returns:
+    tuple: (date, id, direction), or None when the cursor is missing or malformed.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        date, pk, direction = json.loads(raw)
+        date = parse_datetime(date)
+    except (ValueError, TypeError):
+        return None
+    if date is None or direction not in ('next', 'prev') or not isinstance(pk, int):
+        return None
+    return date, pk, direction
+
+
+def page_size_from(request, default=PAGE_SIZE):
+    try:
+        size = int(request.GET.get('limit', default))
+    except ValueError:
+        size = default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def paginate(queryset, cursor=None, page_size=PAGE_SIZE):
+    """
+    Paginate a queryset newest-first on (date, id) without OFFSET.
+
+    Every page is a range scan that starts right after the cursor row, so deep
+    pages cost the same as the first one as long as (date, id) is indexed.
+
+    Parameters:
+    queryset (QuerySet): Rows with `date` and `id` fields, as model instances or values() dicts.
+    cursor (str): An opaque cursor from a previous page, or None for the newest page.
+    page_size (int): The number of rows per page.
+
+    Returns:
+    KeysetPage: The rows of the page and the cursors around it.
+    """
+    position = decode_cursor(cursor)
+    if position is None:
+        items = list(queryset.order_by('-date', '-id')[:page_size + 1])
+        more = len(items) > page_size
+        items = items[:page_size]
+        return KeysetPage(items, next=encode_cursor(items[-1], 'next') if more else None)
+
+    date, pk, direction = position
+    if direction == 'next':
+        older = Q(date__lt=date) | Q(date=date, id__lt=pk)
+        items = list(queryset.filter(older).order_by('-date', '-id')[:page_size + 1])
+        more = len(items) > page_size
+        items = items[:page_size]
+        return KeysetPage(
+            items,
+            next=encode_cursor(items[-1], 'next') if more else None,
+            prev=encode_cursor(items[0], 'prev') if items else None,
+        )
+
+    newer = Q(date__gt=date) | Q(date=date, id__gt=pk)
+    items = list(queryset.filter(newer).order_by('date', 'id')[:page_size + 1])
+    more = len(items) > page_size
+    items = items[:page_size][::-1]
+    return KeysetPage(
+        items,
+        next=encode_cursor(items[-1], 'next') if items else None,
+        prev=encode_cursor(items[0], 'prev') if more else None,
+    )
+
+
+def _key(item):
+    if isinstance(item, dict):
+        return item['date'], item['id']
+    return item.date, item.id
@@ -0,0 +1,342 @@
+import asyncio
+import json
+import logging
+import socket
+import threading
+from collections import defaultdict
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 100
+INBOX_CHANNEL = 'inbox'
+HEARTBEAT_SECONDS = 15
+POLL_TIMEOUT_SECONDS = 25
+# Streams are closed after this long and the browser reconnects with Last-Event-ID,
+# which bounds the lifetime of a generator whose client vanished without a FIN.
+STREAM_LIFETIME_SECONDS = 300
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+def message_event(message):
+    """
+    Build the payload pushed to subscribers for a new Message.
+
+    It has the same shape as the rows returned by clientsApp.getUserMessages,
+    plus `senderUsername`, which the staff inbox shows. Load `fromUserId` with
+    the message when building events for several of them.
+    """
+    from clientsApp.serializers import MESSAGE
+    return {**MESSAGE.from_instance(message), 'senderUsername': message.fromUserId.username}
+
+
+class Subscription:
+    """
+    A bounded queue of events for one connected client.
+
+    The queue lives on the event loop of the connection; publishers on other
+    threads hand events over with call_soon_threadsafe. When a slow client lets
+    the queue fill up, new events are dropped and the client catches up from
+    the database on its next reconnect.
+    """
+    def __init__(self, hub, channels):
+        self.hub = hub
+        self.channels = channels
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+
+    def push(self, payload):
+        try:
+            self.loop.call_soon_threadsafe(self._put, payload)
+        except RuntimeError:
+            # The loop of a dropped connection is already closed
+            self.hub.unsubscribe(self)
+
+    def _put(self, payload):
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self, timeout=None):
+        """
+        Wait for the next event.
+
+        Returns:
+        dict: The event payload, or None if `timeout` seconds pass first.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class Hub:
+    """
+    In-process pub/sub: fans published events out to the subscriptions of this worker.
+    """
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, *channels):
+        subscription = Subscription(self, channels)
+        with self._lock:
+            for channel in channels:
+                self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscriptions.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscriptions[channel]
+
+    def deliver(self, channel, payload):
+        with self._lock:
+            subscribers = list(self._subscriptions.get(channel, ()))
+        for subscription in subscribers:
+            subscription.push(payload)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({s for subscribers in self._subscriptions.values() for s in subscribers})
+
+
+class PubSubBackend:
+    """
+    Carries published events to the hub of every worker process.
+
+    Subclasses implement `publish`. `start` is called once with the hub of the
+    current process and must arrange for events from other workers to be
+    passed to `hub.deliver`.
+    """
+    def start(self, hub):
+        self.hub = hub
+
+    def publish(self, channel, payload):
+        raise NotImplementedError
+
+
+class LocalBackend(PubSubBackend):
+    """
+    Single-process backend: events only reach clients connected to this worker.
+    """
+    def publish(self, channel, payload):
+        self.hub.deliver(channel, payload)
+
+
+class BrokerBackend(PubSubBackend):
+    """
+    Multi-process backend that relays events through the `runbroker` command.
+
+    Every worker keeps one TCP connection to the broker and sends each event as
+    a JSON line; the broker echoes every line to every worker, including the
+    sender, whose reader thread then delivers it to the local hub. While the
+    broker is unreachable, events are delivered locally only.
+    """
+    reconnect_delay = 1.0
+
+    def __init__(self, host=None, port=None):
+        default_host, default_port = getattr(settings, 'PUBSUB_BROKER', ('127.0.0.1', 8765))
+        self.address = (host or default_host, port or default_port)
+        self._sock = None
+        self._send_lock = threading.Lock()
+        self._closed = threading.Event()
+
+    def start(self, hub):
+        super().start(hub)
+        threading.Thread(target=self._read_forever, name='pubsub-broker', daemon=True).start()
+
+    def publish(self, channel, payload):
+        line = (json.dumps({'channel': channel, 'payload': payload}) + '\n').encode()
+        with self._send_lock:
+            if self._sock is not None:
+                try:
+                    self._sock.sendall(line)
+                    return
+                except OSError:
+                    self._drop()
+        self.hub.deliver(channel, payload)
+
+    def close(self):
+        self._closed.set()
+        with self._send_lock:
+            self._drop()
+
+    def _read_forever(self):
+        while not self._closed.is_set():
+            try:
+                sock = socket.create_connection(self.address)
+            except OSError:
+                self._closed.wait(self.reconnect_delay)
+                continue
+            with self._send_lock:
+                self._sock = sock
+            try:
+                for line in sock.makefile('rb'):
+                    event = json.loads(line)
+                    self.hub.deliver(event['channel'], event['payload'])
+            except (OSError, ValueError):
+                if self._closed.is_set():
+                    return
+                logger.warning("Lost connection to pub/sub broker at %s:%s", *self.address)
+            with self._send_lock:
+                self._drop()
+
+    def _drop(self):
+        if self._sock is not None:
+            try:
+                # shutdown() also wakes the reader thread blocked on the makefile() stream
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+            self._sock = None
+
+
+class Broker:
+    """
+    Local broker stand-in: rebroadcasts every line it receives to all connected workers.
+    """
+    def __init__(self):
+        self.writers = set()
+
+    async def handle(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            while line := await reader.readline():
+                for peer in list(self.writers):
+                    peer.write(line)
+                await asyncio.gather(*(peer.drain() for peer in list(self.writers)), return_exceptions=True)
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def serve(self, host, port, started=None):
+        server = await asyncio.start_server(self.handle, host, port)
+        if started is not None:
+            started(server)
+        async with server:
+            await server.serve_forever()
+
+
+hub = Hub()
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            backend = import_string(getattr(settings, 'PUBSUB_BACKEND', 'caisseApp.realtime.LocalBackend'))()
+            backend.start(hub)
+            _backend = backend
+        return _backend
+
+
+def publish(channel, payload):
+    get_backend().publish(channel, payload)
+
+
+async def authenticated_user(request):
+    """
+    Resolve `request.user` from an async view.
+
+    Returns:
+    AppUser: The logged-in user, or None for anonymous requests.
+    """
+    def resolve():
+        return request.user if request.user.is_authenticated else None
+    return await sync_to_async(resolve)()
+
+
+async def subscribe(channel, read_backlog):
+    """
+    Subscribe to `channel`, then read the events a client missed.
+
+    Subscribing first means no event falls between the backlog and the live
+    ones; if starting the backend or reading the backlog fails, the
+    subscription is closed again instead of staying in the hub.
+
+    Parameters:
+    channel (str): The channel to subscribe to.
+    read_backlog (callable): Returns the missed events; runs in a thread, as it queries the database.
+
+    Returns:
+    tuple: (Subscription, list of backlog events).
+    """
+    subscription = hub.subscribe(channel)
+    try:
+        await sync_to_async(get_backend)()
+        return subscription, await sync_to_async(read_backlog)()
+    except BaseException:
+        subscription.close()
+        raise
+
+
+async def event_stream(subscription, backlog=()):
+    """
+    Yield Server-Sent Events: first the backlog, then live events from the subscription.
+
+    Events already covered by the backlog are skipped, since the subscription
+    is opened before the backlog is read so that nothing falls in between.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + STREAM_LIFETIME_SECONDS
+    last_id = 0
+    try:
+        yield "retry: 2000\n\n"
+        for payload in backlog:
+            last_id = max(last_id, payload['id'])
+            yield _sse(payload)
+        while loop.time() < deadline:
+            payload = await subscription.get(HEARTBEAT_SECONDS)
+            if payload is None:
+                yield ": keepalive\n\n"
+            elif payload['id'] > last_id:
+                last_id = payload['id']
+                yield _sse(payload)
+    finally:
+        subscription.close()
+
+
+async def wait_for_events(subscription, backlog):
+    """
+    Long-poll fallback: return the backlog at once, or wait for the next live event.
+
+    Returns:
+    list: The events to send, empty if nothing arrived before the poll timeout.
+    """
+    try:
+        if backlog:
+            return list(backlog)
+        payload = await subscription.get(POLL_TIMEOUT_SECONDS)
+        return [payload] if payload is not None else []
+    finally:
+        subscription.close()
+
+
+def sse_response(subscription, backlog=()):
+    response = StreamingHttpResponse(event_stream(subscription, backlog), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _sse(payload):
+    return f"id: {payload['id']}\nevent: message\ndata: {json.dumps(payload)}\n\n"
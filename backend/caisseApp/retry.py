@@ -0,0 +1,34 @@
+import random
+import time
+from functools import wraps
+from django.db import OperationalError,connection
+
+
+ATTEMPTS = 4
+BACKOFF = 0.05
+
+
+def retry_when_locked(function):
+    """
+    Retry a write transaction a few times if the database stays locked.
+
+    SQLite's busy_timeout already waits for the current writer; this covers
+    bursts that outlast it. Only the outermost transaction can be retried, so
+    inside an atomic block the error is left to the caller. Retries back off
+    exponentially with jitter, so queued writers don't wake up together.
+    """
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        for attempt in range(ATTEMPTS):
+            try:
+                return function(*args, **kwargs)
+            except OperationalError as e:
+                if connection.in_atomic_block or not _is_lock_error(e) or attempt == ATTEMPTS - 1:
+                    raise
+                time.sleep(BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+    return wrapper
+
+
+def _is_lock_error(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
@@ -0,0 +1,72 @@
+"""
+Daily sales rollups.
+
+DailyProductSales and DailyCategorySales hold, per day, the units sold and the
+revenue of each product and category. Checkout adds its lines to them in the
+same transaction, with one upsert per table, so reports read a few hundred
+rollup rows instead of grouping the whole Transaction/Facture history. The
+rebuild_rollups command recomputes them from the raw lines.
+"""
+from collections import defaultdict
+from django.db import connection
+from django.db.models import Sum
+from .models import DailyCategorySales,DailyProductSales
+
+
+def record(day, lines):
+    """
+    Add sold lines to the rollups of `day`. Must run inside the checkout transaction.
+
+    Parameters:
+    day (date): The sales day.
+    lines (iterable): (product ID, category ID, quantity, revenue) tuples.
+    """
+    products = defaultdict(lambda: [0, 0.0])
+    categories = defaultdict(lambda: [0, 0.0])
+    for product_id, category_id, quantity, revenue in lines:
+        for totals in (products[product_id], categories[category_id]):
+            totals[0] += quantity
+            totals[1] += revenue
+    increment(DailyProductSales, 'product_id', [(day, key, *totals) for key, totals in products.items()])
+    increment(DailyCategorySales, 'category_id', [(day, key, *totals) for key, totals in categories.items()])
+
+
+def increment(model, key_column, rows):
+    """
+    Add (day, key, quantity, revenue) rows to a rollup table, creating missing rows.
+
+    One INSERT ... ON CONFLICT DO UPDATE, executed for every row in a single
+    call, so concurrent checkouts never race on a read-modify-write of the same
+    day and bulk loads stay within SQLite's parameter limit.
+    """
+    if not rows:
+        return
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {table} (day, {key_column}, quantity, revenue) VALUES (%s, %s, %s, %s) "
+            f"ON CONFLICT (day, {key_column}) DO UPDATE SET "
+            f"quantity = {table}.quantity + excluded.quantity, revenue = {table}.revenue + excluded.revenue",
+            rows,
+        )
+
+
+def sales_by_day(start, end):
+    return list(
+        DailyCategorySales.objects.filter(day__range=(start, end)).values('day')
+        .annotate(quantity=Sum('quantity'), revenue=Sum('revenue')).order_by('day')
+    )
+
+
+def sales_by_product(start, end):
+    return list(
+        DailyProductSales.objects.filter(day__range=(start, end)).values('product', 'product__name')
+        .annotate(quantity=Sum('quantity'), revenue=Sum('revenue')).order_by('-revenue', 'product')
+    )
+
+
+def sales_by_category(start, end):
+    return list(
+        DailyCategorySales.objects.filter(day__range=(start, end)).values('category', 'category__name')
+        .annotate(quantity=Sum('quantity'), revenue=Sum('revenue')).order_by('-revenue', 'category')
+    )
@@ -0,0 +1,143 @@
+"""
+Primary/replica database routing.
+
+Every write goes to the `default` (primary) database. Reads go there too,
+except inside views decorated with `replica_reads`, or code wrapped in
+`reading_from_replica()`, which read from one of settings.DATABASE_REPLICAS.
+`reading_from_primary()` opts a block back out, for reads whose result
+outlives the request, such as the cached catalog payloads.
+
+Replicas lag behind the primary, so a client that has just written is pinned
+to the primary for REPLICA_STICKY_SECONDS: ReplicaStickinessMiddleware notices
+the write and sets a short-lived cookie, and replica_reads honours it. Within
+a request, a write also sends the reads that follow it to the primary.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from asgiref.sync import iscoroutinefunction,markcoroutinefunction
+from django.conf import settings
+
+
+PIN_COOKIE = 'db_pin'
+# Session rows are rewritten on almost every request: they are not data a client reads back
+UNTRACKED_APPS = {'sessions'}
+
+_replica_ok = ContextVar('replica_ok', default=False)
+_request = ContextVar('db_request_state', default=None)
+
+
+class _RequestState:
+    def __init__(self):
+        self.wrote = False
+
+
+def replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', ()))
+
+
+def pick_replica():
+    """
+    Return a replica alias, or 'default' when no replica is configured.
+    """
+    aliases = replicas()
+    return random.choice(aliases) if aliases else 'default'
+
+
+@contextmanager
+def reading_from_replica():
+    """
+    Route the reads of the enclosed block to a replica.
+    """
+    token = _replica_ok.set(True)
+    try:
+        yield
+    finally:
+        _replica_ok.reset(token)
+
+
+@contextmanager
+def reading_from_primary():
+    """
+    Route the reads of the enclosed block to the primary, even inside `replica_reads`.
+    """
+    token = _replica_ok.set(False)
+    try:
+        yield
+    finally:
+        _replica_ok.reset(token)
+
+
+def replica_reads(view):
+    """
+    Let a read-only view read from a replica, unless its client has just written.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if PIN_COOKIE in request.COOKIES:
+            return view(request, *args, **kwargs)
+        with reading_from_replica():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _request.get()
+        if _replica_ok.get() and not (state and state.wrote):
+            return pick_replica()
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        state = _request.get()
+        if state is not None and model._meta.app_label not in UNTRACKED_APPS:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Pin a client to the primary for a few seconds after any request that wrote.
+
+    Async-capable, so the streaming views are not pushed onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        state = _RequestState()
+        token = _request.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request.reset(token)
+        return self._pin(response, state)
+
+    async def _acall(self, request):
+        state = _RequestState()
+        token = _request.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request.reset(token)
+        return self._pin(response, state)
+
+    def _pin(self, response, state):
+        if state.wrote and replicas():
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_STICKY_SECONDS, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,97 @@
+"""
+Product lookup for the caisse screen.
+
+A scanned or typed SKU resolves through the unique index on Product.sku.
+Text queries on SQLite go through an FTS5 index over the product name and
+description, an external-content table kept in sync by triggers, so it adds
+no work to the code that writes products. Other databases fall back to a
+case-insensitive substring match.
+"""
+import re
+from django.db import connection,connections
+from .models import Product
+
+
+FTS_TABLE = 'caisseApp_product_fts'
+RESULT_LIMIT = 20
+# Only this many matches are ranked: ranking every match of a short prefix costs
+# tens of milliseconds on a large catalog, and the cashier keeps typing anyway
+RANK_WINDOW = 100
+FIELDS = ('id', 'name', 'price', 'sku')
+
+
+def ensure_index(using='default'):
+    """
+    Create the FTS5 table and its triggers if they are missing, and fill it.
+
+    Runs after every migrate (see apps.py); a no-op on databases other than SQLite.
+    """
+    conn = connections[using]
+    if conn.vendor != 'sqlite':
+        return
+    product = conn.ops.quote_name(Product._meta.db_table)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        if cursor.fetchone():
+            return
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(name, description, content={product}, "
+            f"content_rowid=id, tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')"
+        )
+        old = f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);"
+        new = f"INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);"
+        cursor.execute(f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {product} BEGIN {new} END")
+        cursor.execute(f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {product} BEGIN {old} END")
+        cursor.execute(f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF name, description ON {product} BEGIN {old} {new} END")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def match_expression(query):
+    """
+    Turn typed text into an FTS5 query: every word must match, the last one as a prefix.
+    """
+    words = re.findall(r'\w+', query)
+    terms = ['"%s"' % word for word in words]
+    if terms and query[-1:].isalnum():
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_products(query, limit=RESULT_LIMIT):
+    """
+    Find products by exact SKU, SKU prefix, or words of their name and description.
+
+    Parameters:
+    query (str): A scanned barcode or typed text.
+    limit (int): The maximum number of results.
+
+    Returns:
+    list: Product dicts (id, name, price, sku): SKU matches first, then text
+    matches by relevance. An exact SKU match is returned alone.
+    """
+    query = query.strip()
+    if not query:
+        return []
+    # A range rather than LIKE, so SQLite can walk the unique index
+    by_sku = list(Product.objects.filter(sku__gte=query, sku__lt=query + '\U0010ffff')
+                  .order_by('sku').values(*FIELDS)[:limit])
+    found = {row['id'] for row in by_sku}
+    remaining = limit - len(by_sku)
+    if remaining <= 0 or (by_sku and by_sku[0]['sku'] == query):
+        # A scan: the exact match is all the cashier needs
+        return by_sku
+    if connection.vendor == 'sqlite':
+        expression = match_expression(query)
+        if not expression:
+            return by_sku
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM (SELECT rowid, rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s LIMIT %s) "
+                f"ORDER BY rank LIMIT %s",
+                [expression, RANK_WINDOW, limit],
+            )
+            ids = [row[0] for row in cursor.fetchall() if row[0] not in found][:remaining]
+        rows = {row['id']: row for row in Product.objects.filter(pk__in=ids).values(*FIELDS)}
+        return by_sku + [rows[pk] for pk in ids if pk in rows]
+    return by_sku + list(Product.objects.filter(name__icontains=query).exclude(pk__in=found)
+                         .order_by('name').values(*FIELDS)[:remaining])
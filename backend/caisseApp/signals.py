@@ -0,0 +1,41 @@
+from django.db import transaction
+from django.db.models.signals import post_delete,post_save,pre_save
+from django.dispatch import receiver
+from . import images
+from .catalog import bump_catalog_version
+from .models import Category,Gift,Message,Product
+from .realtime import INBOX_CHANNEL,message_event,publish,user_channel
+
+
+@receiver(post_save, sender=Message)
+def push_new_message(sender, instance, created, **kwargs):
+    # Push once the row is committed, so a client reloading from the DB always finds it
+    if not created:
+        return
+    payload = message_event(instance)
+    channels = {INBOX_CHANNEL, user_channel(instance.fromUserId_id), user_channel(instance.toUserId_id)}
+
+    def send():
+        for channel in channels:
+            publish(channel, payload)
+    transaction.on_commit(send)
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Gift)
+def invalidate_catalog(sender, **kwargs):
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(pre_save, sender=Product)
+def note_image_upload(sender, instance, **kwargs):
+    # The upload is only written to storage during save, so this is the last point it can be told apart
+    instance._image_uploaded = bool(instance.image) and not instance.image._committed
+
+
+@receiver(post_save, sender=Product)
+def schedule_image_variants(sender, instance, **kwargs):
+    # Images that predate the pipeline are left to the build_image_variants command
+    if instance.__dict__.pop('_image_uploaded', False):
+        transaction.on_commit(lambda: images.schedule(instance.pk))
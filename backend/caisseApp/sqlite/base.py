@@ -0,0 +1,63 @@
+"""
+SQLite backend tuned for several worker processes sharing one database file.
+
+Use it as ENGINE 'caisseApp.sqlite'. On top of the stock backend it reads two
+extra OPTIONS:
+
+pragmas (dict): PRAGMA name -> value, run on every new connection.
+transaction_mode (str): How atomic blocks open their transaction: DEFERRED
+    (SQLite's default), IMMEDIATE or EXCLUSIVE. IMMEDIATE takes the write lock
+    at BEGIN, where a busy writer is waited for by busy_timeout, instead of at
+    the first write of a transaction that may already have read, where SQLite
+    can only fail with "database is locked".
+
+Long reads that must not hold the write lock, such as a streamed export, use
+DatabaseWrapper.read_snapshot() instead of atomic().
+"""
+from contextlib import ExitStack,contextmanager
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.backends.sqlite3 import base
+
+
+TRANSACTION_MODES = {'DEFERRED', 'IMMEDIATE', 'EXCLUSIVE'}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    pragmas = {}
+    transaction_mode = 'DEFERRED'
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        # Not sqlite3.connect() arguments: keep them for get_new_connection and _start_transaction
+        self.pragmas = kwargs.pop('pragmas', {})
+        self.transaction_mode = kwargs.pop('transaction_mode', 'DEFERRED').upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"transaction_mode must be one of {sorted(TRANSACTION_MODES)}.")
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
+
+    @contextmanager
+    def read_snapshot(self):
+        """
+        An atomic block opened with BEGIN DEFERRED, whatever transaction_mode says.
+
+        It reads a single snapshot of the database and takes no lock until a
+        write, so writers can commit alongside it however long it stays open.
+        Inside an outer atomic block it is a savepoint like any other.
+        """
+        with ExitStack() as stack:
+            mode, self.transaction_mode = self.transaction_mode, 'DEFERRED'
+            try:
+                stack.enter_context(transaction.atomic(using=self.alias))
+            finally:
+                self.transaction_mode = mode
+            yield
@@ -0,0 +1,53 @@
+"""
+Content-addressed media storage.
+
+Uploads are named after a hash of their bytes, so the same image uploaded
+twice is stored once, and a stored name never changes content: its URL can
+be cached forever. Resized variants (caisseApp.images) derive their names from
+the original's, so they inherit the same property.
+"""
+import hashlib
+import os
+import re
+from django.core.files.storage import FileSystemStorage
+
+
+HASH_LENGTH = 32
+# A content hash, optionally followed by a variant suffix such as `_thumb`
+HASHED_NAME = re.compile(r'^[0-9a-f]{%d}(_[a-z]+)?\.[0-9a-z]+$' % HASH_LENGTH)
+
+
+def content_hash(content):
+    """
+    Hash a django File; chunks() rewinds it, so it can be read again afterwards.
+    """
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def is_hashed(name):
+    return bool(HASHED_NAME.match(os.path.basename(name)))
+
+
+class ContentHashStorage(FileSystemStorage):
+    """
+    A FileSystemStorage that stores each file under the hash of its content.
+
+    The directory and the (lowercased) extension of the requested name are
+    kept. Saving bytes that are already stored writes nothing and returns the
+    existing name.
+    """
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        name = os.path.join(directory, content_hash(content) + extension)
+        if self.exists(name):
+            return name
+        # Two concurrent uploads of new bytes can still race here: the loser gets a
+        # suffixed copy from get_available_name, which is wasteful but correct
+        return super()._save(name, content)
+
+
+media_storage = ContentHashStorage()
@@ -0,0 +1,284 @@
+"""
+Production-shaped synthetic data, generated fast and reproducibly.
+
+Rows are built in memory a chunk at a time and written with one executemany
+per table, with primary keys assigned here, so the whole graph (factures, their
+lines and through-rows, points ledger, gift codes, daily rollups, messages)
+is linked without reading anything back. Every user shares one password hash,
+computed once.
+
+The data has the shapes that matter to the queries: product popularity follows
+a Zipf law, a minority of active customers makes most of the purchases, basket
+sizes are skewed towards a few items, and points are earned and spent as the
+checkout and redemption code would have done. The same seed on the same
+starting database produces the same rows.
+"""
+import random
+import time
+from contextlib import contextmanager
+from bisect import bisect
+from dataclasses import dataclass,field
+from datetime import datetime,timedelta
+from itertools import accumulate
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connection,transaction
+from django.db.models import Max
+from django.utils import timezone
+from . import rollups
+from .checkout import POINTS_DIVISOR
+from .models import (AppUser,Category,Code,DailyCategorySales,DailyProductSales,Facture,Gift,Message,
+                     PointsLedger,Product,Transaction)
+
+
+WORDS = ('chocolate', 'milk', 'orange', 'juice', 'green', 'tea', 'coffee', 'biscuit', 'almond', 'vanilla',
+         'sparkling', 'water', 'honey', 'mint', 'lemon', 'olive', 'bread', 'butter', 'cheese', 'yogurt')
+ZIPF_EXPONENT = 1.1
+ACTIVE_WEIGHT = 20
+REDEEM_RATE = 0.05
+OPENING_HOURS = (8, 20)
+
+
+@dataclass
+class Shape:
+    categories: int = 20
+    products: int = 2000
+    gifts: int = 50
+    users: int = 10000
+    active_share: float = 0.2
+    factures: int = 100000
+    days: int = 365
+    threads: int = 5000
+    chunk_size: int = 10000
+    password: str = 'secret'
+
+
+@dataclass
+class Report:
+    rows: dict = field(default_factory=dict)
+    seconds: float = 0.0
+
+    @property
+    def total(self):
+        return sum(self.rows.values())
+
+    @property
+    def rate(self):
+        return self.total / self.seconds if self.seconds else 0.0
+
+
+def _next_ids(*models):
+    return [(model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1 for model in models]
+
+
+class Generator:
+    """
+    Append one `Shape` worth of rows after whatever the database already holds.
+    """
+    def __init__(self, shape, seed=0):
+        self.shape = shape
+        self.seed = seed
+        self.report = Report()
+
+    def database_time(self, moment):
+        """
+        The naive datetime the database stores for local time `moment` (UTC when USE_TZ).
+
+        Adding a timedelta to it and taking str() gives the stored form directly,
+        without adapting every row.
+        """
+        value = connection.ops.adapt_datetimefield_value(timezone.make_aware(moment) if settings.USE_TZ else moment)
+        return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+    def insert(self, model, columns, rows):
+        if not rows:
+            return
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {quote(model._meta.db_table)} ({', '.join(quote(c) for c in columns)}) "
+                f"VALUES ({', '.join(['%s'] * len(columns))})",
+                rows,
+            )
+        self.report.rows[model._meta.db_table] = self.report.rows.get(model._meta.db_table, 0) + len(rows)
+
+    @contextmanager
+    def deferred_indexes(self, *models):
+        """
+        Drop the non-unique indexes of `models` for the duration of the block and recreate them after.
+
+        SQLite builds an index from the finished table far faster than it updates
+        it row by row. Unique indexes are constraints and stay. Other databases
+        keep all their indexes.
+        """
+        if connection.vendor != 'sqlite':
+            yield
+            return
+        tables = [model._meta.db_table for model in models]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+                f"AND sql NOT LIKE 'CREATE UNIQUE%%' AND tbl_name IN ({', '.join(['%s'] * len(tables))})",
+                tables,
+            )
+            indexes = cursor.fetchall()
+            for name, _ in indexes:
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                for _, sql in indexes:
+                    cursor.execute(sql)
+
+    def run(self):
+        started = time.perf_counter()
+        shape = self.shape
+        category_id, product_id, gift_id, user_id, facture_id, line_id, through_id, ledger_id, message_id = _next_ids(
+            Category, Product, Gift, AppUser, Facture, Transaction, Facture.transactionIds.through,
+            PointsLedger, Message,
+        )
+        # Seeded with the starting ids too, so a second run into the same database draws fresh codes
+        rng = random.Random(f'{self.seed}-{user_id}-{facture_id}')
+
+        with transaction.atomic():
+            categories = list(range(category_id, category_id + shape.categories))
+            self.insert(Category, ('id', 'name'), [(pk, f'{WORDS[pk % len(WORDS)].title()} {pk}') for pk in categories])
+
+            products = list(range(product_id, product_id + shape.products))
+            prices = {}
+            rows = []
+            for pk in products:
+                prices[pk] = (round(min(max(rng.lognormvariate(2.5, 0.8), 0.5), 500), 2), rng.choice(categories))
+                rows.append((pk, ' '.join(rng.sample(WORDS, 2)).title() + f' {pk}', prices[pk][0],
+                             ' '.join(rng.sample(WORDS, 6)), prices[pk][1], '', f'G{pk:012d}', ''))
+            self.insert(Product, ('id', 'name', 'price', 'description', 'category_id', 'image', 'sku', 'variants_for'),
+                        rows)
+
+            gifts = [(pk, 10 * rng.randint(2, 20)) for pk in range(gift_id, gift_id + shape.gifts)]
+            self.insert(Gift, ('id', 'productId_id', 'pointCost'), [(pk, rng.choice(products), cost) for pk, cost in gifts])
+
+        # Popularity: the product at rank r sells in proportion to 1 / r^s
+        by_rank = products[:]
+        rng.shuffle(by_rank)
+        product_weights = list(accumulate(1 / rank ** ZIPF_EXPONENT for rank in range(1, len(by_rank) + 1)))
+
+        password = make_password(shape.password)
+        shop = AppUser.objects.filter(is_staff=True).order_by('pk').values_list('pk', flat=True).first()
+        users = list(range(user_id, user_id + shape.users))
+        if shop is None:
+            shop, users = users[0], users[1:]
+        active = set(rng.sample(users, int(len(users) * shape.active_share)))
+        user_weights = list(accumulate(ACTIVE_WEIGHT if pk in active else 1 for pk in users))
+        for start in range(0, shape.users, shape.chunk_size):
+            with transaction.atomic():
+                self.insert(AppUser, ('id', 'password', 'last_login', 'is_superuser', 'username', 'points', 'email',
+                                      'is_active', 'is_staff', 'points_through', 'token_version'), [
+                    (pk, password, None, False, f'gen{pk}', 0, f'gen{pk}@example.invalid', True, pk == shop, 0, 0)
+                    for pk in range(user_id + start, min(user_id + start + shape.chunk_size, user_id + shape.users))
+                ])
+
+        # The plain indexes of the big tables are built once at the end, from sorted rows
+        with self.deferred_indexes(Facture, Transaction, Facture.transactionIds.through, PointsLedger, Message):
+            balances = {}
+            today = timezone.localdate()
+            # History ends yesterday, so nothing is dated in the future
+            first_day = today - timedelta(days=shape.days)
+            opening, closing = OPENING_HOURS
+            midnights = {}
+            for start in range(0, shape.factures, shape.chunk_size):
+                factures, lines, through, ledger, codes = [], [], [], [], []
+                sold = {}
+                for n in range(start, min(start + shape.chunk_size, shape.factures)):
+                    # Spread over the days in order, so ids grow with dates as they do in production
+                    day = first_day + timedelta(days=n * shape.days // shape.factures)
+                    if day not in midnights:
+                        midnights[day] = self.database_time(datetime.combine(day, datetime.min.time()))
+                    stamp = str(midnights[day] + timedelta(seconds=rng.uniform(opening * 3600, closing * 3600)))
+                    customer = users[bisect(user_weights, rng.random() * user_weights[-1])]
+
+                    basket = {}
+                    for _ in range(1 + min(int(rng.expovariate(1 / 3)), 30)):
+                        pk = by_rank[bisect(product_weights, rng.random() * product_weights[-1])]
+                        basket[pk] = basket.get(pk, 0) + (1 if rng.random() < 0.7 else rng.randint(2, 6))
+                    total = items = 0
+                    for pk, quantity in basket.items():
+                        price = prices[pk][0]
+                        line_total = price * quantity
+                        lines.append((line_id, pk, quantity, price, line_total))
+                        through.append((through_id, facture_id, line_id))
+                        line_id += 1
+                        through_id += 1
+                        total += line_total
+                        items += quantity
+                        totals = sold.get((day, pk))
+                        if totals is None:
+                            totals = sold[day, pk] = [0, 0.0]
+                        totals[0] += quantity
+                        totals[1] += line_total
+                    points = int(total // POINTS_DIVISOR)
+                    factures.append((facture_id, customer, stamp, total, items, points, None))
+                    if points:
+                        ledger.append((ledger_id, customer, points, PointsLedger.EARN, f'facture:{facture_id}', stamp))
+                        ledger_id += 1
+                        balances[customer] = balances.get(customer, 0) + points
+                    facture_id += 1
+
+                    if gifts and rng.random() < REDEEM_RATE:
+                        gift, cost = rng.choice(gifts)
+                        if balances.get(customer, 0) >= cost:
+                            cid = ''.join(rng.choices(Code.CID_ALPHABET, k=Code.CID_LENGTH))
+                            codes.append((cid, gift, customer, None))
+                            ledger.append((ledger_id, customer, -cost, PointsLedger.SPEND, f'code:{cid}', stamp))
+                            ledger_id += 1
+                            balances[customer] -= cost
+
+                with transaction.atomic():
+                    self.insert(Facture, ('id', 'userId_id', 'date', 'total_cost', 'item_count', 'points_awarded',
+                                          'idempotency_key'), factures)
+                    self.insert(Transaction, ('id', 'productId_id', 'quantity', 'unit_price', 'line_total'), lines)
+                    self.insert(Facture.transactionIds.through, ('id', 'facture_id', 'transaction_id'), through)
+                    self.insert(PointsLedger, ('id', 'user_id', 'delta', 'reason', 'reference', 'created'), ledger)
+                    self.insert(Code, ('cid', 'giftId_id', 'userId_id', 'idempotency_key'), codes)
+                    by_category = {}
+                    for (day, pk), (quantity, revenue) in sold.items():
+                        totals = by_category.setdefault((day, prices[pk][1]), [0, 0.0])
+                        totals[0] += quantity
+                        totals[1] += revenue
+                    rollups.increment(DailyProductSales, 'product_id',
+                                      [(day, pk, *totals) for (day, pk), totals in sold.items()])
+                    rollups.increment(DailyCategorySales, 'category_id',
+                                      [(day, pk, *totals) for (day, pk), totals in by_category.items()])
+
+            # Fold the generated entries into the balance snapshots, as ledger.compact would
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.executemany(
+                        f"UPDATE {connection.ops.quote_name(AppUser._meta.db_table)} "
+                        f"SET points = %s, points_through = %s WHERE id = %s",
+                        [(points, ledger_id - 1, pk) for pk, points in balances.items()],
+                    )
+
+            self.messages(rng, shop, users, user_weights, first_day, message_id)
+        self.report.seconds = time.perf_counter() - started
+        return self.report
+
+    def messages(self, rng, shop, users, user_weights, first_day, message_id):
+        shape = self.shape
+        span = shape.days * 86400
+        start = self.database_time(datetime.combine(first_day, datetime.min.time()))
+        rows = []
+        for _ in range(shape.threads):
+            customer = users[bisect(user_weights, rng.random() * user_weights[-1])]
+            moment = start + timedelta(seconds=rng.uniform(0, span))
+            for turn in range(rng.randint(1, 6)):
+                sender, recipient = (customer, shop) if turn % 2 == 0 else (shop, customer)
+                rows.append((message_id, sender, recipient, str(moment), ' '.join(rng.choices(WORDS, k=8))))
+                message_id += 1
+                moment += timedelta(minutes=rng.expovariate(1 / 30))
+            if len(rows) >= shape.chunk_size:
+                with transaction.atomic():
+                    self.insert(Message, ('id', 'fromUserId_id', 'toUserId_id', 'date', 'text'), rows)
+                rows = []
+        with transaction.atomic():
+            self.insert(Message, ('id', 'fromUserId_id', 'toUserId_id', 'date', 'text'), rows)
@@ -1,3 +1,1273 @@
-from django.test import TestCase
+from datetime import timedelta
+import csv
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import zipfile
+from io import BytesIO,StringIO
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import OperationalError,connection,connections,transaction
+from django.test import Client,SimpleTestCase,TestCase,TransactionTestCase,override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.db.models import F,Sum
+from django.utils import timezone
+from PIL import Image
+from . import archive,export,images,ledger,loadbench,metrics,realtime,rollups
+from . import urls as caisse_urls
+from .archive import unpack_lines
+from .catalog_import import CatalogImportError,import_catalog
+from .codes import mint_codes
+from clientsApp.tokens import issue_tokens
+from .checkout import checkout
+from .models import (Product,AppUser,ArchivedFacture,Category,Code,DailyCategorySales,DailyProductSales,Facture,Gift,
+                     Message,PointsLedger,Transaction)
+from .pagination import paginate
+from .retry import retry_when_locked
+from .search import search_products
+from .synthetic import Generator,Shape
+from .routing import PIN_COOKIE,PrimaryReplicaRouter,reading_from_replica
 
-# Create your tests here.
+
+class CaisseCheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cashier = AppUser.objects.create_user('cashier', 'cashier@example.com', 'secret', is_staff=True)
+        cls.customer = AppUser.objects.create_user('client', 'client@example.com', 'secret')
+        category = Category.objects.create(name='Snacks')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'Product {i}', price=10.0 + i, description='', category=category, image='p.jpg')
+            for i in range(200)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.cashier)
+
+    def post_basket(self, products):
+        data = {'userId': self.customer.id, 'products': [str(p.id) for p in products]}
+        for p in products:
+            data[f'quantity_{p.id}'] = 5
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('caisse'), data)
+        self.assertEqual(response.status_code, 302)
+        return len(ctx.captured_queries)
+
+    def test_checkout_records_lines_and_points(self):
+        self.post_basket(self.products[:3])
+        fac = Facture.objects.get()
+        self.assertEqual(sorted(t.quantity for t in fac.transactionIds.all()), [5, 5, 5])
+        self.assertEqual(ledger.balance(self.customer.id), int((10 + 11 + 12) * 5 // 50))
+
+    def test_checkout_stores_price_snapshot_and_totals(self):
+        self.post_basket(self.products[:2])
+        fac = Facture.objects.get()
+        self.assertEqual((fac.total_cost, fac.item_count, fac.points_awarded), (105.0, 10, 2))
+        self.assertEqual(sorted(t.line_total for t in fac.transactionIds.all()), [50.0, 55.0])
+        Product.objects.filter(pk=self.products[0].pk).update(price=99)
+        response = self.client.get(reverse('facture', args=[fac.id]))
+        self.assertContains(response, '105.0 MAD')
+
+    def test_checkout_query_count_is_constant(self):
+        small = self.post_basket(self.products[:1])
+        large = self.post_basket(self.products)
+        self.assertEqual(small, large)
+        self.assertEqual(Facture.objects.count(), 2)
+
+    def test_unknown_user_renders_form(self):
+        response = self.client.post(reverse('caisse'), {'userId': 999999, 'products': [self.products[0].id]})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Facture.objects.exists())
+
+
+class BackfillTotalsTests(TestCase):
+    def test_backfill_fills_missing_totals(self):
+        user = AppUser.objects.create_user('client', 'client@example.com', 'secret')
+        category = Category.objects.create(name='Drinks')
+        product = Product.objects.create(name='Tea', price=20.0, description='', category=category, image='t.jpg')
+        fac = Facture.objects.create(userId=user)
+        fac.transactionIds.add(Transaction.objects.create(productId=product, quantity=3))
+        call_command('backfill_totals', chunk_size=1, stdout=StringIO())
+        fac.refresh_from_db()
+        self.assertEqual((fac.total_cost, fac.item_count, fac.points_awarded), (60.0, 3, 1))
+        self.assertEqual(fac.transactionIds.get().unit_price, 20.0)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = AppUser.objects.create_user('client', 'client@example.com', 'secret')
+        Facture.objects.bulk_create([Facture(userId=cls.user) for _ in range(7)])
+        # Ties on date must still page deterministically through the id tiebreaker
+        Facture.objects.filter(pk__lte=4).update(date=timezone.now() - timedelta(days=1))
+
+    def walk(self, direction, cursor, pages):
+        ids = []
+        for _ in range(pages):
+            page = paginate(Facture.objects.all(), cursor, page_size=3)
+            ids.append([f.id for f in page])
+            cursor = getattr(page, direction)
+        return ids, cursor
+
+    def test_pages_forward_and_back(self):
+        expected = list(Facture.objects.order_by('-date', '-id').values_list('id', flat=True))
+        first = paginate(Facture.objects.all(), None, page_size=3)
+        self.assertIsNone(first.prev)
+        pages, end = self.walk('next', first.next, 2)
+        self.assertEqual([f.id for f in first] + pages[0] + pages[1], expected)
+        self.assertIsNone(end)
+        last = paginate(Facture.objects.all(), first.next, page_size=3)
+        back = paginate(Facture.objects.all(), last.prev, page_size=3)
+        self.assertEqual([f.id for f in back], [f.id for f in first])
+        self.assertIsNone(back.prev)
+
+    def test_malformed_cursor_returns_first_page(self):
+        page = paginate(Facture.objects.all(), 'not-a-cursor', page_size=3)
+        self.assertEqual(len(page), 3)
+        self.assertIsNone(page.prev)
+
+    def test_history_renders_page_links(self):
+        staff = AppUser.objects.create_user('cashier', 'cashier@example.com', 'secret', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse('history'), {'limit': 3})
+        self.assertEqual(len(response.context['factures']), 3)
+        self.assertContains(response, '?cursor=' + response.context['factures'].next)
+
+
+class GiftCodeMintingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [AppUser.objects.create_user(f'u{i}', f'u{i}@example.com', 'secret') for i in range(3)]
+        category = Category.objects.create(name='Drinks')
+        product = Product.objects.create(name='Tea', price=20.0, description='', category=category, image='t.jpg')
+        cls.gift = Gift.objects.create(productId=product, pointCost=100)
+
+    def test_mint_issues_one_code_per_entry(self):
+        user_ids = [u.id for u in self.users] * 2
+        report = mint_codes(self.gift.id, user_ids, batch_size=4)
+        self.assertEqual(report.count, 6)
+        self.assertEqual(len(set(report.cids)), 6)
+        owners = dict(Code.objects.values_list('cid', 'userId'))
+        self.assertEqual([owners[cid] for cid in report.cids], user_ids)
+
+    def test_collisions_are_redrawn(self):
+        taken = Code.objects.create(cid='A' * 12, giftId=self.gift, userId=self.users[2])
+        draws = iter([['A' * 12, 'B' * 12, 'B' * 12], ['C' * 12, 'D' * 12]])
+        with mock.patch.object(Code, 'random_cids', side_effect=lambda n: next(draws)[:n]):
+            report = mint_codes(self.gift.id, [u.id for u in self.users])
+        self.assertEqual(sorted(report.cids), ['B' * 12, 'C' * 12, 'D' * 12])
+        self.assertEqual(report.collisions, 2)
+        self.assertEqual(Code.objects.get(pk=taken.pk).userId_id, self.users[2].id)
+
+    def test_random_cids_use_letters_only(self):
+        cids = Code.random_cids(50)
+        self.assertEqual(len(cids), 50)
+        self.assertTrue(all(len(cid) == 12 and cid.isalpha() and cid.isascii() for cid in cids))
+
+    def test_save_generates_a_code(self):
+        code = Code.objects.create(giftId=self.gift, userId=self.users[0])
+        self.assertEqual(len(code.cid), 12)
+
+    def test_command_reports_rate(self):
+        out = StringIO()
+        call_command('mint_codes', self.gift.id, users=','.join(str(u.id) for u in self.users), per_user=2, stdout=out)
+        self.assertIn('Minted 6 codes', out.getvalue())
+        self.assertEqual(Code.objects.count(), 6)
+
+
+class PointsLedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = AppUser.objects.create_user('client', 'client@example.com', 'secret', points=40)
+
+    def test_balance_is_snapshot_plus_recent_entries(self):
+        ledger.credit([ledger.entry(self.user.id, 25, PointsLedger.EARN), ledger.entry(self.user.id, 5, PointsLedger.ADJUST)])
+        with self.assertNumQueries(1):
+            self.assertEqual(ledger.balance(self.user.id), 70)
+
+    def test_earning_does_not_write_the_user_row(self):
+        category = Category.objects.create(name='Drinks')
+        product = Product.objects.create(name='Tea', price=50.0, description='', category=category, image='t.jpg')
+        with CaptureQueriesContext(connection) as ctx:
+            checkout(self.user, {product.id: 2})
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')])
+        self.assertEqual(ledger.balance(self.user.id), 42)
+
+    def test_spend_refuses_to_overdraw(self):
+        with transaction.atomic():
+            self.assertEqual(ledger.spend(self.user.id, 30), 10)
+        with self.assertRaises(ledger.InsufficientPoints), transaction.atomic():
+            ledger.spend(self.user.id, 11)
+        self.assertEqual(ledger.balance(self.user.id), 10)
+        self.assertEqual(PointsLedger.objects.count(), 1)
+
+    def test_compaction_folds_settled_entries_into_snapshot(self):
+        ledger.credit([ledger.entry(self.user.id, 10, PointsLedger.EARN)])
+        PointsLedger.objects.update(created=timezone.now() - timedelta(hours=1))
+        ledger.credit([ledger.entry(self.user.id, 7, PointsLedger.EARN)])
+        self.assertEqual(ledger.compact(chunk_size=1), 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.points, 50)
+        self.assertEqual(ledger.balance(self.user.id), 57)
+        self.assertEqual(ledger.compact(settle_seconds=0), 1)
+        self.assertEqual(ledger.compact(settle_seconds=0), 0)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.points, ledger.balance(self.user.id)), (57, 57))
+
+    def test_admin_changes_points_through_the_ledger(self):
+        admin = AppUser.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(admin)
+        url = reverse('admin:caisseApp_appuser_change', args=[self.user.pk])
+        form = {'username': 'client', 'email': 'client@example.com', 'is_active': 'on'}
+        self.assertContains(self.client.get(url), 'Adjust points')
+        response = self.client.post(url, {**form, 'adjust_points': '-15'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(PointsLedger.objects.values_list('user', 'delta', 'reason')),
+                         [(self.user.id, -15, PointsLedger.ADJUST)])
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.points, ledger.balance(self.user.id)), (40, 25))
+        response = self.client.post(url, {**form, 'adjust_points': '-30'})
+        self.assertContains(response, 'The balance cannot go below zero.')
+        self.assertEqual(PointsLedger.objects.count(), 1)
+
+
+class CheckoutBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cashier = AppUser.objects.create_user('cashier', 'cashier@example.com', 'secret', is_staff=True)
+        cls.customers = [AppUser.objects.create_user(f'c{i}', f'c{i}@example.com', 'secret') for i in range(3)]
+        category = Category.objects.create(name='Snacks')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'Product {i}', price=25.0, description='', category=category, image='p.jpg') for i in range(5)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.cashier)
+
+    def basket(self, key, customer=0, products=2):
+        return {'key': key, 'userId': self.customers[customer].id,
+                'lines': [{'productId': p.id, 'quantity': 2} for p in self.products[:products]]}
+
+    def upload(self, baskets):
+        response = self.client.post(reverse('checkoutBatch'), json.dumps({'baskets': baskets}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_batch_creates_factures_and_skips_known_keys(self):
+        results = self.upload([self.basket('a'), self.basket('b', 1, 1), self.basket('a')])
+        self.assertEqual([r['status'] for r in results], ['created', 'created', 'duplicate'])
+        self.assertEqual(results[2]['factureId'], results[0]['factureId'])
+        self.assertEqual((results[0]['totalCost'], results[0]['pointsAwarded']), (100.0, 2))
+        resent = self.upload([self.basket('a'), self.basket('c', 2)])
+        self.assertEqual([r['status'] for r in resent], ['duplicate', 'created'])
+        self.assertEqual(resent[0]['factureId'], results[0]['factureId'])
+        self.assertEqual(Facture.objects.count(), 3)
+        self.assertEqual(ledger.balance(self.customers[0].id), 2)
+        self.assertEqual(Facture.objects.get(pk=results[1]['factureId']).transactionIds.count(), 1)
+
+    def test_invalid_baskets_are_reported_without_aborting(self):
+        unknown_user = dict(self.basket('x'), userId=999999)
+        unknown_product = dict(self.basket('y'), lines=[{'productId': 999999, 'quantity': 1}])
+        results = self.upload([unknown_user, unknown_product, {'key': 'z'}, self.basket('ok')])
+        self.assertEqual([r['status'] for r in results], ['error', 'error', 'error', 'created'])
+        self.assertEqual(Facture.objects.count(), 1)
+
+    def test_rejected_basket_does_not_claim_its_key(self):
+        results = self.upload([dict(self.basket('a'), userId=999999), self.basket('a'), self.basket('a')])
+        self.assertEqual([r['status'] for r in results], ['error', 'created', 'duplicate'])
+        self.assertEqual(results[2]['factureId'], results[1]['factureId'])
+        self.assertEqual(results[2]['totalCost'], results[1]['totalCost'])
+        self.assertEqual(Facture.objects.get().idempotency_key, 'a')
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        def count(baskets):
+            with CaptureQueriesContext(connection) as ctx:
+                self.upload(baskets)
+            return len(ctx.captured_queries)
+        self.assertEqual(count([self.basket('one')]), count([self.basket(f'k{i}', i % 3, 5) for i in range(40)]))
+
+    def test_requires_login(self):
+        self.client.logout()
+        response = self.client.post(reverse('checkoutBatch'), '{}', content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_requires_staff_and_csrf(self):
+        batch = json.dumps({'baskets': [self.basket('x')]})
+        self.client.force_login(self.customers[0])
+        response = self.client.post(reverse('checkoutBatch'), batch, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        # A cross-site form post from a cashier's browser carries the session but no CSRF token
+        browser = Client(enforce_csrf_checks=True)
+        browser.force_login(self.cashier)
+        response = browser.post(reverse('checkoutBatch'), batch, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        # A terminal with a bearer token needs no CSRF token
+        terminal = Client(enforce_csrf_checks=True)
+        response = terminal.post(reverse('checkoutBatch'), batch, content_type='application/json',
+                                 headers={'Authorization': f"Bearer {issue_tokens(self.cashier)['access']}"})
+        self.assertEqual(response.json()['results'][0]['status'], 'created')
+        self.assertEqual(Facture.objects.count(), 1)
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.category = Category.objects.create(name='Drinks')
+
+    def upload(self, name='photo.jpg', size=(2400, 1600)):
+        out = BytesIO()
+        Image.effect_noise(size, 60).convert('RGB').save(out, 'JPEG', quality=95)
+        return SimpleUploadedFile(name, out.getvalue(), content_type='image/jpeg')
+
+    def test_saving_a_product_schedules_variants_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            product = Product.objects.create(name='Tea', price=3, description='', category=self.category, image=self.upload())
+        with mock.patch.object(images, 'schedule') as schedule:
+            for callback in callbacks:
+                callback()
+        schedule.assert_called_once_with(product.pk)
+
+    def test_variants_are_smaller_and_advertised_by_the_api(self):
+        product = Product.objects.create(name='Tea', price=3, description='', category=self.category, image=self.upload())
+        self.assertIsNone(self.client.get('/clientsApp/products/').json()['data'][0]['images'])
+
+        images.build_variants(product.pk)
+        original = os.path.getsize(product.image.path)
+        for size, edge in images.SIZES.items():
+            for fmt in images.FORMATS:
+                path = os.path.join(self.media, images.variant_name(product.image.name, size, fmt))
+                with Image.open(path) as variant:
+                    self.assertEqual(max(variant.size), edge)
+                self.assertLess(os.path.getsize(path), original / 4)
+        data = self.client.get('/clientsApp/products/').json()['data'][0]
+        self.assertEqual(data['images']['thumb']['webp'], f'/media/variants/{os.path.splitext(product.image.name)[0]}_thumb.webp')
+
+    def test_replaced_image_is_not_advertised_with_stale_variants(self):
+        product = Product.objects.create(name='Tea', price=3, description='', category=self.category, image=self.upload())
+        images.build_variants(product.pk)
+        product.image = self.upload('other.jpg')
+        product.save()
+        self.assertIsNone(self.client.get('/clientsApp/products/').json()['data'][0]['images'])
+
+    def test_backfill_command(self):
+        Product.objects.create(name='Tea', price=3, description='', category=self.category, image=self.upload())
+        Product.objects.create(name='Gone', price=3, description='', category=self.category, image='missing.jpg')
+        out, err = StringIO(), StringIO()
+        call_command('build_image_variants', stdout=out, stderr=err)
+        self.assertIn('Built variants for 1 products', out.getvalue())
+        self.assertIn('1 failed', out.getvalue())
+        self.assertEqual(Product.objects.filter(variants_for=F('image')).count(), 1)
+
+
+class MediaStorageTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.category = Category.objects.create(name='Drinks')
+
+    def product(self, name, content=b'same bytes'):
+        return Product.objects.create(name=name, price=1, description='', category=self.category,
+                                      image=SimpleUploadedFile(name, content))
+
+    def test_identical_uploads_are_stored_once(self):
+        first, second = self.product('28383.jpg'), self.product('28383.JPG')
+        other = self.product('28383.jpg', b'other bytes')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+        self.assertRegex(first.image.name, r'^[0-9a-f]{32}\.jpg$')
+        self.assertEqual(sorted(os.listdir(self.media)), sorted([first.image.name, other.image.name]))
+
+    def test_hashed_files_are_immutable_and_conditional(self):
+        url = self.product('a.jpg', b'0123456789' * 10).image.url
+        response = self.client.get(url)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789' * 10)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        cached = self.client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(cached.status_code, 304)
+
+    def test_ranges(self):
+        url = self.product('a.jpg', bytes(range(100))).image.url
+        response = self.client.get(url, headers={'Range': 'bytes=10-19'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        suffix = self.client.get(url, headers={'Range': 'bytes=-5'})
+        self.assertEqual(b''.join(suffix.streaming_content), bytes(range(95, 100)))
+        self.assertEqual(self.client.get(url, headers={'Range': 'bytes=100-'}).status_code, 416)
+        stale = self.client.get(url, headers={'Range': 'bytes=0-1', 'If-Range': '"changed"'})
+        self.assertEqual(stale.status_code, 200)
+
+    def test_unhashed_files_must_revalidate(self):
+        with open(os.path.join(self.media, 'legacy.jpg'), 'wb') as f:
+            f.write(b'old')
+        self.assertEqual(self.client.get('/media/legacy.jpg')['Cache-Control'], 'public, no-cache')
+        self.assertEqual(self.client.get('/media/../settings.py').status_code, 404)
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect', MEDIA_ACCEL_PREFIX='/protected-media/')
+    def test_sendfile_mode_leaves_the_bytes_to_the_proxy(self):
+        image = self.product('a.jpg').image
+        response = self.client.get(image.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{image.name}')
+        self.assertEqual(response.content, b'')
+
+    def test_dedupe_command(self):
+        for name in ('28383.jpg', '28383_3XYIGDc.jpg'):
+            with open(os.path.join(self.media, name), 'wb') as f:
+                f.write(b'duplicate')
+            Product.objects.create(name=name, price=1, description='', category=self.category, image=name)
+        call_command('dedupe_media', '--delete', stdout=StringIO())
+        names = set(Product.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        self.assertEqual(os.listdir(self.media), list(names))
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    # The replica is its own test database, a copy of the primary taken by sync_replica,
+    # which can't copy the uncommitted rows of a TestCase transaction
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.cashier = AppUser.objects.create_user('cashier', 'cashier@example.com', 'secret', is_staff=True)
+        category = Category.objects.create(name='Snacks')
+        self.product = Product.objects.create(name='Chips', price=60.0, description='', category=category, image='p.jpg')
+        self.client.force_login(self.cashier)
+        self.sync()
+
+    def sync(self):
+        call_command('sync_replica', stdout=StringIO())
+
+    def queries(self, alias, request):
+        with CaptureQueriesContext(connections[alias]) as ctx:
+            response = request()
+        self.assertLess(response.status_code, 400)
+        return [q['sql'] for q in ctx.captured_queries]
+
+    def test_router(self):
+        router = PrimaryReplicaRouter()
+        self.assertEqual(router.db_for_read(Product), 'default')
+        with reading_from_replica():
+            self.assertEqual(router.db_for_read(Product), 'replica')
+            self.assertEqual(router.db_for_write(Product), 'default')
+
+    def test_reporting_views_read_from_the_replica(self):
+        for url in (reverse('history'), reverse('inbox')):
+            replica = self.queries('replica', lambda: self.client.get(url))
+            self.assertTrue(replica, url)
+
+    def test_catalog_payloads_are_built_from_the_primary(self):
+        self.assertEqual(self.client.get('/clientsApp/products/').json()['data'][0]['name'], 'Chips')
+        self.product.name = 'Crisps'
+        self.product.save()
+        # The replica still has Chips, and the payload is cached until the next change
+        self.assertEqual(Product.objects.using('replica').get().name, 'Chips')
+        for url in ('/clientsApp/products/', '/clientsApp/gifts/', '/clientsApp/getCategories/'):
+            self.assertEqual(self.queries('replica', lambda: self.client.get(url)), [], url)
+        self.assertEqual(self.client.get('/clientsApp/products/').json()['data'][0]['name'], 'Crisps')
+
+    def test_checkout_writes_to_the_primary_and_pins_the_client(self):
+        data = {'userId': self.cashier.id, 'products': [str(self.product.id)], f'quantity_{self.product.id}': 1}
+        replica = self.queries('replica', lambda: self.client.post(reverse('caisse'), data))
+        self.assertFalse([sql for sql in replica if 'INSERT' in sql or 'UPDATE' in sql])
+        self.assertIn(PIN_COOKIE, self.client.cookies)
+        # Right after the write, the history comes from the primary, which already has the new facture
+        self.assertEqual(self.queries('replica', lambda: self.client.get(reverse('history'))), [])
+        del self.client.cookies[PIN_COOKIE]
+        self.assertTrue(self.queries('replica', lambda: self.client.get(reverse('history'))))
+        self.assertFalse(Facture.objects.using('replica').exists())
+        self.sync()
+        self.assertTrue(Facture.objects.using('replica').exists())
+
+
+class SqliteProfileTests(TransactionTestCase):
+    def test_connection_pragmas(self):
+        with connection.cursor() as cursor:
+            for pragma, expected in (('journal_mode', 'wal'), ('synchronous', 1), ('busy_timeout', 5000), ('temp_store', 2),
+                                     ('foreign_keys', 1)):
+                cursor.execute(f'PRAGMA {pragma}')
+                self.assertEqual(cursor.fetchone()[0], expected, pragma)
+
+    def test_write_transactions_begin_immediate(self):
+        with CaptureQueriesContext(connection) as ctx:
+            with transaction.atomic():
+                Category.objects.create(name='Snacks')
+        self.assertEqual(ctx.captured_queries[0]['sql'], 'BEGIN IMMEDIATE')
+
+
+class RetryWhenLockedTests(SimpleTestCase):
+    def test_retries_lock_errors_then_gives_up(self):
+        calls = []
+
+        @retry_when_locked
+        def write(fail):
+            calls.append(fail)
+            if len(calls) <= fail:
+                raise OperationalError('database is locked')
+            return 'ok'
+
+        with mock.patch('caisseApp.retry.time.sleep'):
+            self.assertEqual(write(2), 'ok')
+            self.assertEqual(len(calls), 3)
+            calls.clear()
+            with self.assertRaises(OperationalError):
+                write(10)
+        self.assertEqual(len(calls), 4)
+
+    def test_other_errors_are_not_retried(self):
+        calls = []
+
+        @retry_when_locked
+        def write():
+            calls.append(1)
+            raise OperationalError('no such table: caisseApp_facture')
+
+        with self.assertRaises(OperationalError):
+            write()
+        self.assertEqual(len(calls), 1)
+
+
+class SalesRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cashier = AppUser.objects.create_user('cashier', 'cashier@example.com', 'secret', is_staff=True)
+        snacks, drinks = Category.objects.create(name='Snacks'), Category.objects.create(name='Drinks')
+        cls.chips = Product.objects.create(name='Chips', price=10.0, description='', category=snacks, image='p.jpg')
+        cls.nuts = Product.objects.create(name='Nuts', price=15.0, description='', category=snacks, image='p.jpg')
+        cls.cola = Product.objects.create(name='Cola', price=8.0, description='', category=drinks, image='p.jpg')
+
+    def setUp(self):
+        self.client.force_login(self.cashier)
+
+    def rollup_rows(self):
+        return (sorted(DailyProductSales.objects.values_list('day', 'product', 'quantity', 'revenue')),
+                sorted(DailyCategorySales.objects.values_list('day', 'category', 'quantity', 'revenue')))
+
+    def test_checkout_updates_the_rollups(self):
+        checkout(self.cashier, {self.chips.id: 2, self.cola.id: 1})
+        checkout(self.cashier, {self.chips.id: 1, self.nuts.id: 2})
+        today = timezone.localdate()
+        products, categories = self.rollup_rows()
+        self.assertEqual(products, sorted([(today, self.chips.id, 3, 30.0), (today, self.nuts.id, 2, 30.0),
+                                           (today, self.cola.id, 1, 8.0)]))
+        self.assertEqual(categories, sorted([(today, self.chips.category_id, 5, 60.0),
+                                             (today, self.cola.category_id, 1, 8.0)]))
+
+    def test_rebuild_matches_incremental_updates(self):
+        checkout(self.cashier, {self.chips.id: 2, self.cola.id: 1})
+        checkout(self.cashier, {self.nuts.id: 4})
+        # A line from before the price snapshot is valued at the current price
+        legacy = Transaction.objects.create(productId=self.cola, quantity=2)
+        Facture.objects.create(userId=self.cashier).transactionIds.add(legacy)
+        rollups.record(timezone.localdate(), [(self.cola.id, self.cola.category_id, 2, 16.0)])
+        checkout(self.cashier, {self.cola.id: 2})
+        expected = self.rollup_rows()
+        DailyProductSales.objects.update(quantity=0)
+        call_command('rebuild_rollups', '--chunk-size', '1', stdout=StringIO())
+        self.assertEqual(self.rollup_rows(), expected)
+
+    def test_rebuild_counts_archived_factures(self):
+        checkout(self.cashier, {self.chips.id: 2, self.cola.id: 1})
+        legacy = Transaction.objects.create(productId=self.cola, quantity=2)
+        Facture.objects.create(userId=self.cashier).transactionIds.add(legacy)
+        rollups.record(timezone.localdate(), [(self.cola.id, self.cola.category_id, 2, 16.0)])
+        archive.archive_chunk(timezone.now() + timedelta(minutes=1))
+        checkout(self.cashier, {self.nuts.id: 4})
+        expected = self.rollup_rows()
+        out = StringIO()
+        call_command('rebuild_rollups', '--chunk-size', '1', stdout=out)
+        self.assertEqual(self.rollup_rows(), expected)
+        self.assertIn('from 1 factures and 2 archived factures', out.getvalue())
+
+    def test_report_reads_only_the_rollups(self):
+        checkout(self.cashier, {self.chips.id: 2, self.cola.id: 1})
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get(reverse('salesReport'), {'group': 'category'}).json()['data']
+        self.assertEqual([(row['category__name'], row['revenue']) for row in data], [('Snacks', 20.0), ('Drinks', 8.0)])
+        self.assertFalse([q['sql'] for q in ctx.captured_queries
+                          if 'caisseApp_transaction' in q['sql'] or 'caisseApp_facture' in q['sql']])
+        self.assertEqual(self.client.get(reverse('salesReport'), {'from': 'yesterday'}).status_code, 400)
+        page = self.client.get(reverse('reports'))
+        self.assertContains(page, 'Chips')
+        self.assertContains(page, '28.00 MAD')
+
+    def test_reports_are_staff_only(self):
+        customer = AppUser.objects.create_user('client', 'client@example.com', 'secret')
+        access = issue_tokens(customer)['access']
+        response = Client().get(reverse('salesReport'), headers={'Authorization': f'Bearer {access}'})
+        self.assertEqual(response.status_code, 403)
+        self.client.force_login(customer)
+        self.assertEqual(self.client.get(reverse('salesReport')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('reports')).status_code, 403)
+
+
+class ProductSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cashier = AppUser.objects.create_user('cashier', 'cashier@example.com', 'secret', is_staff=True)
+        category = Category.objects.create(name='Snacks')
+        cls.bar = Product.objects.create(name='Chocolate bar', price=12.0, description='Dark, 70%', category=category,
+                                         image='p.jpg', sku='6111000000017')
+        cls.coffee = Product.objects.create(name='Café noir', price=9.0, description='Arabica beans', category=category,
+                                            image='p.jpg', sku='6111000000024')
+        cls.milk = Product.objects.create(name='Chocolate milk', price=7.0, description='', category=category,
+                                          image='p.jpg', sku='6111000000031')
+
+    def names(self, query):
+        return [row['name'] for row in search_products(query)]
+
+    def test_scan_resolves_to_the_exact_sku(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.names('6111000000024'), ['Café noir'])
+        self.assertEqual(len(self.names('611100000')), 3)
+
+    def test_words_and_prefixes(self):
+        self.assertEqual(sorted(self.names('choco')), ['Chocolate bar', 'Chocolate milk'])
+        self.assertEqual(self.names('chocolate mi'), ['Chocolate milk'])
+        self.assertEqual(self.names('cafe'), ['Café noir'])
+        self.assertEqual(self.names('arabica'), ['Café noir'])
+        self.assertEqual(self.names('"*'), [])
+
+    def test_index_follows_product_changes(self):
+        self.milk.name = 'Strawberry milk'
+        self.milk.save()
+        self.assertEqual(self.names('strawb'), ['Strawberry milk'])
+        self.assertEqual(self.names('chocolate'), ['Chocolate bar'])
+        self.bar.delete()
+        self.assertEqual(self.names('chocolate'), [])
+
+    def test_caisse_page_no_longer_lists_the_catalog(self):
+        self.client.force_login(self.cashier)
+        self.assertNotContains(self.client.get(reverse('caisse')), 'Chocolate bar')
+        data = self.client.get(reverse('productSearch'), {'q': 'choc'}).json()['data']
+        self.assertEqual({row['id'] for row in data}, {self.bar.id, self.milk.id})
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('productSearch'), {'q': 'choc'}).status_code, 401)
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = AppUser.objects.create_user('staff', 'staff@example.com', 'secret', is_staff=True)
+        cls.client_user = AppUser.objects.create_user('client', 'client@example.com', 'secret')
+
+    def setUp(self):
+        patcher = mock.patch.object(metrics, 'registry', metrics.Registry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def scrape(self, **kwargs):
+        response = self.client.get('/metrics', **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_requests_are_timed_and_their_queries_counted(self):
+        self.client.force_login(self.client_user)
+        self.client.get('/clientsApp/getUserHistory/')
+        self.client.get('/clientsApp/getUserHistory/')
+        self.client.force_login(self.staff)
+        text = self.scrape()
+        labels = 'view="clientsApp:getUserHistory",method="GET"'
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 2', text)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2', text)
+        self.assertIn(f'http_responses_total{{{labels},status="2xx"}} 2', text)
+        queries = [line for line in text.splitlines() if line.startswith(f'http_request_db_queries_sum{{{labels}}}')]
+        self.assertGreaterEqual(float(queries[0].split()[-1]), 4)
+
+    def test_endpoint_is_protected(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.client.force_login(self.client_user)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.client.logout()
+        with override_settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+            self.scrape(headers={'Authorization': 'Bearer s3cret'})
+
+    def test_processes_are_summed_from_the_shared_directory(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        other = metrics.Registry()
+        other.observe(('clientsApp:isAuth', 'GET'), 0.003, metrics.RequestStats(False), 200)
+        with open(os.path.join(directory, '999999.json'), 'w') as f:
+            json.dump(other.snapshot(), f)
+        with override_settings(METRICS_DIR=directory, METRICS_TOKEN='s3cret'):
+            self.client.get('/clientsApp/isAuth/')
+            text = self.scrape(headers={'Authorization': 'Bearer s3cret'})
+        self.assertIn('http_request_duration_seconds_count{view="clientsApp:isAuth",method="GET"} 2', text)
+        self.assertIn(f'{os.getpid()}.json', os.listdir(directory))
+
+    def test_label_values_are_escaped(self):
+        metrics.registry.observe(('caisse', 'GET"\n'), 0.001, metrics.RequestStats(False), 200)
+        self.client.force_login(self.staff)
+        self.assertIn('http_responses_total{view="caisse",method="GET\\"\\n",status="2xx"} 1', self.scrape())
+
+    @override_settings(SLOW_REQUEST_SECONDS=0)
+    def test_slow_request_log_shows_the_sql(self):
+        self.client.force_login(self.client_user)
+        with self.assertLogs('caisseApp.metrics.slow', 'WARNING') as logs:
+            self.client.get('/clientsApp/getUserHistory/')
+        self.assertIn('clientsApp:getUserHistory', logs.output[0])
+        self.assertIn('caisseApp_facture', logs.output[0])
+
+
+class ViewQueryCountTests(TestCase):
+    """
+    Every caisseApp view runs at most its budget of queries, and the same number
+    whatever the number of rows: each is measured at two data volumes.
+
+    A view added to urls.py needs a case and a budget here.
+    """
+    SIZES = (2, 20)
+    BUDGETS = {
+        ('login', 'get'): 2,
+        ('login', 'post'): 6,
+        ('logout', 'get'): 4,
+        ('products', 'get'): 3,
+        ('productDetails', 'get'): 3,
+        ('addProduct', 'get'): 3,
+        ('importCatalog', 'get'): 2,
+        ('importCatalog', 'post'): 8,
+        ('editProduct', 'get'): 4,
+        ('editProduct', 'post'): 7,
+        ('deleteProduct', 'get'): 3,
+        ('deleteProduct', 'post'): 11,
+        ('caisse', 'get'): 2,
+        ('caisse', 'post'): 11,
+        ('productSearch', 'get'): 5,
+        ('checkoutBatch', 'post'): 12,
+        ('facture', 'get'): 4,
+        ('scanGiftCode', 'get'): 2,
+        ('scanGiftCode', 'post'): 5,
+        ('gifts', 'get'): 3,
+        ('addGift', 'get'): 3,
+        ('addGift', 'post'): 5,
+        ('editGift', 'get'): 4,
+        ('editGift', 'post'): 6,
+        ('deleteGift', 'get'): 3,
+        ('deleteGift', 'post'): 5,
+        ('history', 'get'): 3,
+        ('reports', 'get'): 5,
+        ('salesReport', 'get'): 3,
+        ('exportData', 'get'): 6,
+        ('inbox', 'get'): 3,
+        ('inboxStream', 'get'): 3,
+        ('sendMessage', 'get'): 4,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = AppUser.objects.create_user('staff', 'staff@example.com', 'secret', is_staff=True)
+        cls.customer = AppUser.objects.create_user('client', 'client@example.com', 'secret')
+        cls.category = Category.objects.create(name='Snacks')
+
+    def seed(self, count):
+        start = Product.objects.count()
+        products = Product.objects.bulk_create([
+            Product(name=f'Product {start + i}', sku=f'SKU{start + i}', price=10.0, description='',
+                    category=self.category, image=f'{start + i}.jpg')
+            for i in range(count)
+        ])
+        gifts = Gift.objects.bulk_create([Gift(productId=p, pointCost=10) for p in products])
+        codes = Code.objects.bulk_create([
+            Code(cid=cid, giftId=gift, userId=self.customer) for cid, gift in zip(Code.random_cids(count), gifts)
+        ])
+        for product in products:
+            checkout(self.customer, {product.id: 1})
+        self.facture = checkout(self.customer, {p.id: 2 for p in products})
+        Message.objects.bulk_create(
+            [Message(fromUserId=self.staff, toUserId=self.customer, text='hello')] * count
+            + [Message(fromUserId=self.customer, toUserId=self.staff, text='hi')] * count
+        )
+        self.product, self.gift, self.code = products[0], gifts[0], codes[0]
+
+    def cases(self):
+        product_form = {'name': 'Renamed', 'sku': self.product.sku, 'price': 12, 'category': self.category.id,
+                        'description': 'x'}
+        gift_form = {'productId': self.product.id, 'pointCost': 20}
+        catalog = f'sku,price,gift_points\n{self.product.sku},11,15\n'.encode()
+        basket = {'userId': self.customer.id, 'products': [self.product.id], f'quantity_{self.product.id}': 1}
+        batch = json.dumps({'baskets': [{'key': f'k{self.facture.id}', 'userId': self.customer.id,
+                                         'lines': [{'productId': self.product.id, 'quantity': 1}]}]})
+        return {
+            ('login', 'get'): ((), None),
+            ('login', 'post'): ((), {'username': 'staff', 'password': 'secret'}),
+            ('logout', 'get'): ((), None),
+            ('products', 'get'): ((), None),
+            ('productDetails', 'get'): ((self.product.id,), None),
+            ('addProduct', 'get'): ((), None),
+            ('importCatalog', 'get'): ((), None),
+            ('importCatalog', 'post'): ((), {'catalog': SimpleUploadedFile('catalog.csv', catalog)}),
+            ('editProduct', 'get'): ((self.product.id,), None),
+            ('editProduct', 'post'): ((self.product.id,), product_form),
+            ('deleteProduct', 'get'): ((self.product.id,), None),
+            ('deleteProduct', 'post'): ((self.product.id,), {}),
+            ('caisse', 'get'): ((), None),
+            ('caisse', 'post'): ((), basket),
+            ('productSearch', 'get'): ((), {'q': 'product'}),
+            ('checkoutBatch', 'post'): ((), batch),
+            ('facture', 'get'): ((self.facture.id,), None),
+            ('scanGiftCode', 'get'): ((), None),
+            ('scanGiftCode', 'post'): ((), {'giftCode': self.code.cid}),
+            ('gifts', 'get'): ((), None),
+            ('addGift', 'get'): ((), None),
+            ('addGift', 'post'): ((), gift_form),
+            ('editGift', 'get'): ((self.gift.id,), None),
+            ('editGift', 'post'): ((self.gift.id,), gift_form),
+            ('deleteGift', 'get'): ((self.gift.id,), None),
+            ('deleteGift', 'post'): ((self.gift.id,), {}),
+            ('history', 'get'): ((), None),
+            ('reports', 'get'): ((), None),
+            ('salesReport', 'get'): ((), {'group': 'product'}),
+            ('exportData', 'get'): (('lines',), None),
+            ('inbox', 'get'): ((), None),
+            ('inboxStream', 'get'): ((), {'transport': 'poll', 'since': 0}),
+            ('sendMessage', 'get'): ((self.customer.id,), None),
+        }
+
+    def query_counts(self):
+        counts = {}
+        for (name, method), (args, data) in self.cases().items():
+            cache.clear()
+            self.client.force_login(self.staff)
+            # Each case runs against the same rows: its writes are rolled back
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as ctx:
+                    if isinstance(data, str):
+                        response = self.client.post(reverse(name, args=args), data, content_type='application/json')
+                    else:
+                        response = getattr(self.client, method)(reverse(name, args=args), data)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                transaction.set_rollback(True)
+            self.assertLess(response.status_code, 400, (name, method))
+            counts[name, method] = len(ctx.captured_queries)
+        return counts
+
+    def test_query_counts_are_bounded_and_do_not_grow_with_rows(self):
+        small, large = [self.seed(size) or self.query_counts() for size in self.SIZES]
+        self.assertEqual(set(large), set(self.BUDGETS))
+        for case, budget in self.BUDGETS.items():
+            with self.subTest(view=case):
+                self.assertEqual(large[case], small[case])
+                self.assertLessEqual(large[case], budget)
+
+    def test_every_view_has_a_budget(self):
+        views = {pattern.name for pattern in caisse_urls.urlpatterns}
+        self.assertEqual({name for name, _ in self.BUDGETS}, views)
+
+
+class LoadBenchTests(TestCase):
+    def test_every_scenario_runs_without_errors(self):
+        fixture = loadbench.Fixture(customers=2, products=20, history=60)
+        for scenario in loadbench.SCENARIOS:
+            with self.subTest(scenario=scenario):
+                results = loadbench.run(fixture, [scenario], concurrency=1, iterations=2)
+                self.assertTrue(results['endpoints'])
+                for endpoint, row in results['endpoints'].items():
+                    self.assertEqual(row['errors'], 0, endpoint)
+                    self.assertLessEqual(row['p50'], row['p99'])
+        history = loadbench.run(fixture, ['history'], concurrency=1, iterations=1)
+        self.assertEqual(history['endpoints']['history page']['requests'], loadbench.HISTORY_PAGES)
+
+    def test_results_are_written_and_compared(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        first, second = os.path.join(directory, 'first.json'), os.path.join(directory, 'second.json')
+        options = ['--scenario', 'catalog', '--concurrency', '1', '--iterations', '3', '--customers', '1',
+                   '--products', '5', '--history', '0']
+        call_command('loadbench', *options, '--output', first, stdout=StringIO())
+        out = StringIO()
+        call_command('loadbench', *options, '--output', second, '--compare', first, stdout=out)
+        with open(second) as f:
+            results = json.load(f)
+        self.assertEqual(results['endpoints']['catalog products']['requests'], 3)
+        self.assertEqual(results['config']['iterations'], 3)
+        self.assertIn('catalog products     p99', out.getvalue())
+        self.assertFalse(AppUser.objects.filter(username__startswith='bench-').exists())
+
+
+class SyntheticDataTests(TestCase):
+    SHAPE = Shape(categories=3, products=30, gifts=5, users=40, factures=600, days=10, threads=20, chunk_size=100)
+
+    def generate(self, seed=1):
+        return Generator(self.SHAPE, seed=seed).run()
+
+    def indexes(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+            return sorted(row[0] for row in cursor.fetchall())
+
+    def test_graph_is_consistent(self):
+        indexes = self.indexes()
+        report = self.generate()
+        self.assertEqual(report.rows['caisseApp_facture'], 600)
+        self.assertEqual(Facture.objects.count(), 600)
+        self.assertEqual(self.indexes(), indexes)
+        lines = Transaction.objects.aggregate(total=Sum('line_total'), items=Sum('quantity'))
+        self.assertAlmostEqual(Facture.objects.aggregate(total=Sum('total_cost'))['total'], lines['total'], places=4)
+        self.assertEqual(Facture.objects.aggregate(items=Sum('item_count'))['items'], lines['items'])
+        self.assertEqual(Facture.transactionIds.through.objects.count(), Transaction.objects.count())
+        self.assertAlmostEqual(DailyProductSales.objects.aggregate(total=Sum('revenue'))['total'], lines['total'], places=4)
+        self.assertEqual(DailyCategorySales.objects.aggregate(items=Sum('quantity'))['items'], lines['items'])
+        for user in AppUser.objects.filter(points_entries__isnull=False).distinct():
+            entries = user.points_entries.aggregate(total=Sum('delta'))['total']
+            self.assertEqual(ledger.balance(user.pk), entries)
+            self.assertEqual(user.points, entries)
+        self.assertEqual(Code.objects.count(), PointsLedger.objects.filter(reason=PointsLedger.SPEND).count())
+        user = AppUser.objects.filter(is_staff=False).first()
+        self.assertTrue(self.client.login(username=user.username, password=self.SHAPE.password))
+
+    def test_same_seed_same_rows(self):
+        def snapshot(seed):
+            with transaction.atomic():
+                self.generate(seed)
+                rows = (list(Facture.objects.order_by('pk').values_list('userId', 'date', 'total_cost')),
+                        list(Transaction.objects.order_by('pk').values_list('productId', 'quantity')),
+                        list(Message.objects.order_by('pk').values_list('fromUserId', 'toUserId', 'date', 'text')))
+                transaction.set_rollback(True)
+            return rows
+        self.assertEqual(snapshot(1), snapshot(1))
+        self.assertNotEqual(snapshot(1), snapshot(2))
+
+    def test_command_reports_rate(self):
+        out = StringIO()
+        call_command('generate_data', '--users', '5', '--products', '5', '--factures', '50', '--threads', '2',
+                     stdout=out)
+        self.assertIn('rows/s', out.getvalue())
+        self.assertEqual(Facture.objects.count(), 50)
+
+
+class ArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = AppUser.objects.create_user('client', 'client@example.com', 'secret')
+        category = Category.objects.create(name='Snacks')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'Product {i}', price=10.0 + i, description='', category=category, image='p.jpg')
+            for i in range(3)
+        ])
+        for i in range(8):
+            checkout(cls.user, {cls.products[0].pk: 2, cls.products[i % 2 + 1].pk: 1})
+        # The five oldest are three years old
+        ids = list(Facture.objects.order_by('id').values_list('id', flat=True))
+        for days, pk in enumerate(ids[:5]):
+            Facture.objects.filter(pk=pk).update(date=timezone.now() - timedelta(days=3 * 365 - days))
+        cls.old = ids[:5]
+
+    def test_moves_old_factures_with_their_lines(self):
+        before = {f.pk: (f.total_cost, sorted((t.productId.name, t.quantity, t.line_total)
+                                              for t in f.transactionIds.select_related('productId')))
+                  for f in Facture.objects.filter(pk__in=self.old)}
+        out = StringIO()
+        call_command('archive_factures', '--chunk-size', '2', stdout=out)
+        self.assertIn('Archived 5 factures', out.getvalue())
+        self.assertEqual(set(ArchivedFacture.objects.values_list('id', flat=True)), set(self.old))
+        self.assertEqual(Facture.objects.count(), 3)
+        self.assertEqual(Transaction.objects.count(), 6)
+        self.assertEqual(Facture.transactionIds.through.objects.count(), 6)
+        for archived in ArchivedFacture.objects.all():
+            lines = sorted((name, quantity, total) for _, name, _, _, quantity, total in unpack_lines(archived.lines))
+            self.assertEqual((archived.total_cost, lines), before[archived.pk])
+
+    def test_resumes_and_reruns_safely(self):
+        self.assertEqual(archive.archive_chunk(archive.cutoff(), 2), 2)
+        call_command('archive_factures', '--limit', '2', stdout=StringIO())
+        self.assertEqual(ArchivedFacture.objects.count(), 4)
+        call_command('archive_factures', stdout=StringIO())
+        call_command('archive_factures', stdout=StringIO())
+        self.assertEqual(ArchivedFacture.objects.count(), 5)
+        self.assertEqual(Facture.objects.count(), 3)
+
+    def test_facture_page_reads_the_archive(self):
+        archive.archive_chunk(archive.cutoff())
+        self.client.force_login(AppUser.objects.create_user('cashier', 'cashier@example.com', 'secret',
+                                                            is_staff=True))
+        response = self.client.get(reverse('facture', args=[self.old[0]]))
+        self.assertContains(response, 'Product 0')
+        self.assertContains(response, 'client')
+        self.assertEqual(self.client.get(reverse('facture', args=[10 ** 6])).status_code, 404)
+
+    def test_history_pages_across_hot_and_archived_factures(self):
+        expected = list(Facture.objects.order_by('-date', '-id').values_list('id', flat=True))
+        archive.archive_chunk(archive.cutoff())
+        self.client.force_login(self.user)
+        pages, params = [], {'limit': 3}
+        while True:
+            body = self.client.get('/clientsApp/getUserHistory/', params).json()
+            pages.append(body)
+            if not body['next']:
+                break
+            params = {'limit': 3, 'cursor': body['next']}
+        self.assertEqual([f['factureId'] for page in pages for f in page['data']], expected)
+        archived = pages[-1]['data'][-1]
+        self.assertEqual(len(archived['transactions']), 2)
+        self.assertTrue(archived['transactions'][0]['productImage'].endswith('p.jpg'))
+        # And back towards the newest, across the boundary again
+        body = self.client.get('/clientsApp/getUserHistory/', {'limit': 3, 'cursor': pages[-1]['prev']}).json()
+        self.assertEqual([f['factureId'] for f in body['data']], expected[3:6])
+        body = self.client.get('/clientsApp/getUserHistory/', {'limit': 3, 'cursor': body['prev']}).json()
+        self.assertEqual([f['factureId'] for f in body['data']], expected[:3])
+        self.assertIsNone(body['prev'])
+
+
+
+class InboxStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = AppUser.objects.create_user('staff', 'staff@example.com', 'secret', is_staff=True)
+        cls.customer = AppUser.objects.create_user('client', 'client@example.com', 'secret')
+        cls.message = Message.objects.create(fromUserId=cls.customer, toUserId=cls.staff, text='hello')
+
+    async def poll(self, **headers):
+        return await self.async_client.get(reverse('inboxStream'), {'transport': 'poll', 'since': 0}, headers=headers)
+
+    async def test_staff_gets_the_backlog(self):
+        await sync_to_async(self.async_client.force_login)(self.staff)
+        response = await self.poll()
+        self.assertEqual([(m['id'], m['senderUsername']) for m in response.json()['data']], [(self.message.id, 'client')])
+
+    async def test_failed_backlog_read_closes_the_subscription(self):
+        await sync_to_async(self.async_client.force_login)(self.staff)
+        with mock.patch.object(realtime, 'get_backend', side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                await self.poll()
+        self.assertEqual(realtime.hub.subscriber_count(), 0)
+
+    async def test_customers_are_refused(self):
+        access = (await sync_to_async(issue_tokens)(self.customer))['access']
+        self.assertEqual((await self.poll(Authorization=f'Bearer {access}')).status_code, 403)
+        await sync_to_async(self.async_client.force_login)(self.customer)
+        self.assertEqual((await self.poll()).status_code, 403)
+        self.assertEqual(realtime.hub.subscriber_count(), 0)
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = AppUser.objects.create_user('staff', 'staff@example.com', 'secret', is_staff=True)
+        cls.user = AppUser.objects.create_user('client', 'client@example.com', 'secret')
+        category = Category.objects.create(name='Snacks')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'Product {i}', price=10.0 + i, description='', category=category, image='p.jpg')
+            for i in range(2)
+        ])
+        for i in range(6):
+            checkout(cls.user, {cls.products[0].pk: 1, cls.products[1].pk: i + 1})
+        ids = list(Facture.objects.order_by('id').values_list('id', flat=True))
+        # Two factures three years ago, archived, and one a week ago
+        for days, pk in zip((3 * 365, 3 * 365 - 1, 7), ids):
+            Facture.objects.filter(pk=pk).update(date=timezone.now() - timedelta(days=days))
+        archive.archive_chunk(archive.cutoff())
+        cls.ids = ids
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def rows(self, dataset, **params):
+        response = self.client.get(reverse('exportData', args=[dataset]), params)
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        if params.get('gzip'):
+            self.assertEqual(response['Content-Type'], 'application/gzip')
+            content = gzip.decompress(content)
+        if params.get('format') == 'jsonl':
+            return [json.loads(line) for line in content.decode().splitlines()]
+        return list(csv.DictReader(StringIO(content.decode())))
+
+    def test_factures_include_the_archive_oldest_first(self):
+        rows = self.rows('factures')
+        self.assertEqual([int(row['facture_id']) for row in rows], self.ids)
+        self.assertEqual([row['archived'] for row in rows], ['True'] * 2 + ['False'] * 4)
+        self.assertEqual(rows[0]['username'], 'client')
+
+    def test_date_range(self):
+        today = timezone.localdate()
+        rows = self.rows('factures', format='jsonl', **{'from': str(today - timedelta(days=8)),
+                                                      'to': str(today - timedelta(days=1))})
+        self.assertEqual([row['facture_id'] for row in rows], [self.ids[2]])
+        self.assertEqual(self.rows('factures', to=str(today - timedelta(days=3 * 365 - 1))), self.rows('factures')[:2])
+
+    def test_lines_gzipped_match_the_factures(self):
+        lines = self.rows('lines', format='jsonl', gzip='1')
+        self.assertEqual(len(lines), 12)
+        totals = {}
+        for line in lines:
+            totals[line['facture_id']] = totals.get(line['facture_id'], 0) + line['line_total']
+        for row in self.rows('factures', format='jsonl'):
+            self.assertAlmostEqual(totals[row['facture_id']], row['total_cost'])
+        self.assertEqual({line['product_name'] for line in lines}, {'Product 0', 'Product 1'})
+
+    def test_customers_points(self):
+        [row] = self.rows('customers', format='jsonl')
+        earned = PointsLedger.objects.filter(user=self.user).aggregate(total=Sum('delta'))['total']
+        self.assertEqual((row['username'], row['points_earned'], row['points_spent']), ('client', earned, 0))
+        self.assertEqual(row['balance'], ledger.balance(self.user.pk))
+
+    def test_staff_only_and_bad_parameters(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('exportData', args=['factures'])).status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse('exportData', args=['passwords'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('exportData', args=['lines']), {'from': 'May'}).status_code, 400)
+
+    def test_streams_in_chunks(self):
+        with mock.patch.object(export, 'BUFFER_BYTES', 100):
+            response = self.client.get(reverse('exportData', args=['lines']))
+            self.assertGreater(len(list(response.streaming_content)), 3)
+
+    async def test_streams_asynchronously_under_asgi(self):
+        await sync_to_async(self.async_client.force_login)(self.staff)
+        response = await self.async_client.get(reverse('exportData', args=['factures']))
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(content.decode().splitlines()), 7)
+
+    def test_command_writes_a_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'lines.csv.gz')
+            call_command('export_data', 'lines', '--gzip', '--output', path, stderr=StringIO())
+            with gzip.open(path, 'rt') as f:
+                self.assertEqual(len(list(csv.DictReader(f))), 12)
+        out = StringIO()
+        call_command('export_data', 'customers', '--format', 'jsonl', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['username'], 'client')
+
+
+
+class ExportSnapshotTests(TransactionTestCase):
+    # Outside a TestCase transaction, so the export opens its own and another connection can write
+    def test_writers_are_not_blocked_by_a_running_export(self):
+        user = AppUser.objects.create_user('client', 'client@example.com', 'secret')
+        category = Category.objects.create(name='Snacks')
+        product = Product.objects.create(name='Chips', price=10.0, description='', category=category, image='p.jpg')
+        for _ in range(5):
+            checkout(user, {product.pk: 1})
+        with mock.patch.object(export, 'BUFFER_BYTES', 1):
+            chunks = export.stream('factures')
+            # The header, then the first row, which opens the read snapshot
+            head = next(chunks) + next(chunks)
+            writer = sqlite3.connect(connection.settings_dict['NAME'], timeout=0)
+            try:
+                writer.execute('DELETE FROM caisseApp_facture_transactionIds')
+                writer.execute('DELETE FROM caisseApp_facture')
+                writer.commit()
+            finally:
+                writer.close()
+            rest = list(chunks)
+        self.assertFalse(Facture.objects.exists())
+        # The export still reads the snapshot it started from
+        self.assertEqual(len((head + b''.join(rest)).decode().splitlines()), 6)
+
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.category = Category.objects.create(name='Drinks')
+        self.tea = Product.objects.create(name='Tea', sku='TEA', price=3, description='Green', category=self.category,
+                                          image='tea.jpg')
+        self.gift = Gift.objects.create(productId=self.tea, pointCost=30)
+
+    def images(self, *names):
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w') as z:
+            for name in names:
+                out = BytesIO()
+                Image.new('RGB', (40, 30), 'red').save(out, 'JPEG')
+                z.writestr(name, out.getvalue())
+            z.writestr('broken.jpg', b'not an image')
+        archive.seek(0)
+        return archive
+
+    def run_import(self, text, images=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return import_catalog(StringIO(text), images)
+
+    def test_upserts_by_natural_key_and_reports_bad_rows(self):
+        report = self.run_import(
+            'sku,name,price,description,category,image,gift_points\n'
+            'TEA,,3.5,,,,40\n'
+            'COF,Coffee,4,Arabica,Hot drinks,img/coffee.jpg,50\n'
+            'JUI,Juice,abc,,Drinks,juice.jpg,\n'
+            'COF,Coffee again,4,,Drinks,,\n'
+            'WAT,Water,1,,Drinks,,\n'
+            'BAD,Bad,1,,Drinks,broken.jpg,\n'
+            ',Nameless,1,,Drinks,,\n',
+            self.images('img/coffee.jpg', 'juice.jpg'),
+        )
+        self.assertEqual((report.rows, report.imported), (7, 2))
+        self.assertEqual([line for line, _ in report.errors], [4, 5, 6, 7, 8])
+        self.assertIn('price', report.errors[0][1])
+        self.assertIn('line 3', report.errors[1][1])
+        self.assertIn('image', report.errors[2][1])
+        self.assertEqual((report.created, report.updated),
+                         ({'category': 1, 'product': 1, 'gift': 1}, {'product': 1, 'gift': 1}))
+
+        self.tea.refresh_from_db()
+        self.assertEqual((self.tea.name, self.tea.price, self.tea.description, self.tea.image.name),
+                         ('Tea', 3.5, 'Green', 'tea.jpg'))
+        self.gift.refresh_from_db()
+        self.assertEqual(self.gift.pointCost, 40)
+        coffee = Product.objects.get(sku='COF')
+        self.assertEqual(coffee.category.name, 'Hot drinks')
+        self.assertRegex(coffee.image.name, r'^[0-9a-f]{32}\.jpg$')
+        self.assertEqual(Gift.objects.get(productId=coffee).pointCost, 50)
+        self.assertEqual(report.new_images, [coffee.pk])
+        self.assertEqual(search_products('arabica')[0]['id'], coffee.pk)
+
+    def test_catalog_is_invalidated_once(self):
+        rows = ''.join(f'S{i},Product {i},{i},,Drinks,p.jpg,{i}\n' for i in range(50))
+        with mock.patch('caisseApp.catalog_import.bump_catalog_version') as bump:
+            report = self.run_import('sku,name,price,description,category,image,gift_points\n' + rows,
+                                     self.images('p.jpg'))
+        self.assertEqual(report.created['product'], 50)
+        bump.assert_called_once_with()
+        with mock.patch('caisseApp.catalog_import.bump_catalog_version') as bump:
+            report = self.run_import('sku,price\nTEA,3\n')
+        self.assertEqual(report.updated, {'product': 0, 'gift': 0})
+        bump.assert_not_called()
+
+    def test_file_level_errors(self):
+        with self.assertRaises(CatalogImportError):
+            import_catalog(StringIO('name,price\nTea,3\n'))
+        with self.assertRaises(CatalogImportError):
+            import_catalog(StringIO('sku\nTEA\n'), BytesIO(b'not a zip'))
+
+    def test_upload_page_and_command(self):
+        staff = AppUser.objects.create_user('staff', 'staff@example.com', 'secret', is_staff=True)
+        self.client.force_login(staff)
+        with mock.patch.object(images, 'schedule_batch') as schedule, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('importCatalog'), {
+                'catalog': SimpleUploadedFile('catalog.csv', b'sku,name,price,category,image\nCOF,Coffee,4,Drinks,c.jpg\n'),
+                'images': SimpleUploadedFile('images.zip', self.images('c.jpg').getvalue()),
+            })
+        self.assertContains(response, 'Imported 1 of 1 rows')
+        schedule.assert_called_once_with([Product.objects.get(sku='COF').pk])
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('sku,price\nTEA,5\nNEW,1\n')
+        self.addCleanup(os.remove, f.name)
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', f.name, stdout=out, stderr=err)
+        self.assertIn('Imported 1 of 2 rows', out.getvalue())
+        self.assertIn('Line 3: A new product needs name, category, image.', err.getvalue())
+        self.assertEqual(Product.objects.get(sku='TEA').price, 5)
+
+        self.client.force_login(AppUser.objects.create_user('client', 'client@example.com', 'secret'))
+        self.assertEqual(self.client.get(reverse('importCatalog')).status_code, 403)
@@ -7,9 +7,12 @@ path('logout/', views.logout, name='logout'),
 path('', views.products,name='products'),
 path('productDetails/<int:id>', views.productDetails,name='productDetails'),
 path('addProduct/', views.addProduct,name='addProduct'),
+path('importCatalog/', views.importCatalog,name='importCatalog'),
 path('editProduct/<int:id>', views.editProduct,name='editProduct'),
 path('deleteProduct/<int:id>', views.deleteProduct,name='deleteProduct'),
 path('caisse/', views.caisse,name='caisse'),
+path('caisse/search/', views.productSearch,name='productSearch'),
+path('api/checkout/', views.checkoutBatch,name='checkoutBatch'),
 path('facture/<int:id>', views.facture,name='facture'),
 path('scanGiftCode/', views.scanGiftCode,name='scanGiftCode'),
 path('gifts/', views.gifts,name='gifts'),
@@ -17,7 +20,11 @@ path('addGift/', views.addGift,name='addGift'),
 path('editGift/<int:id>', views.editGift,name='editGift'),
 path('deleteGift/<int:id>', views.deleteGift,name='deleteGift'),
 path('history/', views.history,name='history'),
+path('reports/', views.reports,name='reports'),
+path('api/reports/sales/', views.salesReport,name='salesReport'),
+path('api/export/<str:dataset>/', views.exportData,name='exportData'),
 path('inbox/', views.inbox,name='inbox'),
+path('inbox/stream/', views.inboxStream,name='inboxStream'),
 path('sendMessage/<int:user_id>', views.sendMessage,name='sendMessage')
 
 ]
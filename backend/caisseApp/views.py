@@ -2,13 +2,39 @@ from django.shortcuts import render,redirect
 from django.contrib.auth import authenticate
 from django.contrib.auth import login as loginAuth
 from django.contrib import messages
-from .models import Product,AppUser,Code,Gift,Message,Transaction,Facture
+from .models import Product,AppUser,Code,Gift,Message,Facture
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import logout as logoutAuth
 from .forms import ProductForm,GiftForm
+from .checkout import checkout,checkout_batch,parse_basket,MAX_BATCH
+from .pagination import paginate,page_size_from,MAX_PAGE_SIZE
+from . import realtime
+from .realtime import authenticated_user
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.exceptions import PermissionDenied
+from django.db import router,transaction
+from django.http import Http404,JsonResponse,StreamingHttpResponse
+from .routing import replica_reads
+from . import archive
+from . import images
+from . import export
+from . import rollups
+from .search import search_products
+from .catalog_import import CatalogImportError,import_catalog
+from datetime import date,timedelta
+from django.utils import timezone
+import io
+import json
+import logging
 from django.db.models import Q
 
 
+logger = logging.getLogger(__name__)
+
+REPORT_DAYS = 30
+
+
 
 def login(request):
     """
@@ -36,7 +62,7 @@ def login(request):
             return redirect('products') 
         else:
             messages.error(request, 'Invalid login credentials.')
-            print("invalid credentials")
+            logger.info("Invalid login credentials for %r", username)
             return redirect('login')
 
 
@@ -119,6 +145,39 @@ def addProduct(request):
     return render(request, 'addProduct.html', {'form': form})
         
     
+@login_required(login_url='login')
+def importCatalog(request):
+    """
+    Create or update products, categories and gifts in bulk from a CSV and a zip of images.
+
+    Requires a staff user. GET requests render the upload form. POST requests import
+    the `catalog` CSV, with the optional `images` zip, and render what was imported
+    and the rows that were rejected; see catalog_import.py.
+
+    Parameters:
+    request (HttpRequest): The HTTP request object.
+
+    Returns:
+    HttpResponse: The rendered import page.
+    """
+    if not request.user.is_staff:
+        raise PermissionDenied
+    context = {}
+    if request.method == 'POST':
+        if 'catalog' not in request.FILES:
+            context['error'] = "Choose a catalog CSV to import."
+        else:
+            rows = io.TextIOWrapper(request.FILES['catalog'].file, encoding='utf-8-sig', newline='')
+            try:
+                context['report'] = report = import_catalog(rows, request.FILES.get('images'))
+            except (CatalogImportError, UnicodeDecodeError) as e:
+                context['error'] = str(e)
+            else:
+                if report.new_images:
+                    transaction.on_commit(lambda: images.schedule_batch(report.new_images))
+    return render(request, 'importCatalog.html', context)
+
+
 @login_required(login_url='login')
 def editProduct(request, id):
     """
@@ -179,8 +238,10 @@ def caisse(request):
     """
     Handle the cash register functionality.
 
-    Requires the user to be logged in. Displays all products and processes the transactions
-    made at the cash register, including calculating total cost and points awarded.
+    Requires the user to be logged in. Processes the transactions made at the cash
+    register, including calculating total cost and points awarded. The page does not
+    list the catalog: products are looked up as the cashier scans or types, through
+    productSearch.
 
     Parameters:
     request (HttpRequest): The HTTP request object.
@@ -188,46 +249,83 @@ def caisse(request):
     Returns:
     HttpResponse: The rendered cash register page or a redirect upon successful transaction.
     """
-    products = Product.objects.all()  # Load all products to display in the form
     if request.method == "POST":
         userId = request.POST.get("userId")
         try:
-            user = AppUser.objects.get(pk=userId)
-        except AppUser.DoesNotExist:
+            user = AppUser.objects.only('id').get(pk=userId)
+        except (AppUser.DoesNotExist, ValueError):
             messages.error(request, 'AppUser does not exist!')
-            return render(request, 'caisse.html', {'products': products})
-
-        total = 0
-        fac = Facture(userId=user)
-        fac.save()  # Save early to generate an ID for ManyToMany relation
-
-        # Process selected products
-        for product in products:
-            if str(product.id) in request.POST.getlist('products'):
-                quantity = int(request.POST.get(f"quantity_{product.id}", 1))
-                total += product.price * quantity
-                transaction = Transaction(productId=product, quantity=quantity)
-                transaction.save()
-                fac.transactionIds.add(transaction)
-
-        # Calculate and assign points
-        points = total // 50  # Assuming integer division for points
-        user.points += points
-        user.save()
+            return render(request, 'caisse.html')
+
+        # Insert the facture, its lines and the points in a fixed number of queries
+        fac = checkout(user, parse_basket(request.POST))
 
         return redirect("facture", fac.id)  # Redirect to a view that shows the facture
 
-    return render(request, 'caisse.html', {'products': products})
+    return render(request, 'caisse.html')
+
+
+def productSearch(request):
+    """
+    Look products up for the caisse screen by barcode/SKU or by words of their name.
+
+    Requires the user to be logged in. The `q` query parameter holds the scanned
+    code or typed text.
+
+    Parameters:
+    request (HttpRequest): The HTTP request object.
+
+    Returns:
+    JsonResponse: Up to 20 matching products, an exact SKU match first.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'status': 'error', 'message': 'Not authenticated'}, status=401)
+    return JsonResponse({'status': 'success', 'data': search_products(request.GET.get('q', ''))})
 
 
             
 
+def checkoutBatch(request):
+    """
+    Settle a batch of baskets uploaded by a POS terminal.
+
+    Requires a staff user. Terminals authenticate with a bearer token
+    (clientsApp.tokens), which is exempt from CSRF; a session POST needs the
+    CSRF token like any form. Accepts a JSON POST of the form
+    {"baskets": [{"key": ..., "userId": ..., "lines": [{"productId": ..., "quantity": ...}]}]}.
+    The whole batch is written in one transaction with bulk inserts; baskets
+    whose key was already recorded are skipped, so a terminal can resend its
+    backlog safely after losing connectivity.
+
+    Parameters:
+    request (HttpRequest): The HTTP request object.
+
+    Returns:
+    JsonResponse: One result per basket: created, duplicate or error.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'status': 'error', 'message': 'Not authenticated'}, status=401)
+    if not request.user.is_staff:
+        return JsonResponse({'status': 'error', 'message': 'Forbidden'}, status=403)
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Only POST method allowed'}, status=405)
+    try:
+        baskets = json.loads(request.body)['baskets']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'status': 'error', 'message': 'Expected a JSON object with a list of baskets'}, status=400)
+    if not isinstance(baskets, list) or len(baskets) > MAX_BATCH:
+        return JsonResponse({'status': 'error', 'message': f'Send a list of at most {MAX_BATCH} baskets'}, status=400)
+    return JsonResponse({'status': 'success', 'results': checkout_batch(baskets)})
+
+
 @login_required(login_url='login')
+@replica_reads
 def facture(request, id):
     """
     Display the details of a specific facture.
 
-    Requires the user to be logged in. Retrieves and displays details of a facture specified by its ID.
+    Requires the user to be logged in. Retrieves and displays details of a facture specified by its ID,
+    from the archive if it has been archived.
 
     Parameters:
     request (HttpRequest): The HTTP request object.
@@ -236,9 +334,11 @@ def facture(request, id):
     Returns:
     HttpResponse: The rendered facture details page.
     """
-    facture = Facture.objects.get(pk=id)
-    transactions = facture.transactionIds.all()
-    total_cost = sum(t.productId.price * t.quantity for t in transactions)
+    found = archive.find(id)
+    if found is None:
+        raise Http404('No such facture')
+    facture, transactions = found
+    total_cost = facture.total_cost
 
     context = {
         'facture': facture,
@@ -289,7 +389,7 @@ def gifts(request):
     Returns:
     HttpResponse: The rendered gifts page.
     """
-    gifts = Gift.objects.all()
+    gifts = Gift.objects.select_related('productId')
     return render(request, 'gifts.html', {'gifts': gifts})
 
     
@@ -370,12 +470,13 @@ def deleteGift(request,id):
         messages.error(request,"Failed to delete the Gift.")
 
 @login_required(login_url='login')
+@replica_reads
 def history(request):
     """
     Display the transaction history.
 
-    Requires the user to be logged in. Retrieves and displays a list of all factures,
-    sorted by date.
+    Requires the user to be logged in. Retrieves and displays one page of factures,
+    newest first. The `cursor` query parameter selects the page.
 
     Parameters:
     request (HttpRequest): The HTTP request object.
@@ -383,16 +484,125 @@ def history(request):
     Returns:
     HttpResponse: The rendered transaction history page.
     """
-    factures = Facture.objects.all().select_related('userId').order_by('-date')
+    factures = paginate(Facture.objects.select_related('userId'), request.GET.get('cursor'), page_size_from(request))
     return render(request, 'history.html', {'factures': factures})
     
 
 @login_required(login_url='login')
+@replica_reads
+def reports(request):
+    """
+    Display revenue per day, per product and per category over a date range.
+
+    Requires a staff user. Reads only the daily rollup tables, so the page
+    costs the same whatever the size of the sales history. The `from` and `to`
+    query parameters (YYYY-MM-DD) default to the last 30 days.
+
+    Parameters:
+    request (HttpRequest): The HTTP request object.
+
+    Returns:
+    HttpResponse: The rendered reports page.
+    """
+    if not request.user.is_staff:
+        raise PermissionDenied
+    try:
+        start, end = _report_range(request)
+    except ValueError:
+        messages.error(request, "Dates must be in YYYY-MM-DD form.")
+        start, end = _report_range(None)
+    days = rollups.sales_by_day(start, end)
+    return render(request, 'reports.html', {
+        'start': start, 'end': end, 'days': days,
+        'products': rollups.sales_by_product(start, end),
+        'categories': rollups.sales_by_category(start, end),
+        'revenue': sum(day['revenue'] for day in days),
+    })
+
+
+@replica_reads
+def salesReport(request):
+    """
+    JSON sales report read from the daily rollups. Staff only.
+
+    Query parameters: `from` and `to` (YYYY-MM-DD, default the last 30 days)
+    and `group`: day (default), product or category.
+
+    Parameters:
+    request (HttpRequest): The HTTP request object.
+
+    Returns:
+    JsonResponse: The rows of the report, each with its quantity and revenue.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'status': 'error', 'message': 'Not authenticated'}, status=401)
+    if not request.user.is_staff:
+        return JsonResponse({'status': 'error', 'message': 'Forbidden'}, status=403)
+    report = {'day': rollups.sales_by_day, 'product': rollups.sales_by_product,
+              'category': rollups.sales_by_category}.get(request.GET.get('group', 'day'))
+    if report is None:
+        return JsonResponse({'status': 'error', 'message': 'group must be day, product or category'}, status=400)
+    try:
+        start, end = _report_range(request)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Dates must be in YYYY-MM-DD form'}, status=400)
+    return JsonResponse({'status': 'success', 'from': start, 'to': end, 'data': report(start, end)})
+
+
+@replica_reads
+def exportData(request, dataset):
+    """
+    Stream factures, facture lines or customers as CSV or JSON Lines for accounting.
+
+    Requires a staff user. Query parameters: `format` (csv, default, or jsonl),
+    `from` and `to` (YYYY-MM-DD, inclusive, default unbounded) and `gzip=1`.
+    The rows are read and sent a chunk at a time; see export.py.
+
+    Parameters:
+    request (HttpRequest): The HTTP request object.
+    dataset (str): factures, lines or customers.
+
+    Returns:
+    StreamingHttpResponse: The export as a file download.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'status': 'error', 'message': 'Forbidden'}, status=403)
+    format = request.GET.get('format', 'csv')
+    if dataset not in export.DATASETS or format not in export.FORMATS:
+        return JsonResponse({'status': 'error', 'message': 'Unknown dataset or format'}, status=404)
+    try:
+        start = date.fromisoformat(request.GET['from']) if request.GET.get('from') else None
+        end = date.fromisoformat(request.GET['to']) if request.GET.get('to') else None
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Dates must be in YYYY-MM-DD form'}, status=400)
+    compress = request.GET.get('gzip') == '1'
+    # Resolved now: the rows are read after the view has returned, outside of replica_reads
+    chunks = export.stream(dataset, format, start, end, compress, using=router.db_for_read(Facture))
+    if isinstance(request, ASGIRequest):
+        chunks = export.as_async(chunks)
+    filename = '-'.join([dataset, *(str(d) for d in (start, end) if d)]) + f'.{format}' + ('.gz' if compress else '')
+    response = StreamingHttpResponse(chunks, content_type='application/gzip' if compress else export.FORMATS[format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _report_range(request):
+    end = timezone.localdate()
+    start = end - timedelta(days=REPORT_DAYS - 1)
+    if request is not None:
+        end = date.fromisoformat(request.GET['to']) if request.GET.get('to') else end
+        start = date.fromisoformat(request.GET['from']) if request.GET.get('from') else start
+    return start, end
+
+
+@login_required(login_url='login')
+@replica_reads
 def inbox(request):
     """
     Display the inbox containing messages.
 
-    Requires the user to be logged in. Retrieves and displays all messages ordered by date.
+    Requires the user to be logged in. Retrieves and displays one page of messages,
+    newest first. The `cursor` query parameter selects the page.
 
     Parameters:
     request (HttpRequest): The HTTP request object.
@@ -400,9 +610,45 @@ def inbox(request):
     Returns:
     HttpResponse: The rendered inbox page.
     """
-    messages = Message.objects.all().order_by('-date').select_related('fromUserId', 'toUserId')
+    messages = paginate(Message.objects.select_related('fromUserId', 'toUserId'), request.GET.get('cursor'), page_size_from(request))
     return render(request, 'inbox.html', {'messages': messages})
 
+async def inboxStream(request):
+    """
+    Push new messages to the inbox page as they arrive.
+
+    Requires a staff user: the inbox holds the messages of every customer.
+    Streams Server-Sent Events for every new message, starting after the `Last-Event-ID` header or `since` parameter. With
+    `transport=poll` it answers as a long-poll instead: it returns as soon as a
+    message is available, or an empty list after the poll timeout.
+
+    Parameters:
+    request (HttpRequest): The HTTP request object.
+
+    Returns:
+    HttpResponse: An event stream, or a JSON list of messages for long-polls.
+    """
+    user = await authenticated_user(request)
+    if user is None:
+        return redirect('login')
+    # A bearer token's TokenUser loads the account on first access, which must not happen on the event loop
+    if not await sync_to_async(lambda: user.is_staff)():
+        raise PermissionDenied
+
+    since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    subscription, backlog = await realtime.subscribe(realtime.INBOX_CHANNEL, lambda: _inbox_since(since))
+
+    if request.GET.get('transport') == 'poll':
+        return JsonResponse({'status': 'success', 'data': await realtime.wait_for_events(subscription, backlog)})
+    return realtime.sse_response(subscription, backlog)
+
+
+def _inbox_since(since):
+    if not since or not since.isdigit():
+        return []
+    messages = Message.objects.select_related('fromUserId').filter(id__gt=int(since)).order_by('id')[:MAX_PAGE_SIZE]
+    return [realtime.message_event(m) for m in messages]
+
 @login_required(login_url='login')
 def sendMessage(request, user_id):
     """
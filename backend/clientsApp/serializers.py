@@ -0,0 +1,229 @@
+"""
+Response shapes of the clientsApp API.
+
+Each shape is described once, as a mapping of output keys to ORM paths, and is
+filled from `.values()` rows, so serializing a list never instantiates model
+objects and every related field is fetched by the JOIN of the same query.
+"""
+from collections import defaultdict
+from django.core.files.storage import default_storage
+from caisseApp.archive import unpack_lines
+from caisseApp.images import variant_urls
+from caisseApp.models import Facture
+
+
+class Field:
+    """
+    One output value read from an ORM path, optionally converted by `transform`.
+    """
+    def __init__(self, path, transform=None):
+        self.path = path
+        self.transform = transform
+
+    def paths(self, prefix):
+        yield _join(prefix, self.path)
+
+    def build(self, row, prefix):
+        value = row[_join(prefix, self.path)]
+        return self.transform(value) if self.transform and value is not None else value
+
+
+class Const:
+    """
+    A fixed output value that needs no column.
+    """
+    def __init__(self, value):
+        self.value = value
+
+    def paths(self, prefix):
+        return ()
+
+    def build(self, row, prefix):
+        return self.value
+
+
+class Combine:
+    """
+    One output value computed by `function` from several ORM paths.
+    """
+    def __init__(self, function, *paths):
+        self.function = function
+        self.sources = paths
+
+    def paths(self, prefix):
+        return [_join(prefix, path) for path in self.sources]
+
+    def build(self, row, prefix):
+        return self.function(*(row[_join(prefix, path)] for path in self.sources))
+
+
+class Nest:
+    """
+    A nested object: `shape` read relative to the ORM path `prefix`.
+    """
+    def __init__(self, prefix, shape):
+        self.prefix = prefix
+        self.shape = shape
+
+    def paths(self, prefix):
+        return self.shape.paths(_join(prefix, self.prefix))
+
+    def build(self, row, prefix):
+        return self.shape.build(row, _join(prefix, self.prefix))
+
+
+class Shape:
+    """
+    An API object shape.
+
+    Keyword arguments map output keys to an ORM path string, a Field, a Const,
+    a Combine or a Nest.
+    """
+    def __init__(self, **fields):
+        self.fields = {key: Field(spec) if isinstance(spec, str) else spec for key, spec in fields.items()}
+
+    def paths(self, prefix=''):
+        return [path for spec in self.fields.values() for path in spec.paths(prefix)]
+
+    def values(self, queryset, *extra):
+        """
+        Restrict a queryset to the columns this shape needs, plus `extra` paths.
+        """
+        return queryset.values(*dict.fromkeys([*self.paths(), *extra]))
+
+    def build(self, row, prefix=''):
+        return {key: spec.build(row, prefix) for key, spec in self.fields.items()}
+
+    def serialize(self, queryset):
+        return [self.build(row) for row in self.values(queryset)]
+
+    def from_instance(self, obj):
+        """
+        Build the shape from an already loaded model instance.
+
+        Foreign keys are read from their `_id` attribute, so this never
+        triggers a query for the flat shapes it is used with.
+        """
+        return self.build({path: _resolve(obj, path) for path in self.paths()})
+
+
+def _join(prefix, path):
+    return f'{prefix}__{path}' if prefix else path
+
+
+def _resolve(obj, path):
+    *relations, name = path.split('__')
+    for relation in relations:
+        obj = getattr(obj, relation)
+    field = obj._meta.get_field(name)
+    return getattr(obj, field.attname)
+
+
+def _media_url(name):
+    return default_storage.url(name)
+
+
+def _image_variants(image, variants_for):
+    # Null until the background resize of the current image has finished
+    return variant_urls(image) if image and image == variants_for else None
+
+
+def _timestamp(date):
+    return date.strftime('%Y-%m-%d %H:%M:%S')
+
+
+PRODUCT = Shape(
+    pk='id',
+    name='name',
+    price='price',
+    description='description',
+    category='category__name',
+    image='image',
+    images=Combine(_image_variants, 'image', 'variants_for'),
+)
+
+GIFT = Shape(
+    id='id',
+    pointCost='pointCost',
+    product=Nest('productId', Shape(
+        id='id',
+        name='name',
+        price='price',
+        category='category__name',
+        description='description',
+        image='image',
+        images=Combine(_image_variants, 'image', 'variants_for'),
+    )),
+)
+
+MESSAGE = Shape(
+    id='id',
+    fromUserId='fromUserId',
+    toUserId='toUserId',
+    fromUsername=Const('FidelEase'),
+    date=Field('date', _timestamp),
+    text='text',
+)
+
+FACTURE = Shape(
+    factureId='id',
+    date='date',
+    totalCost='total_cost',
+    itemCount='item_count',
+    pointsAwarded='points_awarded',
+)
+
+# Read from the Facture/Transaction through table, one row per line
+FACTURE_LINE = Shape(
+    productId='transaction__productId',
+    productName='transaction__productId__name',
+    productPrice='transaction__unit_price',
+    productQuantity='transaction__quantity',
+    productImage=Field('transaction__productId__image', _media_url),
+)
+
+# The FACTURE_LINE paths in the order of an archived line (see caisseApp.archive.pack_lines)
+ARCHIVED_LINE_PATHS = (
+    'transaction__productId', 'transaction__productId__name', 'transaction__productId__image',
+    'transaction__unit_price', 'transaction__quantity', 'transaction__line_total',
+)
+
+# Same layout as django.core.serializers' JSON output, minus the password hash.
+# `points` is the live balance, so the queryset must go through ledger.with_balance.
+USER = Shape(
+    username='username',
+    points='balance',
+    email='email',
+    is_active='is_active',
+    is_superuser='is_superuser',
+    is_staff='is_staff',
+    last_login='last_login',
+)
+
+
+def factures_with_lines(rows):
+    """
+    Serialize facture rows (values() dicts) with their lines, in one extra query.
+
+    Rows of archived factures carry their lines packed in a `lines` column and
+    are unpacked instead of queried.
+
+    Parameters:
+    rows (iterable): Facture rows holding at least the FACTURE paths, plus `lines` for archived ones.
+
+    Returns:
+    list: FACTURE objects, each with a `transactions` list of FACTURE_LINE objects.
+    """
+    rows = list(rows)
+    lines = defaultdict(list)
+    hot = [row['id'] for row in rows if 'lines' not in row]
+    if hot:
+        through = Facture.transactionIds.through.objects.filter(facture_id__in=hot)
+        for line in FACTURE_LINE.values(through, 'facture_id').order_by('transaction_id'):
+            lines[line['facture_id']].append(FACTURE_LINE.build(line))
+    for row in rows:
+        if 'lines' in row:
+            lines[row['id']] = [
+                FACTURE_LINE.build(dict(zip(ARCHIVED_LINE_PATHS, line))) for line in unpack_lines(row['lines'])
+            ]
+    return [dict(FACTURE.build(row), transactions=lines[row['id']]) for row in rows]
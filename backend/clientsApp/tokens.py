@@ -0,0 +1,139 @@
+"""
+Stateless bearer tokens for the mobile API.
+
+An access token is the user id signed with HMAC (django.core.signing) and a
+timestamp; it is checked from its signature alone, so a request that carries
+one never touches the session table and, unless the view needs more than the
+user id, never loads the user either. Access tokens are short-lived. The
+longer-lived refresh token also carries the user's `token_version`, which
+logout increments, so it is checked against the database once per refresh.
+"""
+from asgiref.sync import iscoroutinefunction,markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core import signing
+from django.db.models import F
+from caisseApp.models import AppUser
+
+
+SALT = 'clientsApp.tokens'
+ACCESS = 'a'
+REFRESH = 'r'
+
+
+class TokenUser:
+    """
+    The user of a token-authenticated request.
+
+    `id`/`pk` come from the token; any other attribute loads the AppUser on
+    first use.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id):
+        self.id = self.pk = user_id
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        user = self.__dict__.get('_user')
+        if user is None:
+            user = self.__dict__['_user'] = AppUser.objects.get(pk=self.pk)
+        return getattr(user, name)
+
+    def __str__(self):
+        return str(self.pk)
+
+
+def issue_tokens(user):
+    """
+    Return a fresh access/refresh token pair for `user`, as an API response dict.
+    """
+    return {
+        'access': signing.dumps({'u': user.pk, 't': ACCESS}, salt=SALT),
+        'refresh': signing.dumps({'u': user.pk, 't': REFRESH, 'v': user.token_version}, salt=SALT),
+        'expiresIn': settings.TOKEN_ACCESS_SECONDS,
+    }
+
+
+def access_user_id(token):
+    """
+    Return the user id of a valid, unexpired access token, or None. No query.
+    """
+    payload = _load(token, settings.TOKEN_ACCESS_SECONDS)
+    return payload['u'] if payload and payload.get('t') == ACCESS else None
+
+
+def refresh(token):
+    """
+    Exchange a refresh token for a new token pair.
+
+    Returns:
+    dict: The new tokens, or None if the token is invalid, expired or revoked.
+    """
+    payload = _load(token, settings.TOKEN_REFRESH_SECONDS)
+    if not payload or payload.get('t') != REFRESH:
+        return None
+    user = AppUser.objects.filter(pk=payload['u'], is_active=True).only('id', 'token_version').first()
+    if user is None or user.token_version != payload.get('v'):
+        return None
+    return issue_tokens(user)
+
+
+def revoke(user_id):
+    """
+    Invalidate every refresh token of a user. Access tokens expire on their own.
+    """
+    AppUser.objects.filter(pk=user_id).update(token_version=F('token_version') + 1)
+
+
+def _load(token, max_age):
+    try:
+        payload = signing.loads(token, salt=SALT, max_age=max_age)
+    except signing.BadSignature:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+def _bearer(request):
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return token.strip() if scheme.lower() == 'bearer' else None
+
+
+class TokenAuthenticationMiddleware:
+    """
+    Authenticate requests that carry `Authorization: Bearer <access token>`.
+
+    Must come after AuthenticationMiddleware: it replaces the lazy session
+    user before anything evaluates it, so the session is never read. A
+    request with an invalid or expired token is anonymous; it does not fall
+    back to the session. Token requests carry no ambient credential, so they
+    are exempt from CSRF checks.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        self.authenticate(request)
+        return self.get_response(request)
+
+    async def _acall(self, request):
+        self.authenticate(request)
+        return await self.get_response(request)
+
+    def authenticate(self, request):
+        token = _bearer(request)
+        if token is None:
+            return
+        user_id = access_user_id(token)
+        request.user = TokenUser(user_id) if user_id is not None else AnonymousUser()
+        request.token_auth = True
+        request._dont_enforce_csrf_checks = True
@@ -6,12 +6,15 @@ path('login/', views.login, name = 'login'),
 path('register/', views.register, name = 'register'),
 path('isAuth/', views.isAuth, name = 'isAuth'),
 path('logout/', views.logout, name = 'logout'),
+path('token/', views.token, name = 'token'),
+path('token/refresh/', views.refreshToken, name = 'refreshToken'),
 path('products/', views.products, name = 'products'),
 path('getUserInfo/', views.getUserInfo, name = 'getUserInfo'),
 path('gifts/', views.gifts, name = 'gifts'),
 path('createCode/<int:gift_id>/<int:user_id>/', views.createCode, name='createCode'),
 path('getUserHistory/', views.getUserHistory, name = 'getUserHistory'),
 path('getUserMessages/', views.getUserMessages, name = 'getUserMessages'),
+path('streamMessages/', views.streamMessages, name = 'streamMessages'),
 path('sendMessage/', views.sendMessage, name = 'sendMessage'),
 path('getCategories/', views.getCategories, name='getCategories'),
 
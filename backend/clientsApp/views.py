@@ -1,16 +1,30 @@
-from caisseApp.models import Product,AppUser,Code,Gift,Message,Facture,Category
+from caisseApp.models import Product,AppUser,Gift,Message,Facture,Category,ArchivedFacture
+from caisseApp.pagination import paginate,page_size_from,MAX_PAGE_SIZE
+from caisseApp import realtime
+from caisseApp.realtime import authenticated_user
+from caisseApp.catalog import catalog_response
+from caisseApp.archive import paginate_with_archive
+from caisseApp.codes import redeem
+from caisseApp.ledger import with_balance
+from caisseApp.routing import replica_reads
+from . import tokens
+from .serializers import FACTURE,GIFT,MESSAGE,PRODUCT,USER,factures_with_lines
 from django.http import JsonResponse
 from django.contrib.auth import authenticate, login as loginUser
 from django.views.decorators.csrf import csrf_exempt
 import json
-from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth import logout as logoutUser
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 
 
 # is authentified----------------------------------------------------------------------------
 def isAuth(request):
+    # With a bearer token this is answered from its signature alone, without any query
     if request.user.is_authenticated:
         return JsonResponse({'auth': True})
     else:
@@ -19,7 +33,6 @@ def isAuth(request):
 # register----------------------------------------------------------------------------
 @csrf_exempt
 def register(request):
-    print("register called from app")
     if request.method == 'POST':
         data = json.loads(request.body)
         username = data.get('username')
@@ -56,11 +69,41 @@ def login(request):
     else: 
         return JsonResponse({'status': 'error', 'message': 'Only POST method allowed'})
 
+
+# token login----------------------------------------------------------------------------
+@csrf_exempt
+def token(request):
+    """
+    Log in without a session: exchange credentials for an access and a refresh token.
+
+    The access token goes in an `Authorization: Bearer` header on later calls.
+    """
+    if request.method != "POST":
+        return JsonResponse({'status': 'error', 'message': 'Only POST method allowed'})
+    data = json.loads(request.body)
+    user = authenticate(request, username=data.get('username'), password=data.get('password'))
+    if not user:
+        return JsonResponse({'status': 'error', 'message': 'Invalid credentials'})
+    return JsonResponse({'status': 'success', **tokens.issue_tokens(user)})
+
+
+# refresh the token pair----------------------------------------------------------------------------
+@csrf_exempt
+def refreshToken(request):
+    if request.method != "POST":
+        return JsonResponse({'status': 'error', 'message': 'Only POST method allowed'})
+    pair = tokens.refresh(json.loads(request.body).get('refresh') or '')
+    if pair is None:
+        return JsonResponse({'status': 'error', 'message': 'Invalid or expired refresh token'}, status=401)
+    return JsonResponse({'status': 'success', **pair})
+
         
 # get the user info----------------------------------------------------------------------------
 def getUserInfo(request):
-    user = request.user
-    user_json = serializers.serialize('json', [user, ])
+    user_json = json.dumps([
+        {'model': 'caisseApp.appuser', 'pk': row['id'], 'fields': USER.build(row)}
+        for row in USER.values(with_balance(AppUser.objects.filter(pk=request.user.id)), 'id')
+    ], cls=DjangoJSONEncoder)
     return JsonResponse({'user': user_json}) 
 
 
@@ -69,6 +112,10 @@ def getUserInfo(request):
 
 @csrf_exempt
 def logout(request):
+    if getattr(request, 'token_auth', False):
+        if request.user.is_authenticated:
+            tokens.revoke(request.user.id)
+        return JsonResponse({'status': 'success', 'message': 'Logged out successfully'})
     logoutUser(request)
     return JsonResponse({'status': 'success', 'message': 'Logged out successfully'})
 
@@ -76,53 +123,28 @@ def logout(request):
 # create a code----------------------------------------------------------------------------
 def createCode(request, gift_id, user_id):
     try:
-        # Get gift and user objects
-        gift = Gift.objects.get(pk=gift_id)
-        user = AppUser.objects.get(pk=user_id)
-
-        # Check if the user has enough points
-        if user.points >= gift.pointCost:
-            # na9ass the points from the user
-            user.points -= gift.pointCost
-            user.save()
+        # Retries from the app send the same key and get the same code back, without a second charge
+        key = request.headers.get('Idempotency-Key') or request.GET.get('idempotencyKey')
+        cid, replayed = redeem(gift_id, user_id, key)
 
-            # Create a new code 
-            code = Code.objects.create(giftId=gift, userId=user)
-
-            # Return the id of the created code
-            return JsonResponse({'status': 'success', 'code_id': code.pk})
-        else:
-            return JsonResponse({'status': 'error', 'message': 'Not enough points to redeem this gift.'})
+        # Return the id of the created code
+        return JsonResponse({'status': 'success', 'code_id': cid, 'replayed': replayed})
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)})
 
 
 # get user history----------------------------------------------------------------------------
+@replica_reads
 def getUserHistory(request):
     try:
         user_id = request.user.id
-        factures = Facture.objects.filter(userId=user_id).prefetch_related('transactionIds', 'transactionIds__productId')
+        # Old factures live in the archive, which continues the listing where the hot rows end
+        factures = paginate_with_archive(FACTURE.values(Facture.objects.filter(userId=user_id)),
+                                         FACTURE.values(ArchivedFacture.objects.filter(userId=user_id), 'lines'),
+                                         request.GET.get('cursor'), page_size_from(request))
+        facture_data = factures_with_lines(factures)
         
-        facture_data = []
-        for facture in factures:
-            transactions_data = []
-            for transaction in facture.transactionIds.all():
-                transaction_data = {
-                    'productId': transaction.productId.id,
-                    'productName': transaction.productId.name,
-                    'productPrice': transaction.productId.price,
-                    'productQuantity': transaction.quantity,
-                    'productImage': transaction.productId.image.url,
-                }
-                transactions_data.append(transaction_data)
-            
-            facture_data.append({
-                'factureId': facture.pk,
-                'date': facture.date,
-                'transactions': transactions_data,
-            })
-        
-        return JsonResponse({'status': 'success', 'data': facture_data})
+        return JsonResponse({'status': 'success', 'data': facture_data, 'next': factures.next, 'prev': factures.prev})
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)})
 
@@ -130,28 +152,71 @@ def getUserHistory(request):
 # get user messages----------------------------------------------------------------------------
 def getUserMessages(request):
     try:
-        messages = Message.objects.all().order_by('-date')
-        messages_data = [{
-            'id': message.id,
-            'fromUserId': message.fromUserId.id,
-            'toUserId': message.toUserId.id,
-            'fromUsername': 'FidelEase',
-            'date': message.date.strftime('%Y-%m-%d %H:%M:%S'),
-            'text': message.text,
-        } for message in messages]
-
-        return JsonResponse({'status': 'success', 'data': messages_data})
+        user_id = request.user.id
+        # Only the user's own conversation, served by the (toUserId, date) and (fromUserId, date) indexes
+        conversation = MESSAGE.values(Message.objects.filter(Q(toUserId=user_id) | Q(fromUserId=user_id)))
+
+        since = request.GET.get('since')
+        if since is not None:
+            # Delta mode for polling: everything newer than what the app already has, oldest first
+            newer = _newer_than(since)
+            if newer is None:
+                return JsonResponse({'status': 'error', 'message': 'Invalid since parameter'})
+            messages = list(conversation.filter(newer).order_by('date', 'id')[:page_size_from(request, MAX_PAGE_SIZE)])
+            latest = messages[-1]['id'] if messages else (int(since) if since.isdigit() else None)
+            return JsonResponse({'status': 'success', 'data': [MESSAGE.build(m) for m in messages], 'latest': latest})
+
+        messages = paginate(conversation, request.GET.get('cursor'), page_size_from(request))
+        messages_data = [MESSAGE.build(message) for message in messages]
+
+        return JsonResponse({'status': 'success', 'data': messages_data, 'next': messages.next, 'prev': messages.prev})
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)})
 
+
+def _newer_than(since):
+    if since.isdigit():
+        return Q(id__gt=int(since))
+    date = parse_datetime(since)
+    if date is None:
+        return None
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return Q(date__gt=date)
+
+
+# stream new messages (Server-Sent Events, or long-poll with transport=poll)------------------
+async def streamMessages(request):
+    user = await authenticated_user(request)
+    if user is None:
+        return JsonResponse({'status': 'error', 'message': 'Not authenticated'}, status=401)
+
+    since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    subscription, backlog = await realtime.subscribe(realtime.user_channel(user.id),
+                                                     lambda: _messages_since(user.id, since) if since else [])
+
+    if request.GET.get('transport') == 'poll':
+        messages = await realtime.wait_for_events(subscription, backlog)
+        latest = messages[-1]['id'] if messages else (int(since) if since and since.isdigit() else None)
+        return JsonResponse({'status': 'success', 'data': messages, 'latest': latest})
+    return realtime.sse_response(subscription, backlog)
+
+
+def _messages_since(user_id, since):
+    newer = _newer_than(since)
+    if newer is None:
+        return []
+    messages = Message.objects.filter(Q(toUserId=user_id) | Q(fromUserId=user_id)).filter(newer)
+    return MESSAGE.serialize(messages.order_by('date', 'id')[:MAX_PAGE_SIZE])
+
 # get categorie----------------------------------------------------------------------------
 def getCategories(request):
-    try:
-        categories = Category.objects.all()
-        category_names = [category.name for category in categories]
-        return JsonResponse({'status': 'success', 'categories': category_names})
-    except Exception as e:
-        return JsonResponse({'status': 'error', 'message': str(e)})
+    return catalog_response(request, 'categories', _categories_payload)
+
+
+def _categories_payload():
+    category_names = list(Category.objects.values_list('name', flat=True))
+    return {'status': 'success', 'categories': category_names}
 
 
 # send a message----------------------------------------------------------------------------
@@ -160,11 +225,11 @@ def sendMessage(request):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
-            from_user = request.user
             to_user = AppUser.objects.get(pk=1)
             text = data.get('text', None)
 
-            Message.objects.create(fromUserId=from_user, toUserId=to_user, text=text)
+            # By id: with token auth request.user is a TokenUser, not a loaded AppUser
+            Message.objects.create(fromUserId_id=request.user.id, toUserId=to_user, text=text)
 
             return JsonResponse({'status': 'success', 'message': 'Message sent successfully'})
 
@@ -175,41 +240,16 @@ def sendMessage(request):
 
 # get all products----------------------------------------------------------------------------
 def products(request):
-    products = Product.objects.select_related('category').all()
-    
-    # Create a custom list with category name
-    products_data = []
-    for product in products:
-        product_data = {
-            'pk': product.pk,
-            'name': product.name,
-            'price': product.price,
-            'description': product.description,
-            'category': product.category.name,  
-            'image': str(product.image),
-        }
-        products_data.append(product_data)
-    
-    return JsonResponse({'status': 'success', 'data': products_data})
+    return catalog_response(request, 'products', _products_payload)
+
+
+def _products_payload():
+    return {'status': 'success', 'data': PRODUCT.serialize(Product.objects.all())}
 
 # Get all gifts----------------------------------------------------------------------------
 def gifts(request):
-    gifts = Gift.objects.all()
-    gift_list = []
-    for gift in gifts:
-        product = gift.productId
-        gift_data = {
-            "id": gift.pk,
-            "pointCost": gift.pointCost,
-            "product": {
-                "id": product.pk,
-                "name": product.name,
-                "price": product.price,
-                "category": product.category.name,
-                "description": product.description,
-                "image": str(product.image),
-            },
-        }
-        gift_list.append(gift_data)
-
-    return JsonResponse({'status': 'success', 'data': gift_list})
\ No newline at end of file
+    return catalog_response(request, 'gifts', _gifts_payload)
+
+
+def _gifts_payload():
+    return {'status': 'success', 'data': GIFT.serialize(Gift.objects.all())}
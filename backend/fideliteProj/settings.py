@@ -46,11 +46,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'caisseApp.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'clientsApp.tokens.TokenAuthenticationMiddleware',
+    'caisseApp.routing.ReplicaStickinessMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -79,13 +82,50 @@ WSGI_APPLICATION = 'fideliteProj.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# caisseApp.sqlite: write transactions take the lock at BEGIN IMMEDIATE, where busy_timeout
+# queues them, instead of failing mid-transaction. WAL, which lets readers run alongside a
+# writer, is stored in the database file and set once by migration caisseApp 0015.
+SQLITE_OPTIONS = {
+    'transaction_mode': 'IMMEDIATE',
+    'timeout': 5,
+    'pragmas': {
+        'synchronous': 'NORMAL',   # Durable across crashes of the app in WAL mode; only an OS crash may lose the last commits
+        'busy_timeout': 5000,      # ms
+        'cache_size': -20000,      # KiB, per connection
+        'mmap_size': 268435456,    # 256 MiB
+        'temp_store': 'MEMORY',
+    },
+}
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'ENGINE': 'caisseApp.sqlite',
+        'NAME': os.environ.get('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+        'OPTIONS': SQLITE_OPTIONS,
+        # A connection per request: the ASGI streaming views would hold a persistent one for
+        # the whole stream. Opening a SQLite connection costs a few pragmas.
+        'CONN_MAX_AGE': 0,
+        # A file rather than the in-memory default, so tests run in WAL mode with real locking
+        'TEST': {'NAME': BASE_DIR / 'test-db.sqlite3'},
+    },
+    # Read replica (caisseApp.routing). Locally it is a second SQLite file refreshed from the
+    # primary with `manage.py sync_replica`; tests do the same with their own pair of files,
+    # so they see the replica lag.
+    'replica': {
+        'ENGINE': 'caisseApp.sqlite',
+        'NAME': os.environ.get('REPLICA_DB_NAME', BASE_DIR / 'db-replica.sqlite3'),
+        'OPTIONS': SQLITE_OPTIONS,
+        'CONN_MAX_AGE': 0,
+        'TEST': {'NAME': BASE_DIR / 'test-db-replica.sqlite3'},
+    },
 }
 
+DATABASE_ROUTERS = ['caisseApp.routing.PrimaryReplicaRouter']
+# Aliases the replica_reads views may read from; empty sends every read to the primary
+DATABASE_REPLICAS = [alias for alias in os.environ.get('DATABASE_REPLICAS', '').split(',') if alias]
+# How long a client that wrote keeps reading from the primary, longer than the replication lag
+REPLICA_STICKY_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -125,6 +165,32 @@ STATIC_URL = 'static/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'uploads')
 MEDIA_URL = '/media/'
+# Uploads are served by caisseApp.media. Behind nginx set MEDIA_SENDFILE=x-accel-redirect and map
+# MEDIA_ACCEL_PREFIX to MEDIA_ROOT as an internal location; Apache/lighttpd use x-sendfile.
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE') or None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+
+# Catalog payloads and their version counter live here (caisseApp.catalog). With several
+# workers point this at a shared backend so a bump in one worker is seen by all of them.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'fidelease'),
+    }
+}
+
+# Request metrics (caisseApp.metrics), served at /metrics. With several workers, give them a
+# shared METRICS_DIR so the endpoint sums all of them. SLOW_REQUEST_SECONDS enables the slow log.
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+SLOW_REQUEST_SECONDS = float(os.environ['SLOW_REQUEST_SECONDS']) if os.environ.get('SLOW_REQUEST_SECONDS') else None
+
+# Factures older than this many days are moved to the archive by `manage.py archive_factures`
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 730))
+
+# Bearer tokens of the mobile API (clientsApp.tokens)
+TOKEN_ACCESS_SECONDS = 15 * 60
+TOKEN_REFRESH_SECONDS = 30 * 24 * 60 * 60
 
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 # Default primary key field type
@@ -133,3 +199,8 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 AUTH_USER_MODEL = 'caisseApp.AppUser'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Real-time chat push (caisseApp.realtime). LocalBackend only reaches clients of the
+# same worker; with several ASGI workers use BrokerBackend and run `manage.py runbroker`.
+PUBSUB_BACKEND = os.environ.get('PUBSUB_BACKEND', 'caisseApp.realtime.LocalBackend')
+PUBSUB_BROKER = ('127.0.0.1', 8765)
@@ -15,16 +15,15 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path,include
-from django.conf.urls.static import static
+from django.urls import path,include,re_path
+from caisseApp import media,metrics
 from fideliteProj import settings
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('clientsApp/', include('clientsApp.urls')),
-    path('caisseApp/', include('caisseApp.urls'))
+    path('caisseApp/', include('caisseApp.urls')),
+    path('metrics', metrics.metrics, name='metrics'),
+    re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), media.serve, name='media'),
     
-]
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+]
\ No newline at end of file